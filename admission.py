@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+接口准入控制与降载
+按接口类别 (文本搜索 / 图片OCR) 分别限制并发数和排队长度，排队超过时间预算的请求快速失败，
+避免拍照搜题的突发流量拖慢文本搜索
+可选: 设置 RATE_LIMIT_REDIS_URL 后按客户端使用Redis令牌桶限流
+"""
+
+import os
+import math
+import time
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 接口类别 -> (默认并发数, 默认最大排队数, 默认排队时间预算毫秒)
+ADMISSION_DEFAULTS = {
+    "text": (32, 128, 200),    # /search/text
+    "image": (4, 16, 1000),    # /search/image, /search/image/analysis, /ocr
+}
+
+# 路径前缀 -> 接口类别 (按顺序匹配)
+ADMISSION_ROUTES = (
+    ("/search/text", "text"),
+    ("/search/image", "image"),
+    ("/ocr", "image"),
+)
+
+# 令牌桶: 补充令牌、扣减并返回 {是否允许, 剩余令牌}
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1]) or burst
+local ts = tonumber(data[2]) or now
+tokens = math.min(burst, tokens + math.max(now - ts, 0) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+
+class AdmissionRejected(Exception):
+    """请求未被准入"""
+
+    def __init__(self, reason: str, status_code: int, retry_after: int, detail: str):
+        super().__init__(detail)
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+class AdmissionClass:
+    """一个接口类别的并发限制和有界等待队列"""
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, max_wait_ms: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait_ms = max_wait_ms
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._waiting = 0
+        self._active = 0
+        self._admitted = 0
+        self._rejected = 0
+
+    @property
+    def retry_after(self) -> int:
+        """建议客户端重试间隔 (秒)"""
+        return max(1, math.ceil(self.max_wait_ms / 1000))
+
+    async def acquire(self) -> float:
+        """等待执行名额，返回排队时间 (秒)；队列已满或超过时间预算时抛出 AdmissionRejected"""
+        start = time.perf_counter()
+
+        if self._semaphore.locked():
+            if self._waiting >= self.max_queue:
+                self._rejected += 1
+                raise AdmissionRejected(
+                    "queue_full", 503, self.retry_after,
+                    f"{self.name} 类请求排队已满 ({self.max_queue})"
+                )
+
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_wait_ms / 1000)
+            except asyncio.TimeoutError:
+                self._rejected += 1
+                raise AdmissionRejected(
+                    "queue_timeout", 503, self.retry_after,
+                    f"{self.name} 类请求排队超过 {self.max_wait_ms:.0f}ms"
+                )
+            finally:
+                self._waiting -= 1
+        else:
+            await self._semaphore.acquire()
+
+        self._active += 1
+        self._admitted += 1
+        return time.perf_counter() - start
+
+    def release(self):
+        self._active -= 1
+        self._semaphore.release()
+
+    def get_stats(self) -> Dict[str, float]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "max_wait_ms": self.max_wait_ms,
+            "active": self._active,
+            "waiting": self._waiting,
+            "admitted": self._admitted,
+            "rejected": self._rejected,
+        }
+
+
+class RateLimiter:
+    """基于Redis的客户端令牌桶 (按接口类别分别计数)"""
+
+    def __init__(self, redis_url: str):
+        import redis.asyncio as aioredis
+        self.redis = aioredis.from_url(redis_url)
+        self._script = self.redis.register_script(TOKEN_BUCKET_SCRIPT)
+        self.limits: Dict[str, Tuple[float, float]] = {}
+        for name in ADMISSION_DEFAULTS:
+            rate = float(os.getenv(f"RATE_LIMIT_{name.upper()}_PER_SEC", "0"))
+            if rate > 0:
+                burst = float(os.getenv(f"RATE_LIMIT_{name.upper()}_BURST", str(max(rate * 2, 1))))
+                self.limits[name] = (rate, burst)
+
+    async def check(self, class_name: str, client_id: str):
+        """超过限额时抛出 AdmissionRejected (429)；Redis不可用时放行"""
+        if class_name not in self.limits:
+            return
+
+        rate, burst = self.limits[class_name]
+        try:
+            allowed, tokens = await self._script(
+                keys=[f"ratelimit:{class_name}:{client_id}"],
+                args=[rate, burst, time.time()]
+            )
+        except Exception as e:
+            logger.warning(f"限流检查失败，放行: {e}")
+            return
+
+        if not int(allowed):
+            retry_after = max(1, math.ceil((1 - float(tokens)) / rate))
+            raise AdmissionRejected(
+                "rate_limited", 429, retry_after,
+                f"请求过于频繁，请 {retry_after} 秒后重试"
+            )
+
+    async def close(self):
+        await self.redis.close()
+
+
+class AdmissionController:
+    """按接口类别准入请求"""
+
+    def __init__(self):
+        self.classes: Dict[str, AdmissionClass] = {}
+        for name, (default_concurrent, default_queue, default_wait) in ADMISSION_DEFAULTS.items():
+            prefix = f"ADMISSION_{name.upper()}"
+            self.classes[name] = AdmissionClass(
+                name,
+                max_concurrent=int(os.getenv(f"{prefix}_CONCURRENCY", default_concurrent)),
+                max_queue=int(os.getenv(f"{prefix}_QUEUE", default_queue)),
+                max_wait_ms=float(os.getenv(f"{prefix}_WAIT_MS", default_wait)),
+            )
+
+        self.rate_limiter: Optional[RateLimiter] = None
+        redis_url = os.getenv("RATE_LIMIT_REDIS_URL", "")
+        if redis_url:
+            try:
+                self.rate_limiter = RateLimiter(redis_url)
+            except Exception as e:
+                logger.warning(f"⚠️  客户端限流不可用: {e}")
+
+    @staticmethod
+    def classify(path: str) -> Optional[str]:
+        """请求路径所属的接口类别 (不受限的接口返回None)"""
+        for prefix, name in ADMISSION_ROUTES:
+            if path.startswith(prefix):
+                return name
+        return None
+
+    async def admit(self, class_name: str, client_id: str) -> float:
+        """限流检查并等待执行名额，返回排队时间 (秒)"""
+        if self.rate_limiter is not None:
+            await self.rate_limiter.check(class_name, client_id)
+        return await self.classes[class_name].acquire()
+
+    def release(self, class_name: str):
+        self.classes[class_name].release()
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        return {name: admission.get_stats() for name, admission in self.classes.items()}
+
+    async def close(self):
+        if self.rate_limiter is not None:
+            await self.rate_limiter.close()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+向量模型后端基准测试
+对比当前PyTorch模型与ONNX/量化后端的编码延迟和top-k结果一致性
+
+用法:
+    EMBEDDING_MODEL_DIR=./models/all-MiniLM-L6-v2-onnx python benchmark_embedding.py onnx
+    python benchmark_embedding.py quantized
+"""
+
+import sys
+import json
+import time
+
+import numpy as np
+
+from embedding_backend import load_embedding_model
+
+CORPUS_FILE = "caie_math_questions.json"
+TOP_K = 10
+
+TEST_QUERIES = [
+    "differentiate",
+    "integrate",
+    "solve equation",
+    "find the derivative of x^2",
+    "the line y=mx-3 and the curve y=2x^2+5 do not meet",
+    "Find the equation of the curve",
+    "sin 2x + cos x = 0",
+    "geometric progression sum to infinity",
+]
+
+
+def load_corpus():
+    """加载导出的题库"""
+    with open(CORPUS_FILE, "r", encoding="utf-8") as f:
+        return [item["content"] for item in json.load(f)]
+
+
+def measure_latency(model, queries, rounds: int = 5):
+    """单条查询编码延迟 (毫秒)"""
+    model.encode(queries[0])  # 预热
+    latencies = []
+    for _ in range(rounds):
+        for query in queries:
+            start = time.perf_counter()
+            model.encode(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(latencies)
+
+
+def top_k(query_vectors, corpus_vectors, k):
+    """余弦相似度top-k (向量已归一化)"""
+    scores = query_vectors @ corpus_vectors.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def main():
+    backend = sys.argv[1] if len(sys.argv) > 1 else "onnx"
+
+    print(f"🚀 向量模型基准测试: torch vs {backend}")
+    print("=" * 50)
+
+    corpus = load_corpus()
+    queries = TEST_QUERIES + corpus[::40]  # 混合人工查询与题库片段
+    print(f"📚 题库: {len(corpus)} 题, 查询: {len(queries)} 条")
+
+    baseline = load_embedding_model("torch")
+    candidate = load_embedding_model(backend)
+
+    # 1. 延迟
+    base_lat = measure_latency(baseline, queries)
+    cand_lat = measure_latency(candidate, queries)
+    print("\n⚡ 单条编码延迟 (ms)")
+    print(f"   torch:      p50={np.percentile(base_lat, 50):.2f}  p95={np.percentile(base_lat, 95):.2f}")
+    print(f"   {backend:<10}  p50={np.percentile(cand_lat, 50):.2f}  p95={np.percentile(cand_lat, 95):.2f}")
+    print(f"   加速比: {np.percentile(base_lat, 50) / np.percentile(cand_lat, 50):.2f}x")
+
+    # 2. 向量一致性
+    base_q = np.asarray(baseline.encode(queries, normalize_embeddings=True), dtype=np.float32)
+    cand_q = np.asarray(candidate.encode(queries, normalize_embeddings=True), dtype=np.float32)
+    assert cand_q.shape[1] == base_q.shape[1], "向量维度不一致"
+    cosine = np.sum(base_q * cand_q, axis=1)
+    print(f"\n📐 同一查询向量余弦相似度: mean={cosine.mean():.4f}  min={cosine.min():.4f}")
+
+    # 3. top-k一致性 (各自编码题库)
+    base_c = np.asarray(baseline.encode(corpus, normalize_embeddings=True), dtype=np.float32)
+    cand_c = np.asarray(candidate.encode(corpus, normalize_embeddings=True), dtype=np.float32)
+    base_top = top_k(base_q, base_c, TOP_K)
+    cand_top = top_k(cand_q, cand_c, TOP_K)
+
+    overlaps = [len(set(b) & set(c)) / TOP_K for b, c in zip(base_top, cand_top)]
+    top1 = np.mean(base_top[:, 0] == cand_top[:, 0])
+    print(f"\n🎯 top-{TOP_K}重合率: {np.mean(overlaps):.3f}  top-1一致率: {top1:.3f}")
+
+    print("\n" + "=" * 50)
+    print("🎉 基准测试完成!")
+
+
+if __name__ == "__main__":
+    main()
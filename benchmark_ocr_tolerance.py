@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+OCR容错搜索评估
+对比 fuzziness AUTO 模糊子句 (full) 与字符trigram子句 (ocr) 在含OCR错误的查询上的召回率和延迟
+- 合成噪声: 题库题干加入OCR常见错误 (词粘连、l/1、O/0、rn/m 混淆、漏字)，目标题目已知
+- 真实OCR: img1.jpg / img2.jpg 的识别文本 (需要PaddleOCR)，只输出各模式的top-3
+
+用法:
+    python benchmark_ocr_tolerance.py [噪声比例] [top-k]
+    SEARCH_BACKEND=local python benchmark_ocr_tolerance.py 0.08 5   # 本地BM25索引
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+
+import numpy as np
+
+CORPUS_FILE = "caie_math_questions.json"
+SAMPLE_QUERIES = 50
+QUERY_WORDS = 20
+IMAGES = ["img1.jpg", "img2.jpg"]
+
+# OCR常见的字符混淆
+CONFUSIONS = {"l": "1", "1": "l", "O": "0", "0": "O", "rn": "m", "m": "rn", "e": "c", "S": "5", "I": "l", "x": "×"}
+
+
+def add_ocr_noise(text: str, rate: float, rng: random.Random) -> str:
+    """按比例注入OCR错误"""
+    words = text.split()
+    noisy = []
+    for word in words:
+        if rng.random() < rate:
+            for source, target in CONFUSIONS.items():
+                if source in word:
+                    word = word.replace(source, target, 1)
+                    break
+        if len(word) > 3 and rng.random() < rate / 2:
+            i = rng.randrange(len(word))
+            word = word[:i] + word[i + 1:]
+        # 词粘连: 与前一个词合并
+        if noisy and rng.random() < rate:
+            noisy[-1] += word
+        else:
+            noisy.append(word)
+    return " ".join(noisy)
+
+
+def load_queries(rate: float):
+    """(含噪声的查询, 目标题目ID)"""
+    with open(CORPUS_FILE, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+    # 只取有足够文字的题目 (跳过答题纸、空白页等重复页面)
+    candidates, seen = [], set()
+    for q in questions:
+        words = [w for w in q["content"].split() if any(c.isalpha() for c in w)][:QUERY_WORDS]
+        text = " ".join(words)
+        if len(words) >= QUERY_WORDS // 2 and text not in seen:
+            seen.add(text)
+            candidates.append((text, q["id"]))
+
+    rng = random.Random(42)
+    sampled = rng.sample(candidates, min(SAMPLE_QUERIES, len(candidates)))
+    queries = [(add_ocr_noise(text, rate, rng), question_id) for text, question_id in sampled]
+    return queries
+
+
+def create_service():
+    if os.getenv("SEARCH_BACKEND", "elasticsearch") == "local":
+        from local_search_service import LocalSearchService
+        return LocalSearchService()
+    from search_service import SearchService
+    return SearchService(os.getenv("ELASTICSEARCH_URL", "http://localhost:9200"))
+
+
+async def timed_search(service, query, limit, mode):
+    # SearchService 绕过singleflight直接执行
+    search = getattr(service, "_search_by_text", service.search_by_text)
+    start = time.perf_counter()
+    results = await search(query, limit=limit, mode=mode)
+    return [r.id for r in results], (time.perf_counter() - start) * 1000
+
+
+async def ocr_image_queries():
+    """用OCR服务识别测试图片 (PaddleOCR不可用时跳过)"""
+    try:
+        from PIL import Image
+        from ocr_service import OCRService
+        ocr_service = OCRService()
+    except Exception as e:
+        print(f"⚠️  OCR服务不可用，跳过真实图片: {e}")
+        return []
+
+    queries = []
+    for path in IMAGES:
+        if os.path.exists(path):
+            result = await ocr_service.extract_text(Image.open(path))
+            queries.append((path, result["original_text"]))
+    return queries
+
+
+async def main():
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else 0.08
+    top_k = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    service = create_service()
+    await service.initialize()
+    queries = load_queries(rate)
+    print(f"🧪 OCR容错评估: {len(queries)} 个查询, 噪声比例 {rate}, top-{top_k}")
+    print(f"   示例: {queries[0][0][:80]}")
+
+    for mode in ("full", "ocr"):
+        hits, reciprocal_ranks, latencies = 0, [], []
+        for query, target in queries:
+            ids, latency = await timed_search(service, query, top_k, mode)
+            latencies.append(latency)
+            if target in ids:
+                hits += 1
+                reciprocal_ranks.append(1 / (ids.index(target) + 1))
+            else:
+                reciprocal_ranks.append(0.0)
+
+        print(
+            f"📊 {mode:<5} recall@{top_k} {hits / len(queries):.3f}  MRR {np.mean(reciprocal_ranks):.3f}  "
+            f"p50 {np.percentile(latencies, 50):.1f}ms  p95 {np.percentile(latencies, 95):.1f}ms"
+        )
+
+    for path, text in await ocr_image_queries():
+        print(f"\n🖼️  {path}: {text[:80]}")
+        for mode in ("full", "ocr"):
+            ids, latency = await timed_search(service, text, 3, mode)
+            print(f"   {mode:<5} {latency:6.1f}ms  {ids}")
+
+    await service.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+向量量化存储评估
+在 caie_math_questions.json 上对比 float32 / float16 / int8 向量存储的大小和检索精度
+- 本地向量索引: 文件大小、与float32向量的余弦偏差、题目间top-k近邻重合度
+- ES: dense_vector float / byte 的doc values大小和 _source 中JSON的大小
+
+用法:
+    python benchmark_quantization.py [top-k]
+    VECTOR_INDEX_PATH=./vector_index python benchmark_quantization.py   # 复用已有的float32索引
+"""
+
+import os
+import sys
+import json
+
+import numpy as np
+
+from vector_index import quantize_int8, load_vector_index
+
+CORPUS_FILE = "caie_math_questions.json"
+
+
+def load_float32_vectors():
+    """优先复用float32向量索引，否则用当前向量模型编码题库"""
+    index = load_vector_index()
+    if index is not None and index.vectors.dtype == np.float32:
+        print(f"📂 使用已有向量索引: {os.getenv('VECTOR_INDEX_PATH')}")
+        return np.asarray(index.vectors, dtype=np.float32)
+
+    from embedding_backend import load_embedding_model
+
+    with open(CORPUS_FILE, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+    print(f"🔨 编码 {len(questions)} 个题目...")
+    vectors = load_embedding_model().encode([q["content"] for q in questions], batch_size=64)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def dequantize(vectors: np.ndarray, dtype: str):
+    """按存储类型往返转换，返回 (还原后的float32向量, 存储字节数)"""
+    if dtype == "float32":
+        return vectors, vectors.nbytes
+    if dtype == "float16":
+        stored = vectors.astype(np.float16)
+        return stored.astype(np.float32), stored.nbytes
+    quantized, scales = quantize_int8(vectors)
+    return quantized.astype(np.float32) * scales[:, np.newaxis], quantized.nbytes + scales.nbytes
+
+
+def neighbour_overlap(reference: np.ndarray, candidate: np.ndarray, k: int) -> float:
+    """以float32向量为查询、在量化后的题库中检索，top-k近邻 (排除自身) 与float32结果的平均重合度"""
+    def top_k(vectors):
+        normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        scores = reference @ normalized.T
+        np.fill_diagonal(scores, -np.inf)
+        return np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+    ref_top = top_k(reference)
+    cand_top = top_k(candidate)
+    overlaps = [len(set(a) & set(b)) / k for a, b in zip(ref_top, cand_top)]
+    return float(np.mean(overlaps))
+
+
+def main():
+    k = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    vectors = load_float32_vectors()
+    count, dim = vectors.shape
+    print(f"🧪 向量量化评估: {count} 个向量, dim={dim}, top-{k}")
+
+    print("\n📊 本地向量索引")
+    baseline_bytes = vectors.nbytes
+    for dtype in ("float32", "float16", "int8"):
+        restored, size = dequantize(vectors, dtype)
+        cosine = np.sum(restored * vectors, axis=1) / np.linalg.norm(restored, axis=1)
+        overlap = neighbour_overlap(vectors, restored, k)
+        print(
+            f"   {dtype:<8} {size / 1024:>8.1f} KB ({baseline_bytes / size:.1f}x)  "
+            f"余弦偏差 平均 {1 - cosine.mean():.2e} 最大 {1 - cosine.min():.2e}  top-{k}重合 {overlap:.3f}"
+        )
+
+    print("\n📊 Elasticsearch dense_vector")
+    float_source = np.mean([len(json.dumps(v.tolist())) for v in vectors])
+    byte_source = np.mean([len(json.dumps(quantize_int8(v)[0][0].tolist())) for v in vectors])
+    print(f"   float: doc values {dim * 4} 字节/文档, _source JSON {float_source:.0f} 字节/文档")
+    print(f"   byte:  doc values {dim} 字节/文档, _source JSON {byte_source:.0f} 字节/文档")
+    print(f"   按 {count} 个题目: {count * (dim * 4 + float_source) / 1024 / 1024:.2f} MB → "
+          f"{count * (dim + byte_source) / 1024 / 1024:.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+两阶段搜索召回率评估
+对比 rerank 模式 (词法top-N + 本地重排) 与完整评分 (full 模式) 的top-k重合度和延迟
+需要运行中的Elasticsearch和已建立的索引
+
+用法:
+    python benchmark_rerank.py [N1,N2,...] [top-k]
+    python benchmark_rerank.py 20,50,100,200 10
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+
+import numpy as np
+
+from search_service import SearchService
+
+CORPUS_FILE = "caie_math_questions.json"
+SAMPLE_QUERIES = 50
+
+TEST_QUERIES = [
+    "differentiate",
+    "integrate",
+    "solve equation",
+    "find the derivative of x^2",
+    "the line y=mx-3 and the curve y=2x^2+5 do not meet",
+    "Find the equation of the curve",
+    "sin 2x + cos x = 0",
+    "geometric progression sum to infinity",
+]
+
+
+def load_queries():
+    """固定查询 + 题库中随机题目的开头 (模拟拍照识别的题干)"""
+    with open(CORPUS_FILE, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+    random.seed(42)
+    sampled = random.sample(questions, min(SAMPLE_QUERIES, len(questions)))
+    return TEST_QUERIES + [" ".join(q["content"].split()[:20]) for q in sampled]
+
+
+async def timed_search(service, query, limit, mode):
+    start = time.perf_counter()
+    results = await service._search_by_text(query, limit=limit, mode=mode)
+    return [r.id for r in results], (time.perf_counter() - start) * 1000
+
+
+async def main():
+    candidate_sizes = [int(n) for n in (sys.argv[1] if len(sys.argv) > 1 else "20,50,100,200").split(",")]
+    top_k = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    service = SearchService(os.getenv("ELASTICSEARCH_URL", "http://localhost:9200"))
+    queries = load_queries()
+    print(f"🧪 两阶段搜索评估: {len(queries)} 个查询, top-{top_k}")
+
+    # 完整评分作为参照
+    reference = {}
+    full_latencies = []
+    for query in queries:
+        ids, latency = await timed_search(service, query, top_k, "full")
+        reference[query] = ids
+        full_latencies.append(latency)
+    print(f"\n📊 full:   p50 {np.percentile(full_latencies, 50):.1f}ms  p95 {np.percentile(full_latencies, 95):.1f}ms")
+
+    for n in candidate_sizes:
+        service.rerank_candidates = n
+        recalls, latencies = [], []
+        for query in queries:
+            ids, latency = await timed_search(service, query, top_k, "rerank")
+            latencies.append(latency)
+            recall = service.compute_recall(ids, reference[query])
+            if recall is not None:
+                recalls.append(recall)
+
+        if not recalls:
+            print(f"⚠️  N={n}: 完整评分无结果，无法计算召回率")
+            continue
+
+        print(
+            f"📊 N={n:<4} recall@{top_k} {np.mean(recalls):.3f} (最低 {np.min(recalls):.2f})  "
+            f"p50 {np.percentile(latencies, 50):.1f}ms  p95 {np.percentile(latencies, 95):.1f}ms"
+        )
+
+    await service.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+搜索接口响应序列化基准测试
+对比原响应路径 (response_model校验 + jsonable_encoder + json) 与 FastJSONResponse 的
+单次响应耗时，以及 gzip / brotli 压缩后的响应大小
+
+用法:
+    python benchmark_responses.py [轮数]
+"""
+
+import sys
+import json
+import time
+import gzip
+from typing import List
+
+import numpy as np
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from fastapi.testclient import TestClient
+
+from models import SearchResult
+from responses import FastJSONResponse, CompressionMiddleware, dumps, brotli
+
+CORPUS_FILE = "caie_math_questions.json"
+RESULT_COUNT = 10
+
+
+def build_payloads():
+    """用题库构造搜索结果和带boxes的拍照搜题分析结果"""
+    with open(CORPUS_FILE, "r", encoding="utf-8") as f:
+        questions = json.load(f)[:RESULT_COUNT]
+
+    results = [
+        SearchResult(
+            id=q["id"],
+            title=f"{q['year']} {q['season']} Paper {q['paper_code']}",
+            content=q["content"],
+            year=q["year"],
+            season=q["season"],
+            paper_code=q["paper_code"],
+            mark_scheme=q.get("mark_scheme"),
+            confidence=0.8,
+            file_path=q.get("file_path")
+        )
+        for q in questions
+    ]
+
+    # 模拟OCR输出: 40行文本，每行一个4点坐标框
+    boxes = np.random.randint(0, 2000, size=(40, 8)).tolist()
+    analysis = {
+        "ocr_result": {
+            "text": questions[0]["content"],
+            "original_text": questions[0]["content"],
+            "confidence": 0.93,
+            "boxes": boxes,
+        },
+        "search_results": [
+            {"result": r, "confidence": r.confidence, "method_scores": {"formula_tokens": 0.8}}
+            for r in results
+        ],
+        "total_found": len(results),
+    }
+    return results, analysis
+
+
+def build_apps(results: List[SearchResult], analysis):
+    """原响应路径和快速路径各一个应用"""
+    baseline = FastAPI()
+
+    @baseline.post("/search/text", response_model=List[SearchResult])
+    async def baseline_search():
+        return results
+
+    @baseline.post("/search/image/analysis")
+    async def baseline_analysis():
+        return analysis
+
+    fast = FastAPI(default_response_class=FastJSONResponse)
+
+    @fast.post("/search/text", response_model=List[SearchResult])
+    async def fast_search():
+        return FastJSONResponse(results)
+
+    @fast.post("/search/image/analysis")
+    async def fast_analysis():
+        return FastJSONResponse(analysis)
+
+    compressed = FastAPI(default_response_class=FastJSONResponse)
+    compressed.add_middleware(CompressionMiddleware, minimum_size=1024)
+    compressed.post("/search/text")(fast_search)
+    compressed.post("/search/image/analysis")(fast_analysis)
+
+    return baseline, fast, compressed
+
+
+def measure(client: TestClient, path: str, rounds: int, headers=None):
+    """单次请求耗时 (毫秒) 和传输字节数"""
+    client.post(path, headers=headers)  # 预热
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        response = client.post(path, headers=headers)
+        latencies.append((time.perf_counter() - start) * 1000)
+    # TestClient会自动解压，传输大小以Content-Length为准
+    size = int(response.headers.get("content-length", len(response.content)))
+    return np.array(latencies), size, response.headers.get("content-encoding", "identity")
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    results, analysis = build_payloads()
+    baseline, fast, compressed = build_apps(results, analysis)
+
+    print(f"🧪 响应序列化基准测试 ({RESULT_COUNT} 条结果, {rounds} 轮)")
+
+    for path in ("/search/text", "/search/image/analysis"):
+        print(f"\n📡 {path}")
+        base_lat, base_size, _ = measure(TestClient(baseline), path, rounds)
+        fast_lat, fast_size, _ = measure(TestClient(fast), path, rounds)
+        print(f"   原路径:   p50 {np.percentile(base_lat, 50):.2f}ms  p95 {np.percentile(base_lat, 95):.2f}ms  {base_size} 字节")
+        print(f"   快速路径: p50 {np.percentile(fast_lat, 50):.2f}ms  p95 {np.percentile(fast_lat, 95):.2f}ms  {fast_size} 字节")
+
+        for encoding in ("gzip", "br"):
+            if encoding == "br" and brotli is None:
+                print("   ⚠️  未安装brotli，跳过br")
+                continue
+            lat, size, used = measure(TestClient(compressed), path, rounds, headers={"accept-encoding": encoding})
+            print(f"   快速路径+{used}: p50 {np.percentile(lat, 50):.2f}ms  {size} 字节 ({size / fast_size:.1%})")
+
+    # 纯序列化耗时 (不含HTTP开销)
+    print("\n⏱️  纯序列化 (分析结果)")
+    start = time.perf_counter()
+    for _ in range(rounds):
+        json.dumps(jsonable_encoder(analysis), ensure_ascii=False).encode("utf-8")
+    base_ms = (time.perf_counter() - start) * 1000 / rounds
+    start = time.perf_counter()
+    for _ in range(rounds):
+        dumps(analysis)
+    fast_ms = (time.perf_counter() - start) * 1000 / rounds
+    gzip_size = len(gzip.compress(dumps(analysis)))
+    print(f"   jsonable_encoder+json: {base_ms:.3f}ms  orjson: {fast_ms:.3f}ms  (加速 {base_ms / fast_ms:.1f}x)")
+    print(f"   gzip后大小: {gzip_size} 字节")
+
+
+if __name__ == "__main__":
+    main()
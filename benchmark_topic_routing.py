@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+主题路由评估
+按查询的数学概念 (math_concepts) 限定评分范围 (filter) 或加分 (boost)，与不路由 (off) 对比
+- 路由比例: 有可路由概念的查询占比；切片大小: 被路由的查询平均需要评分的题目比例
+- 误排除率: 被路由的查询中，目标题目不含任一查询概念的比例 (filter 下这些查询不可能召回目标)
+- 召回率、MRR和延迟: 分别在三组查询上评估，目标题目已知
+  - clean: 题库题干片段 (概念与目标题目完全一致，filter 的召回率在这组上不会变差)
+  - noisy: 加入OCR噪声的题干片段
+  - paraphrased: 同义改写并删去部分词的题干片段 (学生转述题目)
+
+用法:
+    python benchmark_topic_routing.py [噪声比例] [top-k]
+    SEARCH_BACKEND=local python benchmark_topic_routing.py 0.05 5   # 本地BM25索引
+"""
+
+import sys
+import json
+import random
+import asyncio
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from benchmark_ocr_tolerance import CORPUS_FILE, load_queries, create_service, timed_search
+from math_formula_processor import MathFormulaProcessor
+
+# 转述时的同义替换 (只替换整词，小写匹配)
+PARAPHRASES = {
+    "find": "work out", "show": "prove", "hence": "then", "calculate": "compute", "determine": "find",
+    "curve": "graph", "gradient": "slope", "particle": "object", "probability": "chance",
+    "equation": "formula", "sin": "sine", "cos": "cosine", "tan": "tangent", "ln": "log",
+    "integral": "area under", "differentiate": "find the derivative of", "velocity": "speed",
+    "acceleration": "rate of change of velocity", "vector": "direction", "mean": "average"
+}
+# 转述时删去不含数字的词的比例
+PARAPHRASE_DROP = 0.15
+
+
+def paraphrase(text: str, rng: random.Random) -> str:
+    """同义替换并随机删去部分词 (含数字和符号的词保留)"""
+    words = []
+    for word in text.split():
+        replacement = PARAPHRASES.get(word.lower())
+        if replacement is not None:
+            words.append(replacement)
+        elif word.isalpha() and rng.random() < PARAPHRASE_DROP:
+            continue
+        else:
+            words.append(word)
+    return " ".join(words)
+
+
+def topic_routes(queries, max_df: float):
+    """每个查询的路由范围占题库的比例 (不路由时为1.0)，以及目标题目是否被路由排除"""
+    processor = MathFormulaProcessor()
+    with open(CORPUS_FILE, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+    labels = [set(processor.extract_mathematical_concepts(q["content"])) for q in questions]
+    df = Counter(concept for concepts in labels for concept in concepts)
+    common = {concept for concept, count in df.items() if count > len(questions) * max_df}
+    # 同一题号可能对应多页题干，任一页含查询概念即可被路由命中
+    labels_by_id = defaultdict(set)
+    for q, concepts in zip(questions, labels):
+        labels_by_id[q["id"]] |= concepts
+
+    slices, excluded = [], []
+    for query, target in queries:
+        concepts = set(processor.extract_mathematical_concepts(query)) - common
+        if concepts:
+            slices.append(sum(1 for doc in labels if doc & concepts) / len(questions))
+            excluded.append(not labels_by_id[target] & concepts)
+        else:
+            slices.append(1.0)
+            excluded.append(False)
+    return np.array(slices), np.array(excluded)
+
+
+async def evaluate(service, queries, top_k: int):
+    """(recall@k, MRR, 延迟列表)"""
+    hits, reciprocal_ranks, latencies = 0, [], []
+    for query, target in queries:
+        ids, latency = await timed_search(service, query, top_k, None)
+        latencies.append(latency)
+        if target in ids:
+            hits += 1
+            reciprocal_ranks.append(1 / (ids.index(target) + 1))
+        else:
+            reciprocal_ranks.append(0.0)
+    return hits / len(queries), float(np.mean(reciprocal_ranks)), latencies
+
+
+async def main():
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else 0.05
+    top_k = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    service = create_service()
+    await service.initialize()
+
+    clean = load_queries(0.0)
+    rng = random.Random(7)
+    query_sets = [
+        ("clean", clean),
+        ("noisy", load_queries(rate)),
+        ("paraphrased", [(paraphrase(query, rng), target) for query, target in clean])
+    ]
+    print(f"🧪 主题路由评估: 每组 {len(clean)} 个查询, 噪声比例 {rate}, top-{top_k}")
+
+    for name, queries in query_sets:
+        slices, excluded = topic_routes(queries, service.topic_max_df)
+        routed = slices < 1.0
+        print(
+            f"\n📊 [{name}] 路由比例 {routed.mean():.2f}  "
+            f"被路由查询的平均切片 {slices[routed].mean() if routed.any() else 1.0:.3f}  "
+            f"误排除率 {excluded[routed].mean() if routed.any() else 0.0:.3f}"
+        )
+
+        baseline = None
+        for routing in ("off", "filter", "boost"):
+            service.topic_routing = routing
+            if hasattr(service, "load_common_concepts"):
+                await service.load_common_concepts()
+            recall, mrr, latencies = await evaluate(service, queries, top_k)
+            baseline = recall if baseline is None else baseline
+            print(
+                f"   {routing:<6} recall@{top_k} {recall:.3f} ({recall - baseline:+.3f})  MRR {mrr:.3f}  "
+                f"p50 {np.percentile(latencies, 50):.1f}ms  p95 {np.percentile(latencies, 95):.1f}ms"
+            )
+
+    await service.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
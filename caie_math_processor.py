@@ -14,6 +14,8 @@ from dataclasses import dataclass
 from typing import List, Dict, Optional
 import pandas as pd
 
+from index_schema import load_index_definition, mapping_fields, mapping_version
+
 @dataclass
 class PaperInfo:
     """试卷信息结构"""
@@ -191,44 +193,11 @@ class CAIEMathProcessor:
         print(f"✅ 成功导出 {len(data)} 个题目")
     
     def create_elasticsearch_index(self):
-        """创建Elasticsearch索引结构"""
-        index_mapping = {
-            "mappings": {
-                "properties": {
-                    "question_id": {"type": "keyword"},
-                    "content": {
-                        "type": "text",
-                        "analyzer": "standard",
-                        "fields": {
-                            "keyword": {"type": "keyword"}
-                        }
-                    },
-                    "year": {"type": "keyword"},
-                    "season": {"type": "keyword"},
-                    "paper_code": {"type": "keyword"},
-                    "subject": {"type": "keyword"},
-                    "mark_scheme": {"type": "text"},
-                    "file_path": {"type": "keyword"}
-                }
-            },
-            "settings": {
-                "number_of_shards": 1,
-                "number_of_replicas": 0,
-                "analysis": {
-                    "analyzer": {
-                        "math_analyzer": {
-                            "tokenizer": "standard",
-                            "filter": ["lowercase", "stop"]
-                        }
-                    }
-                }
-            }
-        }
-        
-        with open("elasticsearch_mapping.json", 'w') as f:
-            json.dump(index_mapping, f, indent=2)
-        
-        print("✅ Elasticsearch映射配置已生成")
+        """检查Elasticsearch索引定义 (elasticsearch_mapping.json 由 SearchService 创建索引时使用)"""
+        definition = load_index_definition()
+        mappings = definition["mappings"]
+        fields = mapping_fields(mappings["properties"])
+        print(f"✅ Elasticsearch映射配置 version {mapping_version(mappings)}: {len(fields)} 个字段")
 
 def main():
     """主函数"""
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+CPU线程预算管理
+统一配置 PaddleOCR、PyTorch/ONNX Runtime 与 OpenCV 的计算线程数，并支持按worker绑定CPU核心，
+避免多个引擎各自按全部核心开线程导致CPU超额订阅
+"""
+
+import os
+import sys
+import logging
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CPUBudget:
+    """CPU线程预算"""
+    cpus: List[int]          # 当前进程可用的CPU核心
+    ocr_threads: int         # PaddleOCR推理线程 (cpu_threads)
+    embedding_threads: int   # PyTorch / ONNX Runtime intra-op线程
+    opencv_threads: int      # OpenCV线程
+
+
+def _parse_cpu_list(spec: str) -> Set[int]:
+    """解析CPU列表，如 "0-3,6" -> {0, 1, 2, 3, 6}"""
+    cpus = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+def _available_cpus() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+_budget: Optional[CPUBudget] = None
+_applied: Dict[str, object] = {}
+
+
+def apply_cpu_affinity() -> List[int]:
+    """
+    按 CPU_AFFINITY 绑定当前进程的CPU核心
+
+    CPU_AFFINITY 格式:
+      - "0-3"          所有worker共用同一组核心
+      - "0-3;4-7"      每个worker一组核心，按 WORKER_INDEX 选择 (未设置时不绑定，
+                       按pid取模会让多个worker落在同一组核心上)
+    """
+    spec = os.getenv("CPU_AFFINITY", "").strip()
+    if not spec or not hasattr(os, "sched_setaffinity"):
+        return _available_cpus()
+
+    slots = [s for s in spec.split(";") if s.strip()]
+    worker_index = os.getenv("WORKER_INDEX")
+    if worker_index is None and len(slots) > 1:
+        logger.warning("⚠️  CPU_AFFINITY 包含多组核心但未设置 WORKER_INDEX，跳过CPU绑定")
+        return _available_cpus()
+    index = int(worker_index) if worker_index is not None else 0
+    cpus = _parse_cpu_list(slots[index % len(slots)])
+
+    try:
+        os.sched_setaffinity(0, cpus)
+        _applied["affinity_slot"] = index % len(slots)
+        logger.info(f"✅ CPU亲和性已设置: {sorted(cpus)}")
+    except OSError as e:
+        logger.warning(f"⚠️  设置CPU亲和性失败: {e}")
+
+    return _available_cpus()
+
+
+def get_cpu_budget() -> CPUBudget:
+    """获取CPU线程预算 (首次调用时应用CPU亲和性)"""
+    global _budget
+    if _budget is None:
+        cpus = apply_cpu_affinity()
+        count = len(cpus)
+        _budget = CPUBudget(
+            cpus=cpus,
+            ocr_threads=int(os.getenv("OCR_CPU_THREADS", max(1, count // 2))),
+            embedding_threads=int(os.getenv("EMBEDDING_CPU_THREADS", max(1, count // 4))),
+            opencv_threads=int(os.getenv("OPENCV_CPU_THREADS", 1)),
+        )
+    return _budget
+
+
+def apply_torch_threads():
+    """设置PyTorch intra-op线程数"""
+    budget = get_cpu_budget()
+    try:
+        import torch
+        torch.set_num_threads(budget.embedding_threads)
+        try:
+            # inter-op线程只能在首次并行计算前设置一次
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass
+        _applied["torch_threads"] = torch.get_num_threads()
+    except ImportError:
+        pass
+
+
+def apply_opencv_threads():
+    """设置OpenCV线程数"""
+    budget = get_cpu_budget()
+    try:
+        import cv2
+        cv2.setNumThreads(budget.opencv_threads)
+        _applied["opencv_threads"] = cv2.getNumThreads()
+    except ImportError:
+        pass
+
+
+def record_applied(key: str, value):
+    """记录由各服务自行应用的线程设置 (如PaddleOCR的cpu_threads)"""
+    _applied[key] = value
+
+
+def effective_thread_settings() -> Dict[str, object]:
+    """当前生效的线程配置 (用于/health)"""
+    settings = {
+        "budget": asdict(get_cpu_budget()),
+        "effective_cpus": _available_cpus(),
+        **_applied,
+    }
+    if "torch" in sys.modules:
+        settings["torch_threads"] = sys.modules["torch"].get_num_threads()
+    if "cv2" in sys.modules:
+        settings["opencv_threads"] = sys.modules["cv2"].getNumThreads()
+    return settings
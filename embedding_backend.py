@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+向量模型推理后端
+为 all-MiniLM-L6-v2 提供 PyTorch / ONNX Runtime / int8动态量化 三种CPU推理方式
+所有后端输出L2归一化的384维向量，与ES中cosineSimilarity评分兼容
+"""
+
+import os
+import sys
+import logging
+from pathlib import Path
+from typing import List, Union
+
+import numpy as np
+
+from cpu_budget import get_cpu_budget, record_applied
+
+EMBEDDING_DIM = 384  # all-MiniLM-L6-v2的向量维度
+DEFAULT_MODEL_NAME = "all-MiniLM-L6-v2"
+
+logger = logging.getLogger(__name__)
+
+
+def _l2_normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2归一化，保证余弦相似度与点积一致"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class ONNXEmbeddingModel:
+    """基于ONNX Runtime的句向量模型 (mean pooling + L2归一化)"""
+
+    def __init__(self, model_dir: str, num_threads: int = 0, max_seq_length: int = 256):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_dir = Path(model_dir)
+        self.model_path = self._find_onnx_file(self.model_dir)
+
+        # 分词器 (SentenceTransformer.save 会一并保存 tokenizer.json)
+        self.tokenizer = Tokenizer.from_file(str(self.model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_seq_length)
+        self.tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            str(self.model_path),
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    @staticmethod
+    def _find_onnx_file(model_dir: Path) -> Path:
+        """优先使用量化模型，其次使用FP32模型"""
+        candidates = [
+            model_dir / "model_quantized.onnx",
+            model_dir / "onnx" / "model_quantized.onnx",
+            model_dir / "model.onnx",
+            model_dir / "onnx" / "model.onnx",
+        ]
+        for path in candidates:
+            if path.exists():
+                return path
+        raise FileNotFoundError(f"在 {model_dir} 中未找到ONNX模型文件")
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return EMBEDDING_DIM
+
+    def encode(
+        self,
+        sentences: Union[str, List[str]],
+        batch_size: int = 32,
+        **kwargs
+    ) -> np.ndarray:
+        """编码文本，接口与SentenceTransformer.encode保持一致"""
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        all_embeddings = []
+        for i in range(0, len(sentences), batch_size):
+            batch = sentences[i:i + batch_size]
+            encodings = self.tokenizer.encode_batch(batch)
+
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+            token_embeddings = self.session.run(None, feeds)[0]
+
+            # mean pooling (忽略padding)
+            mask = attention_mask[..., np.newaxis].astype(np.float32)
+            summed = (token_embeddings * mask).sum(axis=1)
+            counts = np.clip(mask.sum(axis=1), 1e-9, None)
+            all_embeddings.append(_l2_normalize(summed / counts))
+
+        embeddings = np.vstack(all_embeddings).astype(np.float32)
+        return embeddings[0] if single else embeddings
+
+
+def _load_torch_model(model_dir: str = None, quantize: bool = False):
+    """加载PyTorch版SentenceTransformer，可选int8动态量化"""
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_dir or DEFAULT_MODEL_NAME, device="cpu")
+
+    if quantize:
+        import torch
+        # 仅量化Linear层，权重int8、激活动态量化，输出仍为float32
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    return model
+
+
+def load_embedding_model(backend: str = None, model_dir: str = None):
+    """
+    按配置加载向量模型
+
+    backend:
+      - torch:     PyTorch FP32 (默认，与原行为一致)
+      - quantized: PyTorch int8动态量化
+      - onnx:      ONNX Runtime (目录中有model_quantized.onnx时自动使用量化模型)
+    model_dir: 本地模型目录，未设置时torch后端从HuggingFace加载
+    """
+    backend = (backend or os.getenv("EMBEDDING_BACKEND", "torch")).lower()
+    model_dir = model_dir or os.getenv("EMBEDDING_MODEL_DIR") or None
+
+    if backend == "onnx":
+        if not model_dir:
+            raise ValueError("ONNX后端需要设置 EMBEDDING_MODEL_DIR")
+        num_threads = get_cpu_budget().embedding_threads
+        record_applied("onnx_threads", num_threads)
+        return ONNXEmbeddingModel(model_dir, num_threads=num_threads)
+    if backend == "quantized":
+        return _load_torch_model(model_dir, quantize=True)
+    if backend == "torch":
+        return _load_torch_model(model_dir)
+
+    raise ValueError(f"未知的向量模型后端: {backend}")
+
+
+def export_onnx(output_dir: str, model_dir: str = None, quantize: bool = True):
+    """将SentenceTransformer导出为ONNX (可选int8量化)，输出目录可直接作为onnx后端的模型目录"""
+    import torch
+
+    output = Path(output_dir)
+    output.mkdir(parents=True, exist_ok=True)
+
+    model = _load_torch_model(model_dir)
+    model.save(str(output))  # 保存tokenizer.json等文件
+
+    transformer = model[0].auto_model
+    transformer.eval()
+    tokenizer = model.tokenizer
+    dummy = tokenizer(["export sample"], return_tensors="pt")
+
+    onnx_path = output / "model.onnx"
+    torch.onnx.export(
+        transformer,
+        (dummy["input_ids"], dummy["attention_mask"], dummy["token_type_ids"]),
+        str(onnx_path),
+        input_names=["input_ids", "attention_mask", "token_type_ids"],
+        output_names=["last_hidden_state"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "token_type_ids": {0: "batch", 1: "sequence"},
+            "last_hidden_state": {0: "batch", 1: "sequence"},
+        },
+        opset_version=14,
+    )
+    print(f"✅ ONNX模型已导出: {onnx_path}")
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantized_path = output / "model_quantized.onnx"
+        quantize_dynamic(str(onnx_path), str(quantized_path), weight_type=QuantType.QInt8)
+        print(f"✅ int8量化模型已导出: {quantized_path}")
+
+
+if __name__ == "__main__":
+    # 用法: python embedding_backend.py <输出目录> [本地模型目录]
+    if len(sys.argv) < 2:
+        print("用法: python embedding_backend.py <输出目录> [本地模型目录]")
+        sys.exit(1)
+    export_onnx(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+查询向量编码服务
+跨请求微批处理：在短时间窗口内收集并发请求的查询文本，合并为一个批次在线程池中编码
+"""
+
+import os
+import time
+import asyncio
+import logging
+import contextvars
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from executors import get_executor
+from metrics import track_stage, CACHE_HITS
+from request_timing import record_timing
+
+
+class EmbeddingService:
+    def __init__(
+        self,
+        model,
+        max_batch_size: int = None,
+        max_wait_ms: float = None
+    ):
+        """初始化向量编码服务"""
+        self.logger = logging.getLogger(__name__)
+        self.model = model
+
+        self.max_batch_size = max_batch_size or int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+        wait_ms = max_wait_ms if max_wait_ms is not None else float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+        self.max_wait = wait_ms / 1000.0
+
+        # 专用执行器：批次在 embedding 线程池中编码，不占用事件循环和其他类型任务的线程
+        self.executor = get_executor("embedding")
+
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+
+        # 批处理统计
+        self.stats = {"requests": 0, "batches": 0, "encoded_texts": 0}
+
+    async def encode(self, text: str) -> np.ndarray:
+        """编码单条查询 (与其他并发请求合并为批次)"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        self.stats["requests"] += 1
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+
+        start = time.perf_counter()
+        try:
+            return await future
+        finally:
+            # 请求级耗时包含等待批次窗口的时间
+            record_timing("query_embedding", time.perf_counter() - start)
+
+    def encode_sync(self, texts: List[str]) -> np.ndarray:
+        """同步批量编码 (用于索引构建等离线场景)"""
+        with track_stage("query_embedding"):
+            return np.asarray(self.model.encode(texts), dtype=np.float32)
+
+    def _flush(self):
+        """将当前等待队列作为一个批次提交编码"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        # 批次由多个请求共享，在独立上下文中运行，避免耗时被记到触发刷新的那个请求上
+        loop = asyncio.get_running_loop()
+        task = contextvars.Context().run(loop.create_task, self._encode_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _encode_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        """在线程池中编码一个批次，并将向量分发给各调用方"""
+        # 相同查询只编码一次
+        positions: Dict[str, int] = {}
+        for text, _ in batch:
+            positions.setdefault(text, len(positions))
+        texts = list(positions)
+        if len(texts) < len(batch):
+            CACHE_HITS.labels(cache="embedding_batch").inc(len(batch) - len(texts))
+
+        try:
+            vectors = await self.executor.run(self.encode_sync, texts)
+        except Exception as e:
+            self.logger.error(f"批量向量编码失败: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.stats["batches"] += 1
+        self.stats["encoded_texts"] += len(texts)
+
+        for text, future in batch:
+            if not future.done():
+                future.set_result(vectors[positions[text]])
+
+    def get_stats(self) -> Dict[str, float]:
+        """批处理统计信息"""
+        batches = self.stats["batches"]
+        return {
+            **self.stats,
+            "avg_batch_size": self.stats["encoded_texts"] / batches if batches else 0.0
+        }
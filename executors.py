@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+CPU密集型任务执行器
+为向量编码、OCR、OCR后处理、数学分析、PDF解析分别提供独立的有界线程池，
+避免某类任务占满线程池或阻塞事件循环
+"""
+
+import os
+import asyncio
+import logging
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+# 执行器名称 -> (默认线程数, 默认最大排队数)
+EXECUTOR_DEFAULTS = {
+    "embedding": (1, 256),        # 查询向量编码 (批次内已并行)
+    "ocr": (2, 16),               # 图像预处理 + PaddleOCR推理
+    "ocr_postprocess": (2, 64),   # OCR文本的数学公式后处理
+    "math_analysis": (2, 256),    # 查询增强、公式token化、匹配质量分析
+    "pdf_parsing": (1, 8),        # PDF解析与索引构建
+}
+
+
+class ExecutorSaturatedError(RuntimeError):
+    """执行器排队已满，调用方应快速失败"""
+
+
+class _QueuedJob:
+    """一次提交的排队状态 (工作线程开始执行和等待方取消可能同时发生)"""
+    __slots__ = ("dequeued",)
+
+    def __init__(self):
+        self.dequeued = False
+
+
+class BoundedExecutor:
+    """带排队上限和队列深度统计的命名线程池"""
+
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix=f"{name}-worker"
+        )
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._completed = 0
+        self._rejected = 0
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """在本执行器中运行函数并等待结果"""
+        with self._lock:
+            if self._queued >= self.max_queue:
+                self._rejected += 1
+                raise ExecutorSaturatedError(f"执行器 {self.name} 排队已满 ({self.max_queue})")
+            self._queued += 1
+
+        # 复制当前上下文，使请求级contextvars (如耗时记录) 在工作线程中可见
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        job = _QueuedJob()
+        try:
+            return await loop.run_in_executor(self._executor, context.run, self._wrap, job, fn, args, kwargs)
+        except asyncio.CancelledError:
+            # 排队中被取消的任务不会再由工作线程执行，在这里归还排队名额
+            self._dequeue(job)
+            raise
+
+    def _dequeue(self, job: "_QueuedJob") -> bool:
+        """任务离开队列 (开始执行或被取消)，排队计数只减一次"""
+        with self._lock:
+            if job.dequeued:
+                return False
+            job.dequeued = True
+            self._queued -= 1
+            return True
+
+    def _wrap(self, job: "_QueuedJob", fn: Callable, args: tuple, kwargs: dict) -> Any:
+        """在工作线程中执行，维护排队/运行计数"""
+        self._dequeue(job)
+        with self._lock:
+            self._active += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._completed += 1
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queued
+
+    def get_stats(self) -> Dict[str, int]:
+        """执行器状态"""
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "queue_depth": self._queued,
+                "active": self._active,
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self, wait: bool = False):
+        self._executor.shutdown(wait=wait)
+
+
+_executors: Dict[str, BoundedExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name: str) -> BoundedExecutor:
+    """获取命名执行器，首次使用时按环境变量 EXECUTOR_<NAME>_WORKERS / EXECUTOR_<NAME>_QUEUE 创建"""
+    if name not in EXECUTOR_DEFAULTS:
+        raise ValueError(f"未知的执行器: {name}")
+
+    with _executors_lock:
+        if name not in _executors:
+            default_workers, default_queue = EXECUTOR_DEFAULTS[name]
+            prefix = f"EXECUTOR_{name.upper()}"
+            workers = int(os.getenv(f"{prefix}_WORKERS", default_workers))
+            queue = int(os.getenv(f"{prefix}_QUEUE", default_queue))
+            _executors[name] = BoundedExecutor(name, workers, queue)
+            logger.info(f"创建执行器 {name}: workers={workers}, queue={queue}")
+        return _executors[name]
+
+
+def executor_stats() -> Dict[str, Dict[str, int]]:
+    """所有执行器的状态 (含队列深度)"""
+    return {name: get_executor(name).get_stats() for name in EXECUTOR_DEFAULTS}
+
+
+def shutdown_executors():
+    """关闭所有执行器"""
+    with _executors_lock:
+        for executor in _executors.values():
+            executor.shutdown()
+        _executors.clear()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+后台健康检查
+后台任务定期探测ES、Redis等依赖并保存状态快照，/health 直接返回快照，
+负载均衡器的高频探测不会产生依赖往返，也不会阻塞事件循环
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class HealthMonitor:
+    def __init__(self, interval_s: float = None, timeout_s: float = None):
+        """初始化健康检查器"""
+        self.interval_s = interval_s if interval_s is not None else float(os.getenv("HEALTH_CHECK_INTERVAL_S", "5"))
+        self.timeout_s = timeout_s if timeout_s is not None else float(os.getenv("HEALTH_CHECK_TIMEOUT_S", "2"))
+
+        self._probes: Dict[str, Callable[[], Awaitable[bool]]] = {}
+        self._status: Dict[str, bool] = {}
+        self._errors: Dict[str, str] = {}
+        self._latency_ms: Dict[str, float] = {}
+        self._checked_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, name: str, probe: Callable[[], Awaitable[bool]]):
+        """注册依赖探测 (异步函数，返回是否可用)"""
+        self._probes[name] = probe
+        self._status[name] = False
+
+    async def _probe(self, name: str, probe: Callable[[], Awaitable[bool]]):
+        start = time.perf_counter()
+        try:
+            ok = bool(await asyncio.wait_for(probe(), timeout=self.timeout_s))
+            error = None
+        except asyncio.TimeoutError:
+            ok, error = False, f"超时 ({self.timeout_s}s)"
+        except Exception as e:
+            ok, error = False, str(e)
+
+        if ok != self._status.get(name):
+            if ok:
+                logger.info(f"✅ {name} 恢复可用")
+            else:
+                logger.warning(f"❌ {name} 不可用: {error}")
+
+        self._status[name] = ok
+        self._latency_ms[name] = round((time.perf_counter() - start) * 1000, 2)
+        if error:
+            self._errors[name] = error
+        else:
+            self._errors.pop(name, None)
+
+    async def refresh(self):
+        """并发探测所有依赖并更新快照"""
+        await asyncio.gather(*(self._probe(name, probe) for name, probe in self._probes.items()))
+        self._checked_at = time.time()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_s)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning(f"健康检查失败: {e}")
+
+    async def start(self):
+        """立即探测一次，然后在后台定期刷新"""
+        await self.refresh()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """最近一次探测的状态"""
+        age = None if self._checked_at is None else round(time.time() - self._checked_at, 2)
+        return {
+            "status": dict(self._status),
+            "healthy": bool(self._status) and all(self._status.values()),
+            "checked_at": self._checked_at,
+            "age_s": age,
+            "latency_ms": dict(self._latency_ms),
+            "errors": dict(self._errors),
+        }
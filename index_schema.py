@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+索引定义
+elasticsearch_mapping.json 是索引映射和分析器的唯一来源 (mappings._meta.version 为版本号)，
+创建索引和检查查询子句都从这里读取；查询构建时去掉引用了线上索引中不存在字段的子句
+"""
+
+import os
+import json
+import copy
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+DEFAULT_MAPPING_FILE = Path(__file__).resolve().parent / "elasticsearch_mapping.json"
+
+# 叶子查询中以字段名为键的查询类型
+_FIELD_KEYED_QUERIES = {
+    "term", "terms", "match", "match_phrase", "match_phrase_prefix", "prefix",
+    "fuzzy", "wildcard", "regexp", "range"
+}
+# terms等查询中与字段名并列的参数
+_QUERY_PARAMS = {"boost", "_name"}
+
+
+def load_index_definition(path: str = None) -> Dict[str, Any]:
+    """读取索引定义 (ES_MAPPING_PATH 可覆盖默认文件)"""
+    path = path or os.getenv("ES_MAPPING_PATH") or DEFAULT_MAPPING_FILE
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def mapping_version(mappings: Dict[str, Any]) -> Optional[int]:
+    """映射的版本号 (mappings._meta.version)，未标注时返回None"""
+    return (mappings or {}).get("_meta", {}).get("version")
+
+
+def mapping_fields(properties: Dict[str, Any], prefix: str = "") -> Set[str]:
+    """映射中所有可查询的字段路径，包括对象子属性和多字段 (content.english)"""
+    fields = set()
+    for name, spec in (properties or {}).items():
+        path = f"{prefix}{name}"
+        fields.add(path)
+        fields |= mapping_fields(spec.get("properties"), f"{path}.")
+        fields |= {f"{path}.{sub}" for sub in spec.get("fields", {})}
+    return fields
+
+
+def with_element_type(definition: Dict[str, Any], element_type: str) -> Dict[str, Any]:
+    """返回副本，所有dense_vector字段使用指定的存储类型"""
+    definition = copy.deepcopy(definition)
+    for spec in definition["mappings"]["properties"].values():
+        if spec.get("type") == "dense_vector":
+            spec["element_type"] = element_type
+    return definition
+
+
+def _strip_boost(field: str) -> str:
+    return field.split("^", 1)[0]
+
+
+def _field_exists(field: str, available: Set[str]) -> bool:
+    return _strip_boost(field) in available
+
+
+def prune_clause(clause: Dict[str, Any], available: Set[str], dropped: Set[str]) -> Optional[Dict[str, Any]]:
+    """去掉子句中引用不存在字段的部分，整个子句无效时返回None；被去掉的字段记入 dropped
+
+    multi_match 只去掉不存在的字段，bool 子句递归处理，其余查询类型原样保留
+    """
+    (query_type, body), = clause.items()
+
+    if query_type in _FIELD_KEYED_QUERIES:
+        fields = [key for key in body if key not in _QUERY_PARAMS]
+        missing = [field for field in fields if not _field_exists(field, available)]
+        dropped.update(missing)
+        return None if missing else clause
+
+    if query_type == "multi_match":
+        fields = body.get("fields", [])
+        kept = [field for field in fields if _field_exists(field, available)]
+        dropped.update(_strip_boost(field) for field in fields if field not in kept)
+        if not kept:
+            return None
+        return clause if len(kept) == len(fields) else {query_type: {**body, "fields": kept}}
+
+    if query_type == "bool":
+        pruned = dict(body)
+        for occur in ("must", "should", "filter", "must_not"):
+            if occur in body:
+                children = [prune_clause(child, available, dropped) for child in body[occur]]
+                pruned[occur] = [child for child in children if child is not None]
+        if not any(pruned.get(occur) for occur in ("must", "should", "filter")):
+            return None
+        return pruned
+
+    return clause
+
+
+def prune_clauses(clauses: Iterable[Dict[str, Any]], available: Set[str], dropped: Set[str]) -> List[Dict[str, Any]]:
+    """逐个裁剪子句，去掉无效的子句"""
+    pruned = (prune_clause(clause, available, dropped) for clause in clauses)
+    return [clause for clause in pruned if clause is not None]
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+本地搜索服务
+基于导出题库 (caie_math_questions.json) 的进程内BM25倒排索引，接口与SearchService一致
+用于小规模部署 (SEARCH_BACKEND=local) 或Elasticsearch不可用时的降级搜索
+"""
+
+import os
+import re
+import json
+import math
+import logging
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from models import SearchResult, IndexStats
+from math_formula_processor import MathFormulaProcessor
+from executors import get_executor, ExecutorSaturatedError
+from metrics import track_stage, SEARCH_TIER
+from request_timing import record_search_tier
+from profiling import SlowQueryLog
+from vector_index import load_vector_index
+
+DEFAULT_CORPUS_FILE = "caie_math_questions.json"
+
+# 支持term过滤的字段
+FILTER_FIELDS = ("year", "season", "paper_code", "subject_code")
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """小写分词 (与ES standard分词器近似)"""
+    return _WORD_PATTERN.findall(text.lower()) if text else []
+
+
+def char_trigrams(text: str) -> List[str]:
+    """词内字符trigram (与ES ngram分词器 min_gram=max_gram=3 一致，少于3个字符的词不产生trigram)"""
+    return [word[i:i + 3] for word in tokenize(text) for i in range(len(word) - 2)]
+
+
+class BM25FieldIndex:
+    """单字段倒排索引，posting中直接保存BM25权重 (查询时只需累加)"""
+
+    def __init__(self, docs_tokens: List[List[str]], k1: float = 1.2, b: float = 0.75):
+        doc_count = len(docs_tokens)
+        doc_len = np.array([len(tokens) for tokens in docs_tokens], dtype=np.float32)
+        avgdl = float(doc_len.mean()) if doc_count and doc_len.sum() > 0 else 1.0
+        norm = k1 * (1 - b + b * doc_len / avgdl)
+
+        raw: Dict[str, Tuple[List[int], List[int]]] = {}
+        for doc_id, tokens in enumerate(docs_tokens):
+            for term, tf in Counter(tokens).items():
+                ids, tfs = raw.setdefault(term, ([], []))
+                ids.append(doc_id)
+                tfs.append(tf)
+
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for term, (ids, tfs) in raw.items():
+            ids = np.array(ids, dtype=np.int32)
+            tfs = np.array(tfs, dtype=np.float32)
+            df = len(ids)
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            weights = idf * tfs * (k1 + 1) / (tfs + norm[ids])
+            self.postings[term] = (ids, weights.astype(np.float32))
+
+    def score(self, terms: List[str], scores: np.ndarray, boost: float = 1.0):
+        """将查询词的BM25得分累加到 scores (重复的查询词按次数计)"""
+        for term, qtf in Counter(terms).items():
+            posting = self.postings.get(term)
+            if posting is not None:
+                ids, weights = posting
+                scores[ids] += weights * (boost * qtf)
+
+    def nbytes(self) -> int:
+        return sum(ids.nbytes + weights.nbytes for ids, weights in self.postings.values())
+
+
+class LocalSearchService:
+    def __init__(self, corpus_path: str = None):
+        """初始化本地搜索服务"""
+        self.logger = logging.getLogger(__name__)
+        self.corpus_path = corpus_path or os.getenv("LOCAL_CORPUS_PATH", DEFAULT_CORPUS_FILE)
+
+        self.math_processor = MathFormulaProcessor()
+
+        # BM25参数与ES默认值一致
+        self.k1 = float(os.getenv("LOCAL_BM25_K1", "1.2"))
+        self.b = float(os.getenv("LOCAL_BM25_B", "0.75"))
+
+        # 出现在超过该比例题目中的公式指纹查询时跳过 (与SearchService一致)
+        self.fingerprint_max_df = float(os.getenv("FORMULA_FINGERPRINT_MAX_DF", "0.05"))
+        self.common_fingerprints = set()
+
+        # 主题路由 (与SearchService一致): filter 只在含查询概念的题目中评分，boost 为这些题目加分
+        self.topic_routing = os.getenv("TOPIC_ROUTING", "off")
+        self.topic_max_df = float(os.getenv("TOPIC_ROUTING_MAX_DF", "0.2"))
+        self.common_concepts = set()
+
+        # 与SearchService保持相同的属性
+        self.embedding_model = None
+        self.embedding_service = None
+        self.slow_query_log = SlowQueryLog()
+
+        # 本地向量索引 (VECTOR_INDEX_PATH)，用于向量相似度搜索
+        self.vector_index = load_vector_index()
+
+        self.documents: List[Dict[str, Any]] = []
+        self.doc_rows: Dict[str, int] = {}
+        self.field_indexes: Dict[str, BM25FieldIndex] = {}
+        self.formula_hash_rows: Dict[str, np.ndarray] = {}
+        self.concept_rows: Dict[str, np.ndarray] = {}
+        self.filter_values: Dict[str, np.ndarray] = {}
+
+    async def initialize(self):
+        """初始化搜索服务 (加载题库并建立内存索引)"""
+        await self.build_index()
+        self.logger.info("✅ 本地搜索服务初始化完成")
+
+    async def create_index(self):
+        """内存索引在 build_index 时创建，无需单独建索引"""
+
+    async def build_index(self):
+        """从导出的题库构建内存索引"""
+        self.logger.info(f"🔨 开始构建本地索引: {self.corpus_path}")
+        await get_executor("pdf_parsing").run(self._build)
+        self.logger.info(f"✅ 本地索引构建完成: {len(self.documents)} 个题目")
+
+    def _build(self):
+        """加载题库并建立倒排索引 (CPU密集，在线程池中运行)"""
+        with open(self.corpus_path, "r", encoding="utf-8") as f:
+            questions = json.load(f)
+
+        documents = []
+        content_tokens, content_trigrams, formula_tokens, feature_tokens, fingerprints = [], [], [], [], []
+        hash_rows: Dict[str, List[int]] = {}
+        concept_rows: Dict[str, List[int]] = {}
+        for question in questions:
+            raw_content = question.get("content", "")
+            enhanced_content = self.math_processor.process_pdf_text(raw_content)
+
+            documents.append({
+                "question_id": question["id"],
+                "title": f"Question {question['id']}",
+                "content": enhanced_content,
+                "year": str(question.get("year", "")),
+                "season": question.get("season", ""),
+                "paper_code": str(question.get("paper_code", "")),
+                "subject_code": question.get("subject_code", "9709"),
+                "mark_scheme": question.get("mark_scheme") or "",
+                "file_path": question.get("file_path"),
+            })
+            content_tokens.append(tokenize(enhanced_content))
+            content_trigrams.append(char_trigrams(enhanced_content))
+            formula_tokens.append(self.math_processor.tokenize_formula(raw_content))
+            feature_tokens.append(self.math_processor.extract_formula_features(raw_content))
+            fingerprints.append(self.math_processor.formula_fingerprints(raw_content))
+            for formula_hash in self.math_processor.formula_hashes(raw_content):
+                hash_rows.setdefault(formula_hash, []).append(len(documents) - 1)
+            for concept in self.math_processor.extract_mathematical_concepts(raw_content):
+                concept_rows.setdefault(concept, []).append(len(documents) - 1)
+
+        field_indexes = {
+            "content": BM25FieldIndex(content_tokens, self.k1, self.b),
+            "content_trigrams": BM25FieldIndex(content_trigrams, self.k1, self.b),
+            "formula_tokens": BM25FieldIndex(formula_tokens, self.k1, self.b),
+            "math_features": BM25FieldIndex(feature_tokens, self.k1, self.b),
+            "formula_fingerprints": BM25FieldIndex(fingerprints, self.k1, self.b),
+        }
+        max_df = len(documents) * self.fingerprint_max_df
+        common_fingerprints = {
+            fingerprint for fingerprint, (ids, _) in field_indexes["formula_fingerprints"].postings.items()
+            if len(ids) > max_df
+        }
+        common_concepts = {
+            concept for concept, rows in concept_rows.items()
+            if len(rows) > len(documents) * self.topic_max_df
+        }
+        filter_values = {
+            field: np.array([doc[field] for doc in documents])
+            for field in FILTER_FIELDS
+        }
+
+        # 构建完成后一次性替换，搜索不会看到半成品索引
+        self.documents = documents
+        self.doc_rows = {doc["question_id"]: row for row, doc in enumerate(documents)}
+        self.field_indexes = field_indexes
+        self.common_fingerprints = common_fingerprints
+        self.formula_hash_rows = {
+            formula_hash: np.array(rows, dtype=np.int32) for formula_hash, rows in hash_rows.items()
+        }
+        self.concept_rows = {
+            concept: np.array(rows, dtype=np.int32) for concept, rows in concept_rows.items()
+        }
+        self.common_concepts = common_concepts
+        self.filter_values = filter_values
+
+    async def ping(self) -> bool:
+        return bool(self.documents)
+
+    def _analyze_query(self, query: str) -> Dict[str, Any]:
+        """查询数学分析"""
+        with track_stage("math_analysis"):
+            return {
+                "enhanced": self.math_processor.enhance_search_query(query),
+                "formula_tokens": self.math_processor.tokenize_formula(query),
+                "formula_fingerprints": self.math_processor.formula_fingerprints(query),
+                "formula_hashes": self.math_processor.formula_hashes(query),
+                "math_features": self.math_processor.extract_formula_features(query),
+                "math_concepts": self.math_processor.extract_mathematical_concepts(query)
+            }
+
+    def _filter_mask(self, filters: Optional[Dict]) -> Optional[np.ndarray]:
+        """term过滤条件 -> 文档掩码 (不支持的字段不匹配任何文档，与ES行为一致)"""
+        if not filters:
+            return None
+
+        mask = np.ones(len(self.documents), dtype=bool)
+        for field, value in filters.items():
+            if field not in self.filter_values:
+                return np.zeros(len(self.documents), dtype=bool)
+            mask &= self.filter_values[field] == str(value)
+        return mask
+
+    def _topic_mask(self, concepts: List[str]) -> Optional[np.ndarray]:
+        """含任一路由概念的文档掩码 (高频概念不参与路由)，不路由时返回None"""
+        if self.topic_routing == "off":
+            return None
+        concepts = [concept for concept in concepts if concept not in self.common_concepts]
+        if not concepts:
+            return None
+
+        mask = np.zeros(len(self.documents), dtype=bool)
+        for concept in concepts:
+            if concept in self.concept_rows:
+                mask[self.concept_rows[concept]] = True
+        return mask
+
+    def _search(self, query: str, limit: int, filters: Optional[Dict], mode: Optional[str] = None) -> List[SearchResult]:
+        """BM25评分并取top-k (CPU密集，在 math_analysis 线程池中运行)
+
+        mode=ocr 时额外按字符trigram评分，容忍OCR错字
+        """
+        analysis = self._analyze_query(query)
+        enhanced = analysis["enhanced"]
+
+        with track_stage("local_search"):
+            scores = np.zeros(len(self.documents), dtype=np.float32)
+
+            # 字段权重与ES查询子句一致
+            # 等价公式哈希: 与ES terms查询相同，命中的文档加常数分
+            matched = [self.formula_hash_rows[h] for h in analysis["formula_hashes"] if h in self.formula_hash_rows]
+            if matched:
+                scores[np.unique(np.concatenate(matched))] += 8.0
+            self.field_indexes["formula_fingerprints"].score(
+                self._selective_fingerprints(analysis["formula_fingerprints"]), scores, boost=6.0
+            )
+            self.field_indexes["formula_tokens"].score(analysis["formula_tokens"], scores, boost=5.0)
+            self.field_indexes["math_features"].score(analysis["math_features"], scores, boost=4.0)
+            self.field_indexes["content"].score(tokenize(enhanced.get("normalized", query)), scores, boost=2.0)
+            if "expanded" in enhanced:
+                self.field_indexes["content"].score(tokenize(enhanced["expanded"]), scores, boost=1.5)
+            if mode == "ocr":
+                self.field_indexes["content_trigrams"].score(
+                    char_trigrams(enhanced.get("normalized", query)), scores, boost=2.0
+                )
+
+            mask = self._filter_mask(filters)
+            topic_mask = self._topic_mask(analysis["math_concepts"])
+            if topic_mask is not None and self.topic_routing == "filter":
+                mask = topic_mask if mask is None else mask & topic_mask
+            elif topic_mask is not None and self.topic_routing == "boost":
+                # 与ES的 constant_score should 子句一致: 只为已匹配的文档加分
+                scores[topic_mask & (scores > 0)] += 2.0
+
+            return self._top_results(scores, limit, mask)
+
+    def _selective_fingerprints(self, fingerprints: List[str]) -> List[str]:
+        """去掉高频指纹；全部为高频指纹时原样保留"""
+        return [fp for fp in fingerprints if fp not in self.common_fingerprints] or fingerprints
+
+    def _search_fingerprints(self, fingerprints: List[str], limit: int) -> List[SearchResult]:
+        """只按公式指纹评分"""
+        with track_stage("local_search"):
+            scores = np.zeros(len(self.documents), dtype=np.float32)
+            self.field_indexes["formula_fingerprints"].score(self._selective_fingerprints(fingerprints), scores)
+            return self._top_results(scores, limit)
+
+    def _top_results(self, scores: np.ndarray, limit: int, mask: Optional[np.ndarray] = None) -> List[SearchResult]:
+        """取得分最高的limit个文档 (0分文档不返回)"""
+        if mask is not None:
+            scores[~mask] = 0.0
+
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > limit:
+            top = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+        else:
+            top = candidates
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        return [self._doc_to_result(int(i), float(scores[i])) for i in top]
+
+    def _doc_to_result(self, doc_index: int, score: float) -> SearchResult:
+        doc = self.documents[doc_index]
+        return SearchResult(
+            id=doc["question_id"],
+            title=doc["title"],
+            content=doc["content"],
+            year=doc["year"],
+            season=doc["season"],
+            paper_code=doc["paper_code"],
+            mark_scheme=doc["mark_scheme"],
+            confidence=score / 10.0,  # 与ES结果相同的归一化
+            file_path=doc["file_path"]
+        )
+
+    async def search_by_text(
+        self,
+        query: str,
+        limit: int = 10,
+        filters: Optional[Dict] = None,
+        mode: Optional[str] = None,
+        timeout_ms: Optional[float] = None,
+        fields: Optional[List[str]] = None
+    ) -> List[SearchResult]:
+        """文本搜索 (参数与SearchService.search_by_text一致；mode 只区分ocr，timeout_ms 对本地索引无意义)"""
+        if not self.documents:
+            return []
+
+        try:
+            results = await get_executor("math_analysis").run(self._search, query, limit, filters, mode)
+        except ExecutorSaturatedError:
+            raise
+        except Exception as e:
+            self.logger.error(f"本地搜索失败: {e}")
+            return []
+
+        SEARCH_TIER.labels(tier="local").inc()
+        record_search_tier("local")
+        return results
+
+    async def search_by_fingerprints(
+        self,
+        fingerprints: List[str],
+        limit: int = 5,
+        timeout_ms: Optional[float] = None
+    ) -> List[SearchResult]:
+        """公式指纹查找 (参数与SearchService.search_by_fingerprints一致)"""
+        if not self.documents or not fingerprints:
+            return []
+
+        try:
+            results = await get_executor("math_analysis").run(self._search_fingerprints, fingerprints, limit)
+        except ExecutorSaturatedError:
+            raise
+        except Exception as e:
+            self.logger.error(f"本地指纹搜索失败: {e}")
+            return []
+
+        SEARCH_TIER.labels(tier="local").inc()
+        record_search_tier("local")
+        return results
+
+    async def search_by_image_similarity(
+        self,
+        image_embedding: List[float],
+        limit: int = 5
+    ) -> List[SearchResult]:
+        """基于本地向量索引的相似度搜索 (未配置 VECTOR_INDEX_PATH 时不可用)"""
+        if self.vector_index is None:
+            self.logger.warning("未加载向量索引，本地向量搜索不可用")
+            return []
+
+        try:
+            neighbours = await get_executor("math_analysis").run(
+                self.vector_index.search, np.asarray(image_embedding, dtype=np.float32), limit
+            )
+        except ExecutorSaturatedError:
+            raise
+        except Exception as e:
+            self.logger.error(f"本地向量搜索失败: {e}")
+            return []
+
+        # 分数与ES script_score (cos+1) 一致
+        return [
+            self._doc_to_result(self.doc_rows[doc_id], score + 1.0)
+            for doc_id, score in neighbours
+            if doc_id in self.doc_rows
+        ]
+
+    async def get_index_stats(self) -> IndexStats:
+        """获取索引统计信息"""
+        size = sum(index.nbytes() for index in self.field_indexes.values())
+        return IndexStats(
+            total_documents=len(self.documents),
+            index_size=f"{size / 1024 / 1024:.2f} MB"
+        )
+
+    async def close(self):
+        """本地索引无外部连接"""
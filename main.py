@@ -6,16 +6,18 @@ CAIE搜题系统 API服务器
 
 import os
 import json
+import hashlib
+import time
 import uuid
 import asyncio
 from typing import List, Dict, Optional
 from pathlib import Path
 
 import uvicorn
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
+from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import redis
+import redis.asyncio as aioredis
 from elasticsearch import Elasticsearch
 import cv2
 import numpy as np
@@ -24,16 +26,29 @@ import io
 
 from ocr_service import OCRService  # 重新启用
 from search_service import SearchService
+from local_search_service import LocalSearchService
 from math_search_optimizer import MathSearchOptimizer
 from models import SearchResult, OCRResult, SearchRequest
+from executors import executor_stats, shutdown_executors, ExecutorSaturatedError, get_executor
+from cpu_budget import effective_thread_settings
+from metrics import render_metrics, track_stage, REJECTED_REQUESTS, EXECUTOR_QUEUE_DEPTH
+from request_timing import start_request_timing, current_request_timing, collect_search_trace
+from profiling import RequestProfiler, PROFILE_HEADER
+from responses import FastJSONResponse, CompressionMiddleware, project_results
+from admission import AdmissionController, AdmissionRejected
+from health import HealthMonitor
 
 # 初始化FastAPI应用
 app = FastAPI(
     title="CAIE搜题系统API",
     description="支持拍照搜题、OCR识别、智能搜索",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse
 )
 
+# 响应压缩 (br / gzip，超过 COMPRESSION_MIN_SIZE 字节才压缩)
+app.add_middleware(CompressionMiddleware)
+
 # 跨域设置
 app.add_middleware(
     CORSMiddleware,
@@ -43,12 +58,84 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 按接口类别的准入控制 (并发数 / 排队长度 / 排队时间预算，可选按客户端限流)
+admission_controller = AdmissionController()
+
+@app.middleware("http")
+async def admission_middleware(request: Request, call_next):
+    """文本搜索和图片OCR分别限流，排队超时或超限时快速返回 503 / 429"""
+    path = request.url.path
+    class_name = admission_controller.classify(path)
+    if class_name is None:
+        return await call_next(request)
+    
+    client_id = request.headers.get("X-Client-Id") or (request.client.host if request.client else "unknown")
+    try:
+        with track_stage("admission_wait"):
+            await admission_controller.admit(class_name, client_id)
+    except AdmissionRejected as e:
+        REJECTED_REQUESTS.labels(endpoint=path, reason=e.reason).inc()
+        return FastJSONResponse(
+            {"detail": e.detail},
+            status_code=e.status_code,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    
+    try:
+        return await call_next(request)
+    finally:
+        admission_controller.release(class_name)
+
+# 输出耗时分解的接口前缀
+TIMED_PATH_PREFIXES = ("/search", "/ocr")
+
+@app.middleware("http")
+async def server_timing_middleware(request: Request, call_next):
+    """为搜索接口记录各阶段耗时并输出 Server-Timing 响应头"""
+    if not request.url.path.startswith(TIMED_PATH_PREFIXES):
+        return await call_next(request)
+    
+    timings = start_request_timing()
+    response = await call_next(request)
+    response.headers["Server-Timing"] = timings.server_timing_header()
+    return response
+
+# 请求剖析器 (PROFILE_ADMIN_TOKEN / PROFILE_SLOW_THRESHOLD_MS 开启)
+request_profiler = RequestProfiler()
+
+@app.middleware("http")
+async def profiling_middleware(request: Request, call_next):
+    """按需或在出现慢请求后对请求运行cProfile"""
+    if not request_profiler.enabled:
+        return await call_next(request)
+    
+    path = request.url.path
+    start = time.perf_counter()
+    
+    if request_profiler.should_profile(path, request.headers.get(PROFILE_HEADER)):
+        response, stats_path = await request_profiler.profile(path, call_next, request)
+        if stats_path:
+            response.headers["X-Profile-File"] = stats_path.name
+    else:
+        response = await call_next(request)
+    
+    request_profiler.observe_latency(path, (time.perf_counter() - start) * 1000)
+    return response
+
 # 全局服务实例
 ocr_service = None
 search_service = None
 math_optimizer = None
 redis_client = None
 
+# 依赖健康状态快照 (后台定期刷新)
+health_monitor = HealthMonitor()
+
+def reject_request(endpoint: str, reason: str, status_code: int, detail: str) -> HTTPException:
+    """记录被拒绝的请求并生成HTTP异常"""
+    REJECTED_REQUESTS.labels(endpoint=endpoint, reason=reason).inc()
+    return HTTPException(status_code=status_code, detail=detail)
+
 @app.on_event("startup")
 async def startup_event():
     """应用启动时初始化服务"""
@@ -56,11 +143,15 @@ async def startup_event():
     
     print("🚀 启动CAIE搜题系统...")
     
-    # 初始化Redis
+    # 初始化Redis (异步客户端，连接池上限 REDIS_MAX_CONNECTIONS)
     try:
         redis_url = os.getenv("REDIS_URL", "redis://localhost:6379")
-        redis_client = redis.from_url(redis_url)
-        redis_client.ping()
+        redis_client = aioredis.from_url(
+            redis_url,
+            max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", "20")),
+            socket_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT_S", "2"))
+        )
+        await redis_client.ping()
         print("✅ Redis连接成功")
     except Exception as e:
         print(f"❌ Redis连接失败: {e}")
@@ -72,18 +163,67 @@ async def startup_event():
     except Exception as e:
         print(f"❌ OCR服务初始化失败: {e}")
     
+    # 本地BM25索引: SEARCH_BACKEND=local 时作为搜索服务，否则作为ES不可用时的降级
+    search_backend = os.getenv("SEARCH_BACKEND", "elasticsearch").lower()
+    local_search = None
+    if search_backend == "local" or os.getenv("SEARCH_LOCAL_FALLBACK", "true").lower() == "true":
+        try:
+            local_search = LocalSearchService()
+            await local_search.initialize()
+            print("✅ 本地搜索索引加载成功")
+        except Exception as e:
+            local_search = None
+            print(f"❌ 本地搜索索引加载失败: {e}")
+    
     # 初始化搜索服务
-    try:
-        es_url = os.getenv("ELASTICSEARCH_URL", "http://localhost:9200")
-        search_service = SearchService(es_url)
-        await search_service.initialize()
-        print("✅ 搜索服务初始化成功")
-        
-        # 初始化数学搜索优化器
+    if search_backend == "local":
+        search_service = local_search
+    else:
+        try:
+            es_url = os.getenv("ELASTICSEARCH_URL", "http://localhost:9200")
+            search_service = SearchService(es_url)
+            search_service.fallback = local_search
+            await search_service.initialize()
+            print("✅ 搜索服务初始化成功")
+        except Exception as e:
+            print(f"❌ 搜索服务初始化失败: {e}")
+            if local_search is not None:
+                search_service = local_search
+                print("⚠️  使用本地搜索索引降级运行")
+            else:
+                search_service = None
+    
+    # 初始化数学搜索优化器
+    if search_service is not None:
         math_optimizer = MathSearchOptimizer(search_service)
         print("✅ 数学搜索优化器初始化成功")
-    except Exception as e:
-        print(f"❌ 搜索服务初始化失败: {e}")
+    
+    # 启动后台健康检查
+    search_probe_name = "local_search" if isinstance(search_service, LocalSearchService) else "elasticsearch"
+    health_monitor.register(search_probe_name, probe_search)
+    health_monitor.register("redis", probe_redis)
+    health_monitor.register("ocr", probe_ocr)
+    await health_monitor.start()
+
+async def probe_search() -> bool:
+    return search_service is not None and await search_service.ping()
+
+async def probe_redis() -> bool:
+    return redis_client is not None and await redis_client.ping()
+
+async def probe_ocr() -> bool:
+    return ocr_service is not None
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时释放资源"""
+    await health_monitor.stop()
+    if redis_client:
+        await redis_client.close()
+    if search_service:
+        await search_service.close()
+    await admission_controller.close()
+    shutdown_executors()
 
 @app.get("/")
 async def root():
@@ -97,39 +237,17 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """系统健康状态"""
-    status = {
-        "elasticsearch": False,
-        "redis": False,
-        "ocr": False
+    """系统健康状态 (返回后台健康检查的最新快照，不直接访问依赖)"""
+    return {
+        **health_monitor.snapshot(),
+        "cpu": effective_thread_settings()
     }
-    
-    # 检查Elasticsearch
-    try:
-        if search_service and search_service.es.ping():
-            status["elasticsearch"] = True
-    except:
-        pass
-    
-    # 检查Redis
-    try:
-        if redis_client:
-            redis_client.ping()
-            status["redis"] = True
-    except:
-        pass
-    
-    # 检查OCR
-    if ocr_service:
-        status["ocr"] = True
-    
-    return {"status": status, "healthy": all(status.values())}
 
 @app.post("/ocr", response_model=OCRResult)
 async def extract_text(file: UploadFile = File(...)):
     """OCR文字识别接口 - 支持数学公式"""
     if not ocr_service:
-        raise HTTPException(status_code=503, detail="OCR服务未启动")
+        raise reject_request("/ocr", "service_unavailable", 503, "OCR服务未启动")
     
     try:
         # 读取图片
@@ -137,14 +255,17 @@ async def extract_text(file: UploadFile = File(...)):
         image = Image.open(io.BytesIO(contents))
         
         # OCR识别
-        result = await ocr_service.extract_text(image)
+        result = await ocr_service.extract_text(image, image_key=hashlib.sha256(contents).hexdigest())
         
-        return OCRResult(
-            text=result["text"],
-            confidence=result["confidence"],
-            boxes=result["boxes"]
-        )
+        # 字段已由OCR服务生成，直接序列化，跳过response_model校验
+        return FastJSONResponse({
+            "text": result["text"],
+            "confidence": result["confidence"],
+            "boxes": result["boxes"]
+        })
         
+    except ExecutorSaturatedError as e:
+        raise reject_request("/ocr", "executor_saturated", 503, str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"OCR处理失败: {str(e)}")
 
@@ -152,16 +273,33 @@ async def extract_text(file: UploadFile = File(...)):
 async def search_by_text(request: SearchRequest):
     """文本搜索接口"""
     if not search_service:
-        raise HTTPException(status_code=503, detail="搜索服务未启动")
+        raise reject_request("/search/text", "service_unavailable", 503, "搜索服务未启动")
+    
+    if request.fields is not None:
+        unknown = set(request.fields) - set(SearchResult.__fields__)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"未知的结果字段: {', '.join(sorted(unknown))}")
     
     try:
-        results = await search_service.search_by_text(
-            query=request.query,
-            limit=request.limit,
-            filters=request.filters
-        )
-        return results
+        with collect_search_trace() as trace:
+            results = await search_service.search_by_text(
+                query=request.query,
+                limit=request.limit,
+                filters=request.filters,
+                mode=request.mode,
+                fields=request.fields
+            )
+        
+        # 结果已是SearchResult，直接序列化 (指定字段时只返回这些字段)
+        fast_response = FastJSONResponse(project_results(results, request.fields))
+        
+        # 报告结果由哪一层给出 (exact / full)
+        if trace["tiers"]:
+            fast_response.headers["X-Search-Tier"] = trace["tiers"][-1]
+        return fast_response
         
+    except ExecutorSaturatedError as e:
+        raise reject_request("/search/text", "executor_saturated", 503, str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"搜索失败: {str(e)}")
 
@@ -172,20 +310,21 @@ async def search_by_image(
 ):
     """拍照搜题接口 - 支持数学公式识别优化"""
     if not ocr_service or not search_service or not math_optimizer:
-        raise HTTPException(status_code=503, detail="服务未完全启动")
+        raise reject_request("/search/image", "service_unavailable", 503, "服务未完全启动")
     
     try:
         # 1. OCR识别图片文字（增强版）
         contents = await file.read()
         image = Image.open(io.BytesIO(contents))
         
-        ocr_result = await ocr_service.extract_text(image)
+        ocr_result = await ocr_service.extract_text(image, image_key=hashlib.sha256(contents).hexdigest())
         
         if not ocr_result.get("original_text", "").strip():
             raise HTTPException(status_code=400, detail="未识别到文字内容")
         
-        # 2. 使用数学搜索优化器进行智能匹配
-        optimized_results = await math_optimizer.optimize_ocr_search(ocr_result)
+        # 2. 使用数学搜索优化器进行智能匹配 (超过截止时间返回部分结果)
+        with collect_search_trace() as trace:
+            optimized_results = await math_optimizer.optimize_ocr_search(ocr_result)
         
         # 3. 转换为标准SearchResult格式
         search_results = []
@@ -194,10 +333,15 @@ async def search_by_image(
             result.confidence = item['confidence']  # 使用优化后的置信度
             search_results.append(result)
         
-        return search_results
+        fast_response = FastJSONResponse(search_results)
+        if trace["partial"]:
+            fast_response.headers["X-Search-Partial"] = "true"
+        return fast_response
         
     except HTTPException:
         raise
+    except ExecutorSaturatedError as e:
+        raise reject_request("/search/image", "executor_saturated", 503, str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"拍照搜题失败: {str(e)}")
 
@@ -208,40 +352,60 @@ async def search_by_image_with_analysis(
 ):
     """拍照搜题接口 - 带详细分析结果"""
     if not ocr_service or not search_service or not math_optimizer:
-        raise HTTPException(status_code=503, detail="服务未完全启动")
+        raise reject_request("/search/image/analysis", "service_unavailable", 503, "服务未完全启动")
     
     try:
         # OCR识别
         contents = await file.read()
         image = Image.open(io.BytesIO(contents))
-        ocr_result = await ocr_service.extract_text(image)
+        ocr_result = await ocr_service.extract_text(image, image_key=hashlib.sha256(contents).hexdigest())
         
         if not ocr_result.get("original_text", "").strip():
             raise HTTPException(status_code=400, detail="未识别到文字内容")
         
-        # 优化搜索
-        optimized_results = await math_optimizer.optimize_ocr_search(ocr_result)
+        # 优化搜索 (超过截止时间返回部分结果)
+        with collect_search_trace() as trace:
+            optimized_results = await math_optimizer.optimize_ocr_search(ocr_result)
+        
+        # 分析匹配质量 (CPU密集，在 math_analysis 线程池中执行)
+        top_items = optimized_results[:limit]
+        quality_analyses = await get_executor("math_analysis").run(
+            math_optimizer.analyze_results_quality, ocr_result, top_items
+        )
+        
+        # 各策略的ES took (毫秒)
+        timings = current_request_timing()
+        timings_block = timings.to_dict() if timings else {}
+        method_took = {}
+        for entry in timings_block.get("strategies", []):
+            method_took[entry["method"]] = method_took.get(entry["method"], 0) + entry["es_took_ms"]
         
-        # 分析匹配质量
         detailed_results = []
-        for item in optimized_results[:limit]:
-            quality_analysis = math_optimizer.analyze_match_quality(ocr_result, item)
+        for item, quality_analysis in zip(top_items, quality_analyses):
+            method_scores = item.get('method_scores', {})
             detailed_results.append({
                 "result": item['result'],
                 "confidence": item['confidence'],
-                "method_scores": item.get('method_scores', {}),
+                "method_scores": method_scores,
+                "method_es_took_ms": {m: method_took.get(m, 0) for m in method_scores},
                 "method_count": item.get('method_count', 0),
                 "quality_analysis": quality_analysis
             })
         
-        return {
+        # 结果中含SearchResult和numpy数据，直接用orjson序列化，跳过jsonable_encoder
+        return FastJSONResponse({
             "ocr_result": ocr_result,
             "search_results": detailed_results,
-            "total_found": len(optimized_results)
-        }
+            "total_found": len(optimized_results),
+            "partial": trace["partial"],
+            "early_exit": trace["early_exit"],
+            "timings": timings_block
+        })
         
     except HTTPException:
         raise
+    except ExecutorSaturatedError as e:
+        raise reject_request("/search/image/analysis", "executor_saturated", 503, str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"拍照搜题失败: {str(e)}")
 
@@ -256,6 +420,52 @@ async def create_index(background_tasks: BackgroundTasks):
     
     return {"message": "索引创建任务已启动", "status": "started"}
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus监控指标"""
+    for name, stats in executor_stats().items():
+        EXECUTOR_QUEUE_DEPTH.labels(executor=name).set(stats["queue_depth"])
+    
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+@app.get("/admin/executors")
+async def get_executor_stats():
+    """管理接口：各CPU任务执行器的队列深度和运行状态"""
+    return executor_stats()
+
+@app.get("/admin/admission")
+async def get_admission_stats():
+    """管理接口：各接口类别的并发、排队和拒绝情况"""
+    return admission_controller.get_stats()
+
+@app.get("/admin/optimizer")
+async def get_optimizer_stats():
+    """管理接口：拍照搜题提前结束统计"""
+    if not math_optimizer:
+        raise HTTPException(status_code=503, detail="数学搜索优化器未启动")
+    
+    return math_optimizer.get_stats()
+
+@app.get("/admin/embedding")
+async def get_embedding_stats():
+    """管理接口：向量编码微批处理统计"""
+    if not search_service or not getattr(search_service, "embedding_service", None):
+        raise HTTPException(status_code=503, detail="向量编码服务未启动")
+    
+    return search_service.embedding_service.get_stats()
+
+@app.get("/admin/slow_queries")
+async def get_slow_queries():
+    """管理接口：慢查询日志 (含ES profile子句级耗时)"""
+    if not search_service:
+        raise HTTPException(status_code=503, detail="搜索服务未启动")
+    
+    return {
+        "threshold_ms": search_service.slow_query_log.threshold_ms,
+        "entries": search_service.slow_query_log.get_entries()
+    }
+
 @app.get("/admin/stats")
 async def get_stats():
     """管理接口：获取系统统计"""
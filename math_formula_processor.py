@@ -4,10 +4,247 @@
 专门处理数学符号标准化和公式识别
 """
 
+import os
 import re
+import math
+import hashlib
 from typing import Dict, List, Tuple
 import logging
 
+# 公式按出现顺序切分的符号: 数字、字母串、单个运算符/括号
+_FORMULA_LEXEME_PATTERN = re.compile(r'\d+(?:\.\d+)?|[a-z]+|[^\s\w]')
+
+# 相邻公式区域之间只隔着这些字符时合并为一个完整公式
+_FORMULA_GAP_PATTERN = re.compile(r'[\s+\-*/=<>^()≤≥≠×÷−]*')
+# 合并后的公式两端继续吸收的字符 (如 y=2x^2 后的 +5)
+_FORMULA_EDGE_CHARS = set("0123456789.+-*/=<>^()≤≥≠×÷−")
+# 带空格书写的公式 (y = 2x^2 + 5) 中，两端可以越过空格继续吸收运算符及其另一侧的操作数
+_FORMULA_OPERATORS = set("+-*/=<>≤≥≠×÷−")
+# 运算符另一侧的操作数: 数字、数字+单字母 (2x)、单字母变量 (x、PDF丢失上标的 x2)，不吸收 and、that 等单词
+_FORMULA_OPERAND_PATTERN = re.compile(r'\d+(?:\.\d+)?[a-zA-Z]?|[a-zA-Z]\d*')
+_FORMULA_OPERAND_CHARS_PATTERN = re.compile(r'[A-Za-z0-9.]+')
+
+# PDF提取文本中的字形名 (f/lparx/rpar = f(x))
+_PDF_GLYPHS = {
+    "/lpar": "(", "/rpar": ")", "/lbra": "[", "/rbra": "]", "/vert": "|", "/surd": "√", "/degrees": "°",
+    "/thetaslant": "θ", "/alphaslant": "α", "/muslant": "μ", "/lambdaslant": "λ"
+}
+
+# 等价哈希要求公式中至少有一个运算符或关系符
+_HASH_OPERATORS = {"+", "-", "*", "/", "^", "=", "<", ">"}
+# 公式中的字母串 (3个及以上字母)，不是函数/常数名时视为普通单词
+_FORMULA_WORD_PATTERN = re.compile(r'[a-z]{3,}')
+
+# 关系运算符 (符号序列中 <= 等被切分为两个符号)
+_RELATIONS = {"=": "=", "<": "<", ">": ">", "<=": "<=", ">=": ">=", "!=": "!="}
+_OPEN_BRACKETS = {"(": ")", "[": "]", "{": "}"}
+
+
+class _FormulaParser:
+    """递归下降解析公式符号序列，输出规范形式 (S表达式)
+    
+    加法、乘法和等式两边的操作数排序，数字系数合并，> / >= 转为 < / <=，
+    因此 2x^2+5、5+2x^2、x^2*2+5 得到相同的规范形式
+    """
+    
+    def __init__(self, lexemes: List[str], functions: set):
+        self.lexemes = lexemes
+        self.functions = functions
+        self.pos = 0
+    
+    def parse(self):
+        """解析为表达式树，有无法解析的符号时抛出ValueError"""
+        node = self._relation()
+        if self.pos != len(self.lexemes):
+            raise ValueError(f"多余的符号: {self.lexemes[self.pos]}")
+        return node
+    
+    def _peek(self, offset: int = 0):
+        index = self.pos + offset
+        return self.lexemes[index] if index < len(self.lexemes) else None
+    
+    def _take(self) -> str:
+        lexeme = self._peek()
+        if lexeme is None:
+            raise ValueError("公式不完整")
+        self.pos += 1
+        return lexeme
+    
+    def _relation_op(self):
+        """读取关系运算符 (可能由两个符号组成)，不是关系运算符时返回None"""
+        pair = (self._peek() or "") + (self._peek(1) or "")
+        if pair in _RELATIONS:
+            self.pos += 2
+            return _RELATIONS[pair]
+        if self._peek() in _RELATIONS:
+            return _RELATIONS[self._take()]
+        return None
+    
+    def _relation(self):
+        sides = [self._sum()]
+        ops = []
+        while True:
+            op = self._relation_op()
+            if op is None:
+                break
+            ops.append(op)
+            sides.append(self._sum())
+        
+        if not ops:
+            return sides[0]
+        if len(ops) == 1:
+            left, right = sides
+            op = ops[0]
+            if op in (">", ">="):
+                op, left, right = op.replace(">", "<"), right, left
+            return ("rel", op, left, right)
+        return ("chain", ops, sides)  # a<b<c 等连续关系保持原顺序
+    
+    def _sum(self):
+        terms = [self._unary()]
+        while self._peek() in ("+", "-"):
+            if self._take() == "-":
+                terms.append(("neg", self._unary()))
+            else:
+                terms.append(self._unary())
+        return terms[0] if len(terms) == 1 else ("+", terms)
+    
+    def _starts_operand(self, lexeme) -> bool:
+        return lexeme is not None and (lexeme[0].isalnum() or lexeme in _OPEN_BRACKETS)
+    
+    def _product(self, first):
+        """乘除：显式 * / 或相邻操作数的隐式乘法 (2x、x(x+1))"""
+        factors = [first]
+        while True:
+            lexeme = self._peek()
+            if lexeme == "*":
+                self._take()
+                factors.append(self._power())
+            elif lexeme == "/":
+                self._take()
+                factors.append(("inv", self._power()))
+            elif self._starts_operand(lexeme):
+                factors.append(self._power())
+            else:
+                break
+        return factors[0] if len(factors) == 1 else ("*", factors)
+    
+    def _unary(self):
+        if self._peek() == "-":
+            self._take()
+            return ("neg", self._unary())
+        if self._peek() == "+":
+            self._take()
+            return self._unary()
+        return self._product(self._power())
+    
+    def _power(self):
+        base = self._primary()
+        if self._peek() != "^":
+            return base
+        self._take()
+        if self._peek() == "-":
+            self._take()
+            return ("^", base, ("neg", self._power()))
+        return ("^", base, self._power())
+    
+    def _primary(self):
+        lexeme = self._take()
+        if lexeme in _OPEN_BRACKETS:
+            node = self._relation()
+            if self._take() != _OPEN_BRACKETS[lexeme]:
+                raise ValueError("括号不匹配")
+            return node
+        if lexeme[0].isdigit():
+            return ("num", float(lexeme))
+        if lexeme in self.functions:
+            # sin^2 x、sin(x)、sin 2x
+            exponent = None
+            if self._peek() == "^":
+                self._take()
+                exponent = self._primary()
+            # 括号内的参数到右括号为止 (sin(x)cos(x) 是两个函数的乘积)，
+            # 否则参数延续到下一个函数名或括号之前 (sin 2x)
+            bracketed = self._peek() in _OPEN_BRACKETS
+            argument = self._power()
+            while (
+                not bracketed and self._starts_operand(self._peek())
+                and self._peek() not in _OPEN_BRACKETS and self._peek() not in self.functions
+            ):
+                argument = ("*", [argument, self._power()])
+            node = ("fn", lexeme, argument)
+            return ("^", node, exponent) if exponent is not None else node
+        if lexeme.isalpha():
+            return ("var", lexeme)
+        raise ValueError(f"无法解析的符号: {lexeme}")
+    
+    @staticmethod
+    def _number(value: float) -> str:
+        if not math.isfinite(value):
+            raise ValueError("数字超出范围")
+        return str(int(value)) if value == int(value) else repr(value)
+    
+    def canonical(self, node) -> str:
+        """表达式树 -> 规范形式字符串"""
+        kind = node[0]
+        if kind == "num":
+            return self._number(node[1])
+        if kind == "var":
+            return node[1]
+        if kind == "neg":
+            return self.canonical(("*", [("num", -1.0), node[1]]))
+        if kind == "inv":
+            return f"(inv {self.canonical(node[1])})"
+        if kind == "^":
+            return f"(^ {self.canonical(node[1])} {self.canonical(node[2])})"
+        if kind == "fn":
+            return f"({node[1]} {self.canonical(node[2])})"
+        if kind == "rel":
+            _, op, left, right = node
+            sides = [self.canonical(left), self.canonical(right)]
+            if op in ("=", "!="):
+                sides.sort()
+            return f"({op} {' '.join(sides)})"
+        if kind == "chain":
+            _, ops, sides = node
+            parts = [self.canonical(sides[0])]
+            for op, side in zip(ops, sides[1:]):
+                parts.extend([op, self.canonical(side)])
+            return f"(chain {' '.join(parts)})"
+        if kind == "+":
+            terms = sorted(self.canonical(term) for term in self._flatten("+", node[1]))
+            return f"(+ {' '.join(terms)})"
+        
+        # 乘法：数字系数合并，其余因子排序
+        coefficient = 1.0
+        factors = []
+        for factor in self._flatten("*", node[1]):
+            if factor[0] == "neg":
+                coefficient = -coefficient
+                factor = factor[1]
+            if factor[0] == "num":
+                coefficient *= factor[1]
+            else:
+                factors.append(self.canonical(factor))
+        factors.sort()
+        if coefficient != 1.0 or not factors:
+            factors.insert(0, self._number(coefficient))
+        return factors[0] if len(factors) == 1 else f"(* {' '.join(factors)})"
+    
+    @staticmethod
+    def _flatten(kind: str, children: List) -> List:
+        """展开嵌套的同类运算 (a+(b+c) -> a+b+c)"""
+        flat = []
+        for child in children:
+            if child[0] == kind:
+                flat.extend(_FormulaParser._flatten(kind, child[1]))
+            elif kind == "*" and child[0] == "neg" and child[1][0] == "*":
+                flat.append(("num", -1.0))
+                flat.extend(_FormulaParser._flatten(kind, child[1][1]))
+            else:
+                flat.append(child)
+        return flat
+
 class MathFormulaProcessor:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
@@ -60,6 +297,50 @@ class MathFormulaProcessor:
             "domain": ["input", "x-values", "independent variable"],
             "range": ["output", "y-values", "dependent variable"]
         }
+        
+        # 公式中作为整体的名称 (函数、常数、希腊字母)，其他字母串按单字母变量的隐式乘积拆分
+        self.formula_names = {
+            "sin", "cos", "tan", "sec", "csc", "cosec", "cot", "log", "ln", "exp", "sqrt", "lim",
+            "pi", "alpha", "beta", "gamma", "delta", "theta", "lambda", "mu", "sigma",
+            "phi", "psi", "omega", "integral", "sum", "product", "infinity"
+        }
+        
+        # 公式解析时作为函数的名称 (其后的操作数为参数)
+        self.formula_functions = {
+            "sin", "cos", "tan", "sec", "csc", "cosec", "cot", "log", "ln", "exp", "sqrt", "lim",
+            "integral", "sum", "product"
+        }
+        
+        # PDF/OCR中常见的运算符变体和上标
+        self.operator_variants = {
+            "−": "-", "–": "-", "·": "*", "∙": "*", "⋅": "*", "²": "^2", "³": "^3"
+        }
+        
+        # 公式指纹的n-gram长度
+        self.fingerprint_ngram = int(os.getenv("FORMULA_FINGERPRINT_NGRAM", "3"))
+        
+        # 数学概念识别: 同义词按整词匹配 (using 中的 sin、constant 中的 tan 不算)
+        self.concept_patterns = [
+            (concept, re.compile(
+                r'(?<![a-z])(?:' + '|'.join(re.escape(word) for word in [concept] + synonyms) + r')(?![a-z])'
+            ))
+            for concept, synonyms in self.math_synonyms.items()
+        ]
+        # 函数名后可以紧跟一个变量 (sinx、lnx、cosθ)，其他字母不算 (tank、logs)
+        self.concept_patterns += [
+            (concept, re.compile(pattern)) for pattern, concept in [
+                (r'x\^(\d+)', 'polynomial'),
+                (r'e\^', 'exponential'),
+                (r'(?<![a-z])(?:log|ln)[xyztθ]?(?![a-z])', 'logarithmic'),
+                (r'(?<![a-z])(?:sin|cos|tan)[xyzθ]?(?![a-z])', 'trigonometric'),
+                (r'd/dx|derivative', 'calculus'),
+                (r'integral|∫', 'calculus'),
+                (r'matrix|determinant', 'linear_algebra'),
+                (r'vector', 'vector_math'),
+                (r'limit|approach', 'limits'),
+                (r'equation.*=', 'equation_solving')
+            ]
+        ]
     
     def normalize_math_symbols(self, text: str) -> str:
         """标准化数学符号"""
@@ -96,33 +377,10 @@ class MathFormulaProcessor:
     
     def extract_mathematical_concepts(self, text: str) -> List[str]:
         """提取数学概念和关键词"""
-        concepts = []
         text_lower = text.lower()
+        concepts = {concept for concept, pattern in self.concept_patterns if pattern.search(text_lower)}
         
-        # 检查基础数学概念
-        for concept, synonyms in self.math_synonyms.items():
-            if concept in text_lower or any(syn in text_lower for syn in synonyms):
-                concepts.append(concept)
-        
-        # 检查数学模式
-        patterns = [
-            (r'x\^(\d+)', 'polynomial'),
-            (r'e\^', 'exponential'),
-            (r'log|ln', 'logarithmic'),
-            (r'sin|cos|tan', 'trigonometric'),
-            (r'd/dx|derivative', 'calculus'),
-            (r'integral|∫', 'calculus'),
-            (r'matrix|determinant', 'linear_algebra'),
-            (r'vector', 'vector_math'),
-            (r'limit|approach', 'limits'),
-            (r'equation.*=', 'equation_solving')
-        ]
-        
-        for pattern, concept in patterns:
-            if re.search(pattern, text_lower):
-                concepts.append(concept)
-        
-        return list(set(concepts))
+        return sorted(concepts)
     
     def enhance_search_query(self, query: str) -> Dict[str, str]:
         """增强搜索查询，添加数学同义词"""
@@ -264,4 +522,167 @@ class MathFormulaProcessor:
             for match in re.finditer(pattern, normalized):
                 tokens.append(f"{token_type}:{match.group()}")
         
-        return tokens
\ No newline at end of file
+        return tokens
+    
+    def formula_lexemes(self, formula: str) -> List[str]:
+        """将公式按出现顺序切分为符号序列 (数字、变量/函数名、运算符、括号)，统一符号变体和大小写
+        
+        tokenize_formula 会把指数改写为文字且按类型分组输出，不保留顺序，无法用于n-gram
+        """
+        text = self._normalize_glyphs(formula)
+        for variant, replacement in self.operator_variants.items():
+            text = text.replace(variant, replacement)
+        for symbol, replacement in self.symbol_mappings.items():
+            if symbol in text:
+                text = text.replace(symbol, f" {replacement} ")
+        
+        lexemes = []
+        for lexeme in _FORMULA_LEXEME_PATTERN.findall(text.lower()):
+            if lexeme.isalpha() and len(lexeme) > 1 and lexeme not in self.formula_names:
+                lexemes.extend(lexeme)  # 2xy -> 2 x y
+            else:
+                lexemes.append(lexeme)
+        return lexemes
+    
+    @staticmethod
+    def _normalize_glyphs(text: str) -> str:
+        """PDF字形名还原为对应符号"""
+        if "/" in text:
+            for glyph, symbol in _PDF_GLYPHS.items():
+                text = text.replace(glyph, symbol)
+        return text
+    
+    @staticmethod
+    def hash_formula(text: str) -> str:
+        """公式片段的短哈希 (16位十六进制)"""
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+    
+    def formula_spans(self, text: str) -> List[str]:
+        """合并 identify_formula_regions 的重叠/相邻区域，得到完整公式 (如 y=2x、x^2 -> y=2x^2+5)"""
+        regions = sorted((start, end) for start, end, _ in self.identify_formula_regions(text))
+        
+        merged = []
+        for start, end in regions:
+            if merged and (start <= merged[-1][1] or _FORMULA_GAP_PATTERN.fullmatch(text, merged[-1][1], start)):
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        
+        spans = []
+        for start, end in merged:
+            start, end = self._extend_formula_left(text, start), self._extend_formula_right(text, end)
+            spans.append(text[start:end].strip())
+        return spans
+    
+    @staticmethod
+    def _extend_formula_right(text: str, end: int) -> int:
+        """向右吸收公式字符；空格后是运算符、或运算符后 (可隔空格) 是操作数时继续"""
+        while True:
+            while end < len(text) and text[end] in _FORMULA_EDGE_CHARS:
+                end += 1
+            
+            gap_end = end
+            while gap_end < len(text) and text[gap_end].isspace():
+                gap_end += 1
+            if gap_end == len(text):
+                return end
+            
+            if gap_end > end and (text[gap_end] in _FORMULA_OPERATORS or text[gap_end] == "("):
+                end = gap_end
+                continue
+            if end > 0 and text[end - 1] in _FORMULA_OPERATORS:
+                operand = _FORMULA_OPERAND_CHARS_PATTERN.match(text, gap_end)
+                if operand and _FORMULA_OPERAND_PATTERN.fullmatch(operand.group()):
+                    end = operand.end()
+                    continue
+            return end
+    
+    @staticmethod
+    def _extend_formula_left(text: str, start: int) -> int:
+        """向左吸收公式字符；空格前是运算符、或运算符前 (可隔空格) 是操作数时继续"""
+        while True:
+            while start > 0 and text[start - 1] in _FORMULA_EDGE_CHARS:
+                start -= 1
+            
+            gap_start = start
+            while gap_start > 0 and text[gap_start - 1].isspace():
+                gap_start -= 1
+            if gap_start == 0:
+                return start
+            
+            if gap_start < start and (text[gap_start - 1] in _FORMULA_OPERATORS or text[gap_start - 1] == ")"):
+                start = gap_start
+                continue
+            if start < len(text) and text[start] in _FORMULA_OPERATORS:
+                operand_start = gap_start
+                while operand_start > 0 and (text[operand_start - 1].isalnum() or text[operand_start - 1] == "."):
+                    operand_start -= 1
+                if _FORMULA_OPERAND_PATTERN.fullmatch(text[operand_start:gap_start]):
+                    start = operand_start
+                    continue
+            return start
+    
+    def formula_fingerprints(self, text: str) -> List[str]:
+        """公式指纹：每个完整公式的符号序列取n-gram哈希，较长的公式另加整体哈希
+        
+        与formula_tokens的单个token (如 VARIABLE:x) 不同，n-gram保留了符号顺序，区分度高，
+        适合作为keyword精确查找
+        """
+        n = self.fingerprint_ngram
+        fingerprints = set()
+        for formula in set(self.formula_spans(text)):
+            lexemes = self.formula_lexemes(formula)
+            if len(lexemes) < 2:
+                continue  # 单个符号没有区分度
+            
+            for i in range(max(len(lexemes) - n, 0) + 1):
+                fingerprints.add(self.hash_formula(" ".join(lexemes[i:i + n])))
+            if len(lexemes) > n:
+                fingerprints.add(self.hash_formula(" ".join(lexemes)))
+        
+        return sorted(fingerprints)
+    
+    def canonical_form(self, formula: str):
+        """公式的规范形式 (交换律操作数排序、符号变体统一)，无法解析时返回None"""
+        lexemes = self.formula_lexemes(formula)
+        if not lexemes:
+            return None
+        try:
+            parser = _FormulaParser(lexemes, self.formula_functions)
+            return parser.canonical(parser.parse())
+        except (ValueError, RecursionError):  # 嵌套过深 (x^x^x^...) 时递归超限
+            return None
+    
+    def _is_hashable_formula(self, formula: str, lexemes: List[str]) -> bool:
+        """含运算符/关系符、且不含普通单词的片段才取等价哈希
+        (1Find、point/lpar2 等PDF碎片会被解析为单字母变量的乘积，产生无意义的哈希)"""
+        if not any(lexeme in _HASH_OPERATORS for lexeme in lexemes):
+            return False
+        words = _FORMULA_WORD_PATTERN.findall(self._normalize_glyphs(formula).lower())
+        # 函数名后紧跟一个变量 (cosx、sint) 不算单词
+        return all(word in self.formula_names or word[:-1] in self.formula_names for word in words)
+    
+    def formula_hashes(self, text: str) -> List[str]:
+        """等价公式哈希：每个完整公式规范形式的哈希，等式/不等式的两边另外各取一个
+        
+        2x^2+5 与 5+2x^2 哈希相同，可用keyword字段精确查找
+        """
+        hashes = set()
+        for formula in set(self.formula_spans(text)):
+            lexemes = self.formula_lexemes(formula)
+            if len(lexemes) < 3:
+                continue  # 2x 之类的片段过于常见
+            if not self._is_hashable_formula(formula, lexemes):
+                continue
+            try:
+                parser = _FormulaParser(lexemes, self.formula_functions)
+                tree = parser.parse()
+                forms = [parser.canonical(tree)]
+                # y=2x^2+5 的右边也可匹配只拍到 2x^2+5 的查询 (单个变量或数字的一边不取)
+                if tree[0] == "rel":
+                    forms.extend(parser.canonical(side) for side in tree[2:] if side[0] not in ("var", "num"))
+            except (ValueError, RecursionError):  # 嵌套过深 (x^x^x^...) 时递归超限
+                continue
+            
+            hashes.update(self.hash_formula(form) for form in forms)
+        return sorted(hashes)
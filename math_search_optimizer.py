@@ -4,11 +4,19 @@
 专门优化数学公式的OCR识别和搜索匹配
 """
 
+import os
+import time
 import asyncio
 import logging
-from typing import Dict, List, Any, Tuple
+from typing import Dict, List, Any, Optional, Tuple
 from math_formula_processor import MathFormulaProcessor
 from search_service import SearchService
+from executors import get_executor
+from metrics import track_stage, PHOTO_SEARCH_STRATEGIES, EARLY_EXIT
+from request_timing import collect_search_trace, current_request_timing, current_search_trace, mark_partial
+
+# 为结果融合预留的时间 (毫秒)
+MERGE_RESERVE_MS = 50
 
 class MathSearchOptimizer:
     def __init__(self, search_service: SearchService):
@@ -17,19 +25,49 @@ class MathSearchOptimizer:
         self.search_service = search_service
         self.math_processor = MathFormulaProcessor()
         
-    async def optimize_ocr_search(self, ocr_result: Dict[str, Any]) -> List[Dict]:
-        """优化OCR结果的搜索匹配"""
+        # 拍照搜题搜索阶段的截止时间 (毫秒)，0 表示不限时
+        self.deadline_ms = float(os.getenv("PHOTO_SEARCH_DEADLINE_MS", "2000"))
+        
+        # 提前结束策略：可信策略找到的最佳候选置信度和领先幅度都达到阈值时，取消剩余策略
+        self.early_exit_enabled = os.getenv("EARLY_EXIT_ENABLED", "true").lower() == "true"
+        self.early_exit_confidence = float(os.getenv("EARLY_EXIT_CONFIDENCE", "0.9"))
+        self.early_exit_margin = float(os.getenv("EARLY_EXIT_MARGIN", "0.2"))
+        self.early_exit_min_weight = float(os.getenv("EARLY_EXIT_MIN_WEIGHT", "0.8"))
+        
+        # 拍照搜题各策略使用的文本搜索模式 (如 ocr: 字符trigram容错)，为空时使用搜索服务的默认模式
+        self.search_mode = os.getenv("OCR_SEARCH_MODE", "") or None
+        
+        # 提前结束统计
+        self.stats = {"searches": 0, "early_exits": 0, "cancelled_strategies": 0}
+        
+    async def optimize_ocr_search(self, ocr_result: Dict[str, Any], deadline_ms: Optional[float] = None) -> List[Dict]:
+        """优化OCR结果的搜索匹配
+        
+        deadline_ms: 搜索阶段的时间预算，超时后融合已完成策略的结果并标记为部分结果
+        """
+        deadline_ms = self.deadline_ms if deadline_ms is None else deadline_ms
+        deadline = time.perf_counter() + deadline_ms / 1000 if deadline_ms > 0 else None
         try:
             # 获取OCR识别的文本和特征
             original_text = ocr_result.get('original_text', '')
             enhanced_text = ocr_result.get('text', '')
             math_features = ocr_result.get('math_features', [])
             formula_tokens = ocr_result.get('formula_tokens', [])
+            formula_fingerprints = ocr_result.get('formula_fingerprints', [])
             confidence = ocr_result.get('confidence', 0.0)
             
             # 构建多层次搜索策略
             search_strategies = []
             
+            # 策略0: 公式指纹直达 - 只查找包含相同公式片段的题目，候选集小
+            if formula_fingerprints:
+                search_strategies.append({
+                    'method': 'formula_fingerprints',
+                    'query': " ".join(formula_fingerprints),
+                    'weight': 1.0,
+                    'description': '公式指纹精确查找'
+                })
+            
             # 策略1: 公式token精确匹配 (最高优先级)
             if formula_tokens:
                 token_query = " ".join(formula_tokens)
@@ -68,8 +106,10 @@ class MathSearchOptimizer:
                     'description': '原始文本模糊匹配'
                 })
             
-            # 策略5: 部分匹配 - 分解复杂公式
-            partial_queries = self._extract_partial_formulas(original_text)
+            # 策略5: 部分匹配 - 分解复杂公式 (在 math_analysis 线程池中执行)
+            partial_queries = await get_executor("math_analysis").run(
+                self._extract_partial_formulas, original_text
+            )
             for partial in partial_queries:
                 search_strategies.append({
                     'method': 'partial_formula',
@@ -79,10 +119,12 @@ class MathSearchOptimizer:
                 })
             
             # 执行并行搜索
-            search_results = await self._execute_parallel_search(search_strategies)
+            PHOTO_SEARCH_STRATEGIES.observe(len(search_strategies))
+            search_results = await self._execute_parallel_search(search_strategies, deadline, confidence)
             
             # 融合和排序结果
-            final_results = self._merge_and_rank_results(search_results, confidence)
+            with track_stage("merge_and_rank"):
+                final_results = self._merge_and_rank_results(search_results, confidence)
             
             return final_results
             
@@ -90,57 +132,183 @@ class MathSearchOptimizer:
             self.logger.error(f"OCR搜索优化失败: {e}")
             return []
     
-    async def _execute_parallel_search(self, strategies: List[Dict]) -> List[Tuple[Dict, List]]:
-        """并行执行多个搜索策略"""
-        tasks = []
+    async def _execute_parallel_search(
+        self,
+        strategies: List[Dict],
+        deadline: Optional[float] = None,
+        ocr_confidence: float = 0.0
+    ) -> List[Tuple[Dict, List]]:
+        """并行执行多个搜索策略
+        
+        deadline: time.perf_counter() 时间点，到期后取消未完成的策略，只返回已完成的结果
+        每个策略完成后检查是否可提前结束，满足条件时取消剩余策略
+        """
+        # 各策略并发执行，共享剩余时间预算 (扣除结果融合的预留时间)
+        budget_ms = None
+        if deadline is not None:
+            budget_ms = max((deadline - time.perf_counter()) * 1000 - MERGE_RESERVE_MS, 1)
         
+        task_strategies = {}
         for strategy in strategies:
             task = asyncio.create_task(
-                self._search_with_strategy(strategy)
+                self._search_with_strategy(strategy, budget_ms)
             )
-            tasks.append(task)
-        
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+            task_strategies[task] = strategy
         
-        # 过滤异常结果
+        self.stats["searches"] += 1
         valid_results = []
-        for i, result in enumerate(results):
-            if not isinstance(result, Exception):
-                valid_results.append((strategies[i], result))
+        pending = set(task_strategies)
+        early_exit = False
+        
+        while pending:
+            timeout = None
+            if deadline is not None:
+                timeout = max(deadline - time.perf_counter() - MERGE_RESERVE_MS / 1000, 0)
+            
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                break  # 截止时间已到
+            
+            # 过滤异常结果
+            for task in done:
+                strategy = task_strategies[task]
+                if task.exception() is None:
+                    valid_results.append((strategy, task.result()))
+                else:
+                    self.logger.warning(f"搜索策略失败: {strategy['method']} - {task.exception()}")
+            
+            if pending and self._should_exit_early(valid_results, ocr_confidence):
+                early_exit = True
+                break
+        
+        if pending:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            self.stats["cancelled_strategies"] += len(pending)
+            
+            if early_exit:
+                # 已找到高置信度结果，剩余策略无需执行
+                self.stats["early_exits"] += 1
+                trace = current_search_trace()
+                if trace is not None:
+                    trace["early_exit"] = True
             else:
-                self.logger.warning(f"搜索策略失败: {strategies[i]['method']} - {result}")
+                # 超过截止时间：结果标记为部分结果
+                mark_partial()
+                self.logger.warning(f"搜索截止时间已到，{len(pending)}/{len(task_strategies)} 个策略未完成")
         
+        EARLY_EXIT.labels(outcome="early_exit" if early_exit else "completed").inc()
+        
+        # 按策略原始顺序返回，保证融合结果稳定
+        order = {id(strategy): i for i, strategy in enumerate(strategies)}
+        valid_results.sort(key=lambda item: order[id(item[0])])
         return valid_results
     
-    async def _search_with_strategy(self, strategy: Dict) -> List:
-        """使用特定策略执行搜索"""
-        try:
-            method = strategy['method']
-            query = strategy['query']
-            
-            if method == 'formula_tokens':
-                # 使用特殊的token搜索
-                return await self._search_by_tokens(query)
-            elif method == 'math_features':
-                # 数学特征搜索
-                return await self._search_by_features(query)
-            else:
-                # 标准文本搜索
-                return await self.search_service.search_by_text(query, limit=5)
+    def _should_exit_early(self, search_results: List[Tuple[Dict, List]], ocr_confidence: float) -> bool:
+        """已完成策略的融合结果中，最佳候选是否足够确定"""
+        if not self.early_exit_enabled or not search_results:
+            return False
+        
+        ranked = self._merge_and_rank_results(search_results, ocr_confidence)
+        if not ranked:
+            return False
+        
+        # 使用截断前的融合分数: 截断到1.0后前几名通常并列，无法比较领先幅度
+        top = ranked[0]
+        if top['score'] < self.early_exit_confidence:
+            return False
+        
+        # 领先第二名的相对幅度 (与分数的量级无关)
+        if len(ranked) > 1 and top['score'] - ranked[1]['score'] < self.early_exit_margin * top['score']:
+            return False
+        
+        # 最佳候选必须由可信 (高权重) 策略找到
+        trusted_methods = {
+            strategy['method'] for strategy, _ in search_results
+            if strategy['weight'] >= self.early_exit_min_weight
+        }
+        return bool(trusted_methods & set(top['method_scores']))
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """提前结束统计"""
+        searches = self.stats["searches"]
+        return {
+            **self.stats,
+            "early_exit_rate": self.stats["early_exits"] / searches if searches else 0.0
+        }
+    
+    async def _search_with_strategy(self, strategy: Dict, timeout_ms: Optional[float] = None) -> List:
+        """使用特定策略执行搜索 (记录该策略的耗时、ES took和搜索层级)"""
+        start = time.perf_counter()
+        results = []
+        status = 'ok'
+        parent_trace = current_search_trace()
+        
+        with collect_search_trace() as trace:
+            try:
+                method = strategy['method']
+                query = strategy['query']
                 
-        except Exception as e:
-            self.logger.error(f"搜索策略执行失败 {strategy['method']}: {e}")
-            return []
+                if method == 'formula_fingerprints':
+                    # 公式指纹查找
+                    results = await self._search_by_fingerprints(query, timeout_ms)
+                elif method == 'formula_tokens':
+                    # 使用特殊的token搜索
+                    results = await self._search_by_tokens(query, timeout_ms)
+                elif method == 'math_features':
+                    # 数学特征搜索
+                    results = await self._search_by_features(query, timeout_ms)
+                else:
+                    # 标准文本搜索
+                    results = await self.search_service.search_by_text(
+                        query, limit=5, mode=self.search_mode, timeout_ms=timeout_ms
+                    )
+                    
+            except asyncio.CancelledError:
+                status = 'cancelled'
+                raise
+            except Exception as e:
+                self.logger.error(f"搜索策略执行失败 {strategy['method']}: {e}")
+                status = 'error'
+                results = []
+            finally:
+                # ES超时或提前终止的部分结果向上传递给整个请求
+                if trace['partial'] and parent_trace is not None:
+                    parent_trace['partial'] = True
+                
+                timings = current_request_timing()
+                if timings is not None:
+                    timings.add_strategy({
+                        'method': strategy['method'],
+                        'query': strategy['query'][:50],
+                        'status': status,
+                        'partial': trace['partial'],
+                        'es_took_ms': sum(trace['es_took_ms']),
+                        'tiers': trace['tiers'],
+                        'duration_ms': round((time.perf_counter() - start) * 1000, 2),
+                        'hits': len(results)
+                    })
+        
+        return results
     
-    async def _search_by_tokens(self, token_query: str) -> List:
+    async def _search_by_tokens(self, token_query: str, timeout_ms: Optional[float] = None) -> List:
         """基于数学token的专门搜索"""
         # 这里可以实现更精确的token匹配逻辑
-        return await self.search_service.search_by_text(token_query, limit=5)
+        return await self.search_service.search_by_text(token_query, limit=5, mode=self.search_mode, timeout_ms=timeout_ms)
+    
+    async def _search_by_fingerprints(self, fingerprint_query: str, timeout_ms: Optional[float] = None) -> List:
+        """基于公式指纹的查找"""
+        return await self.search_service.search_by_fingerprints(fingerprint_query.split(), limit=5, timeout_ms=timeout_ms)
     
-    async def _search_by_features(self, features_query: str) -> List:
+    async def _search_by_features(self, features_query: str, timeout_ms: Optional[float] = None) -> List:
         """基于数学特征的搜索"""
         # 可以根据数学特征调整搜索参数
-        return await self.search_service.search_by_text(features_query, limit=5)
+        return await self.search_service.search_by_text(features_query, limit=5, mode=self.search_mode, timeout_ms=timeout_ms)
     
     def _extract_partial_formulas(self, text: str) -> List[str]:
         """提取部分公式用于匹配"""
@@ -199,7 +367,7 @@ class MathSearchOptimizer:
                     method_score *= 0.8  # 低置信度OCR降低权重
                 
                 # 特殊加权：公式token匹配给予额外奖励
-                if method == 'formula_tokens':
+                if method in ('formula_tokens', 'formula_fingerprints'):
                     method_score *= 1.5
                 
                 merged_results[result_id]['total_score'] += method_score
@@ -215,18 +383,17 @@ class MathSearchOptimizer:
             elif item['method_count'] > 1:
                 item['total_score'] *= 1.1
             
-            # 归一化分数
-            item['total_score'] = min(item['total_score'], 1.0)
-            
+            # 归一化分数 (score 保留截断前的分数，用于排序和提前结束判断)
             final_results.append({
                 'result': item['result'],
-                'confidence': item['total_score'],
+                'confidence': min(item['total_score'], 1.0),
+                'score': item['total_score'],
                 'method_scores': item['method_scores'],
                 'method_count': item['method_count']
             })
         
         # 按最终分数排序
-        final_results.sort(key=lambda x: x['confidence'], reverse=True)
+        final_results.sort(key=lambda x: x['score'], reverse=True)
         
         return final_results[:10]  # 返回top 10
     
@@ -278,4 +445,8 @@ class MathSearchOptimizer:
                 'overall_quality': 0.0
             }
         
-        return quality_metrics
\ No newline at end of file
+        return quality_metrics
+    
+    def analyze_results_quality(self, ocr_result: Dict, search_results: List[Dict]) -> List[Dict[str, float]]:
+        """批量分析匹配质量"""
+        return [self.analyze_match_quality(ocr_result, item) for item in search_results]
\ No newline at end of file
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Prometheus监控指标
+记录拍照搜题/文本搜索各阶段耗时、ES请求耗时、缓存命中和请求拒绝次数
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    CONTENT_TYPE_LATEST,
+)
+
+from request_timing import record_timing
+
+# 毫秒级到秒级的延迟分桶
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+STAGE_LATENCY = Histogram(
+    "caie_stage_duration_seconds",
+    "各处理阶段耗时",
+    ["stage"],
+    buckets=LATENCY_BUCKETS
+)
+
+ES_REQUEST_LATENCY = Histogram(
+    "caie_es_request_duration_seconds",
+    "Elasticsearch请求耗时",
+    ["operation"],
+    buckets=LATENCY_BUCKETS
+)
+
+CACHE_HITS = Counter(
+    "caie_cache_hits_total",
+    "缓存/共享计算命中次数",
+    ["cache"]
+)
+
+SEARCH_TIER = Counter(
+    "caie_search_tier_total",
+    "文本搜索由哪一层给出结果 (exact: 仅精确子句, full: 含模糊和向量子句, rerank: 两阶段重排, ocr: trigram容错, fingerprint: 公式指纹直达, local: 本地索引)",
+    ["tier"]
+)
+
+RERANK_RECALL = Histogram(
+    "caie_rerank_recall",
+    "两阶段搜索结果相对完整评分结果的召回率 (抽样)",
+    buckets=(0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0)
+)
+
+PHOTO_SEARCH_STRATEGIES = Histogram(
+    "caie_photo_search_strategies",
+    "每次拍照搜题执行的搜索策略数",
+    buckets=(1, 2, 3, 4, 5, 6, 7, 8, 9, 10)
+)
+
+EARLY_EXIT = Counter(
+    "caie_photo_search_early_exit_total",
+    "拍照搜题是否因高置信度结果提前结束 (outcome: early_exit / completed)",
+    ["outcome"]
+)
+
+REJECTED_REQUESTS = Counter(
+    "caie_rejected_requests_total",
+    "被拒绝的请求数",
+    ["endpoint", "reason"]
+)
+
+EXECUTOR_QUEUE_DEPTH = Gauge(
+    "caie_executor_queue_depth",
+    "CPU任务执行器排队深度",
+    ["executor"],
+    multiprocess_mode="livesum"
+)
+
+
+@contextmanager
+def track_stage(stage: str):
+    """记录一个处理阶段的耗时 (同时记入当前请求的耗时分解)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.labels(stage=stage).observe(elapsed)
+        record_timing(stage, elapsed)
+
+
+@contextmanager
+def track_es_request(operation: str):
+    """记录一次Elasticsearch请求的耗时 (同时记入当前请求的耗时分解)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        ES_REQUEST_LATENCY.labels(operation=operation).observe(elapsed)
+        record_timing(f"es_{operation}", elapsed)
+
+
+def render_metrics():
+    """生成Prometheus文本格式指标，返回 (内容, content-type)
+
+    多worker部署时设置 PROMETHEUS_MULTIPROC_DIR，各进程的指标会被汇总
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -3,7 +3,7 @@
 数据模型定义
 """
 
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Literal
 from pydantic import BaseModel, Field
 
 class OCRResult(BaseModel):
@@ -17,6 +17,8 @@ class SearchRequest(BaseModel):
     query: str = Field(description="搜索关键词")
     limit: int = Field(default=10, description="返回结果数量")
     filters: Optional[Dict[str, Any]] = Field(default=None, description="搜索过滤条件")
+    mode: Optional[Literal["full", "cascade", "rerank", "ocr"]] = Field(default=None, description="搜索模式: full / cascade / rerank / ocr (默认使用服务端配置)")
+    fields: Optional[List[str]] = Field(default=None, description="只返回这些结果字段，如 [\"id\", \"title\", \"content\"] (默认全部)")
 
 class SearchResult(BaseModel):
     """搜索结果"""
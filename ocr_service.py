@@ -4,14 +4,20 @@ OCR识别服务
 支持数学公式和化学符号的高精度识别
 """
 
+import copy
 import cv2
 import numpy as np
 from PIL import Image
 import paddleocr
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 import asyncio
 import logging
 from math_formula_processor import MathFormulaProcessor
+from executors import get_executor, ExecutorSaturatedError
+from cpu_budget import get_cpu_budget, apply_opencv_threads, record_applied
+from metrics import track_stage
+from singleflight import SingleFlight
+from spell_corrector import load_spell_corrector
 
 
 class OCRService:
@@ -22,19 +28,34 @@ class OCRService:
         # 初始化数学公式处理器
         self.math_processor = MathFormulaProcessor()
 
+        # CPU线程预算：限制OpenCV和PaddleOCR的线程数
+        budget = get_cpu_budget()
+        apply_opencv_threads()
+
         # 初始化PaddleOCR
         try:
             self.ocr = paddleocr.PaddleOCR(
                 use_angle_cls=True,  # 使用角度分类器
                 lang='en',  # 英文识别
                 use_gpu=False,  # CPU模式（云服务器通常无GPU）
+                cpu_threads=budget.ocr_threads,  # 推理线程数
                 show_log=False
             )
-            self.logger.info("✅ PaddleOCR初始化成功")
+            record_applied("ocr_threads", budget.ocr_threads)
+            self.logger.info(f"✅ PaddleOCR初始化成功 (cpu_threads={budget.ocr_threads})")
         except Exception as e:
             self.logger.error(f"❌ PaddleOCR初始化失败: {e}")
             raise
 
+        # 相同图片并发时只识别一次
+        self.ocr_flight = SingleFlight("ocr")
+
+        # 基于题库词表的拼写纠正 (粘连词切分 + 对称删除纠错)，数学术语视为正确拼写
+        math_terms = set(self.math_processor.formula_names)
+        for concept, synonyms in self.math_processor.math_synonyms.items():
+            math_terms.update(word for word in [concept] + synonyms if word.isalpha())
+        self.spell_corrector = load_spell_corrector(protected=math_terms)
+
     def preprocess_image(self, image: Image.Image) -> np.ndarray:
         """图像预处理"""
         try:
@@ -69,22 +90,31 @@ class OCRService:
             # 如果预处理失败，返回原图
             return np.array(image.convert('RGB'))
 
-    async def extract_text(self, image: Image.Image) -> Dict[str, Any]:
+    async def extract_text(self, image: Image.Image, image_key: Optional[str] = None) -> Dict[str, Any]:
+        """提取图像中的文字
+
+        image_key: 图片内容哈希，相同图片的并发请求只识别一次
+        """
+        if image_key is None:
+            return await self._extract_text(image)
+
+        result = await self.ocr_flight.do(image_key, lambda: self._extract_text(image))
+        # 结果字典可能被调用方修改，每个请求使用独立副本
+        return copy.deepcopy(result)
+
+    async def _extract_text(self, image: Image.Image) -> Dict[str, Any]:
         """提取图像中的文字"""
         try:
-            # 预处理图像
-            processed_img = self.preprocess_image(image)
+            # 图像预处理 + OCR推理 (在专用 ocr 线程池中运行)
+            lines = await get_executor("ocr").run(self._recognize_image, image)
 
-            # 异步执行OCR (在线程池中运行)
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                None,
-                self._run_ocr,
-                processed_img
-            )
+            # 数学公式后处理 (在 ocr_postprocess 线程池中运行)
+            result = await get_executor("ocr_postprocess").run(self._postprocess_lines, lines)
 
             return result
 
+        except ExecutorSaturatedError:
+            raise
         except Exception as e:
             self.logger.error(f"OCR识别失败: {e}")
             return {
@@ -93,59 +123,78 @@ class OCRService:
                 "boxes": []
             }
 
-    def _run_ocr(self, image: np.ndarray) -> Dict[str, Any]:
-        """执行OCR识别"""
-        try:
-            # 使用PaddleOCR识别
-            results = self.ocr.ocr(image, cls=True)
+    def _recognize_image(self, image: Image.Image) -> List:
+        """预处理并识别图像，返回PaddleOCR原始行结果"""
+        with track_stage("image_decode"):
+            image.load()  # PIL延迟解码，在工作线程中完成
 
-            if not results or not results[0]:
-                return {
-                    "text": "",
-                    "confidence": 0.0,
-                    "boxes": []
-                }
-
-            # 解析结果
-            text_lines = []
-            confidences = []
-            boxes = []
-
-            for line in results[0]:
-                if line:
-                    box, (text, confidence) = line
-                    text_lines.append(text)
-                    confidences.append(confidence)
-                    boxes.append([int(coord) for point in box for coord in point])
-
-            # 组合文本
-            full_text = " ".join(text_lines)
-            avg_confidence = sum(confidences) / len(confidences) if confidences else 0.0
+        with track_stage("preprocess_image"):
+            processed_img = self.preprocess_image(image)
 
-            # 后处理：数学公式识别增强
-            enhanced_text = self.math_processor.process_pdf_text(full_text)
+        return self._recognize(processed_img)
 
-            # 提取数学特征用于匹配
-            math_features = self.math_processor.extract_formula_features(full_text)
-            formula_tokens = self.math_processor.tokenize_formula(full_text)
+    def _recognize(self, image: np.ndarray) -> List:
+        """执行PaddleOCR推理"""
+        with track_stage("ocr_inference"):
+            results = self.ocr.ocr(image, cls=True)
 
-            return {
-                "text": enhanced_text,
-                "original_text": full_text,
-                "math_features": math_features,
-                "formula_tokens": formula_tokens,
-                "confidence": avg_confidence,
-                "boxes": boxes
-            }
+        if not results or not results[0]:
+            return []
 
-        except Exception as e:
-            self.logger.error(f"PaddleOCR执行失败: {e}")
+        return results[0]
+
+    def _postprocess_lines(self, lines: List) -> Dict[str, Any]:
+        """解析OCR行结果并进行数学公式后处理"""
+        if not lines:
             return {
                 "text": "",
                 "confidence": 0.0,
                 "boxes": []
             }
 
+        # 解析结果
+        text_lines = []
+        confidences = []
+        boxes = []
+
+        for line in lines:
+            if line:
+                box, (text, confidence) = line
+                text_lines.append(text)
+                confidences.append(confidence)
+                boxes.append([int(coord) for point in box for coord in point])
+
+        # 组合文本
+        raw_text = " ".join(text_lines)
+        avg_confidence = sum(confidences) / len(confidences) if confidences else 0.0
+
+        # 拼写纠正：拆开粘连词、修正错字，纠正后的文本可以不依赖模糊查询
+        if self.spell_corrector is not None:
+            with track_stage("spell_correction"):
+                full_text = self.spell_corrector.correct_text(raw_text)
+        else:
+            full_text = raw_text
+
+        with track_stage("math_analysis"):
+            # 后处理：数学公式识别增强
+            enhanced_text = self.math_processor.process_pdf_text(full_text)
+
+            # 提取数学特征用于匹配
+            math_features = self.math_processor.extract_formula_features(full_text)
+            formula_tokens = self.math_processor.tokenize_formula(full_text)
+            formula_fingerprints = self.math_processor.formula_fingerprints(full_text)
+
+        return {
+            "text": enhanced_text,
+            "original_text": full_text,
+            "raw_text": raw_text,
+            "math_features": math_features,
+            "formula_tokens": formula_tokens,
+            "formula_fingerprints": formula_fingerprints,
+            "confidence": avg_confidence,
+            "boxes": boxes
+        }
+
     def _enhance_math_text(self, text: str) -> str:
         """数学公式文本增强"""
         if not text:
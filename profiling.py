@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+请求性能剖析与慢查询日志
+- 按需剖析: 请求头携带管理员令牌时对该请求运行cProfile并保存统计
+- 自动剖析: 某接口出现超过阈值的慢请求后，对该接口后续若干请求自动剖析 (同一接口有冷却时间)
+- 慢查询日志: 慢的文本搜索会用 "profile": true 重跑ES查询，记录各子句耗时 (默认关闭，重跑有最小间隔)
+"""
+
+import os
+import hmac
+import time
+import uuid
+import asyncio
+import cProfile
+import logging
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Profile-Token"
+
+
+class RequestProfiler:
+    def __init__(self):
+        """初始化请求剖析器"""
+        self.admin_token = os.getenv("PROFILE_ADMIN_TOKEN", "")
+        self.slow_threshold_ms = float(os.getenv("PROFILE_SLOW_THRESHOLD_MS", "0"))
+        self.auto_samples = int(os.getenv("PROFILE_AUTO_SAMPLES", "3"))
+        # 同一接口两次开启自动剖析的最小间隔 (持续变慢时不会一直剖析)
+        self.auto_cooldown_s = float(os.getenv("PROFILE_AUTO_COOLDOWN_S", "300"))
+        self.output_dir = Path(os.getenv("PROFILE_DIR", "profiles"))
+        # 最多保留的统计文件数，超出时删除最早的
+        self.max_files = int(os.getenv("PROFILE_MAX_FILES", "50"))
+
+        # cProfile同一时刻只能剖析一个请求
+        self._lock = threading.Lock()
+        # 接口路径 -> 剩余自动剖析次数
+        self._armed: Dict[str, int] = {}
+        # 接口路径 -> 上次开启自动剖析的时间
+        self._armed_at: Dict[str, float] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.admin_token) or self.slow_threshold_ms > 0
+
+    def should_profile(self, path: str, token: Optional[str]) -> bool:
+        """判断本次请求是否需要剖析"""
+        if self.admin_token and token and hmac.compare_digest(token.encode(), self.admin_token.encode()):
+            return True
+        if self._armed.get(path, 0) > 0:
+            self._armed[path] -= 1
+            return True
+        return False
+
+    def observe_latency(self, path: str, duration_ms: float):
+        """慢请求出现后，为该接口开启后续请求的自动剖析 (冷却时间内不重复开启)"""
+        if self.slow_threshold_ms <= 0 or duration_ms <= self.slow_threshold_ms:
+            return
+        now = time.monotonic()
+        if self._armed.get(path, 0) > 0 or now - self._armed_at.get(path, float("-inf")) < self.auto_cooldown_s:
+            return
+        logger.warning(f"🐢 慢请求 {path}: {duration_ms:.0f}ms，开启后续 {self.auto_samples} 次剖析")
+        self._armed[path] = self.auto_samples
+        self._armed_at[path] = now
+
+    async def profile(self, path: str, call_next, request):
+        """在cProfile下执行请求处理，返回 (响应, 统计文件路径)
+
+        注意: 异步处理期间交错执行的其他协程也会被计入统计
+        """
+        if not self._lock.acquire(blocking=False):
+            return await call_next(request), None
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            try:
+                response = await call_next(request)
+            finally:
+                # 处理异常时也要关闭，否则cProfile会在该线程上一直开启
+                profiler.disable()
+        finally:
+            self._lock.release()
+
+        filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}_{path.strip('/').replace('/', '_')}.prof"
+        stats_path = self.output_dir / filename
+        # 写文件不占用事件循环
+        await asyncio.get_running_loop().run_in_executor(None, self._save, profiler, stats_path)
+        logger.info(f"📊 剖析结果已保存: {stats_path}")
+
+        return response, stats_path
+
+    def _save(self, profiler: cProfile.Profile, stats_path: Path):
+        """保存统计文件，并删除超出 max_files 的最早文件"""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(str(stats_path))
+
+        files = sorted(self.output_dir.glob("*.prof"), key=lambda f: f.stat().st_mtime)
+        for old in files[:max(len(files) - self.max_files, 0)]:
+            try:
+                old.unlink()
+            except OSError as e:
+                logger.warning(f"⚠️  删除旧剖析文件失败 {old}: {e}")
+
+
+class SlowQueryLog:
+    def __init__(self, max_entries: int = 100):
+        """初始化慢查询日志 (默认关闭: 重跑profile会增加ES负载，而慢查询多出现在ES本身已经很忙的时候)"""
+        self.threshold_ms = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "0"))
+        # 两次profile重跑的最小间隔，间隔内的慢查询只记录耗时
+        self.profile_interval_s = float(os.getenv("SLOW_QUERY_PROFILE_INTERVAL_S", "60"))
+        self.entries = deque(maxlen=max_entries)
+        self._last_profile = float("-inf")
+
+    def is_slow(self, duration_ms: float) -> bool:
+        return self.threshold_ms > 0 and duration_ms > self.threshold_ms
+
+    def acquire_profile_slot(self) -> bool:
+        """距上次profile重跑已超过最小间隔时占用本次机会并返回True"""
+        now = time.monotonic()
+        if now - self._last_profile < self.profile_interval_s:
+            return False
+        self._last_profile = now
+        return True
+
+    def add(self, query: str, duration_ms: float, took_ms: int, profile: Optional[Dict[str, Any]]):
+        """记录一条慢查询 (未重跑profile时 profile 为None)"""
+        self.entries.append({
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "query": query,
+            "duration_ms": round(duration_ms, 2),
+            "took_ms": took_ms,
+            "profile": profile,
+        })
+
+    def get_entries(self) -> List[Dict[str, Any]]:
+        return list(self.entries)
+
+
+def summarize_es_profile(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """提炼ES profile结果：顶层bool查询下每个子句的耗时，按耗时降序"""
+    clauses: List[Dict[str, Any]] = []
+    total_nanos = 0
+    collector_nanos = 0
+
+    for shard in profile.get("shards", []):
+        for search in shard.get("searches", []):
+            for query in search.get("query", []):
+                total_nanos += query.get("time_in_nanos", 0)
+                # 顶层为BooleanQuery时逐个子句统计，否则统计查询本身
+                children = query.get("children") or [query]
+                for child in children:
+                    clauses.append({
+                        "type": child.get("type"),
+                        "description": child.get("description", "")[:200],
+                        "time_ms": round(child.get("time_in_nanos", 0) / 1e6, 3),
+                    })
+            for collector in search.get("collector", []):
+                collector_nanos += collector.get("time_in_nanos", 0)
+
+    clauses.sort(key=lambda c: c["time_ms"], reverse=True)
+    return {
+        "query_time_ms": round(total_nanos / 1e6, 3),
+        "collector_time_ms": round(collector_nanos / 1e6, 3),
+        "clauses": clauses,
+    }
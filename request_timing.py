@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+单请求耗时分解
+通过contextvars在一次请求内收集各阶段耗时和各搜索策略的ES took，
+用于 Server-Timing 响应头和 /search/image/analysis 的 timings 字段
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+
+class RequestTimings:
+    """一次请求的耗时记录 (可能被多个线程/任务同时写入)"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.strategies: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage: str, seconds: float):
+        """累加阶段耗时 (同一阶段多次执行时求和)"""
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_strategy(self, entry: Dict[str, Any]):
+        """记录一个搜索策略的耗时"""
+        with self._lock:
+            self.strategies.append(entry)
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.start) * 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        """结构化耗时 (毫秒)"""
+        with self._lock:
+            return {
+                "total_ms": round(self.total_ms(), 2),
+                "stages_ms": {k: round(v * 1000, 2) for k, v in self.stages.items()},
+                "strategies": list(self.strategies),
+            }
+
+    def server_timing_header(self) -> str:
+        """生成 Server-Timing 响应头"""
+        with self._lock:
+            metrics = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.stages.items()]
+        metrics.append(f"total;dur={self.total_ms():.2f}")
+        return ", ".join(metrics)
+
+
+_request_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+_search_trace: ContextVar[Optional[Dict[str, Any]]] = ContextVar("search_trace", default=None)
+
+
+def start_request_timing() -> RequestTimings:
+    """为当前请求开启耗时记录"""
+    timings = RequestTimings()
+    _request_timings.set(timings)
+    return timings
+
+
+def current_request_timing() -> Optional[RequestTimings]:
+    return _request_timings.get()
+
+
+def record_timing(stage: str, seconds: float):
+    """将阶段耗时记入当前请求 (无请求上下文时忽略)"""
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.add_stage(stage, seconds)
+
+
+def record_es_response(response: Dict[str, Any]):
+    """记录ES响应的took (毫秒) 和是否超时/提前终止，归入当前搜索策略"""
+    trace = _search_trace.get()
+    if trace is not None:
+        trace["es_took_ms"].append(response.get("took", 0))
+        if response.get("timed_out") or response.get("terminated_early"):
+            trace["partial"] = True
+
+
+def record_search_tier(tier: str):
+    """记录文本搜索由哪一层给出结果"""
+    trace = _search_trace.get()
+    if trace is not None:
+        trace["tiers"].append(tier)
+
+
+def mark_partial():
+    """标记当前搜索结果不完整 (超过截止时间)"""
+    trace = _search_trace.get()
+    if trace is not None:
+        trace["partial"] = True
+
+
+def current_search_trace() -> Optional[Dict[str, Any]]:
+    return _search_trace.get()
+
+
+@contextmanager
+def collect_search_trace():
+    """在当前任务内收集ES took、搜索层级、是否部分结果/提前结束，用于按策略/请求统计"""
+    trace: Dict[str, Any] = {"es_took_ms": [], "tiers": [], "partial": False, "early_exit": False}
+    token = _search_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _search_trace.reset(token)
+
+
+@contextmanager
+def isolated_recording():
+    """在独立的耗时记录和搜索轨迹中执行 (请求合并的共享计算不写入发起者的上下文)，
+    返回的记录可用 replay_recording 回放到每个等待方"""
+    timings = RequestTimings()
+    trace: Dict[str, Any] = {"es_took_ms": [], "tiers": [], "partial": False, "early_exit": False}
+    timings_token = _request_timings.set(timings)
+    trace_token = _search_trace.set(trace)
+    recording: Dict[str, Any] = {"stages": timings.stages, "trace": trace}
+    try:
+        yield recording
+    finally:
+        _search_trace.reset(trace_token)
+        _request_timings.reset(timings_token)
+
+
+def replay_recording(recording: Optional[Dict[str, Any]]):
+    """将共享计算的阶段耗时、ES took、搜索层级和部分结果标记记入当前请求"""
+    if not recording:
+        return
+    timings = _request_timings.get()
+    if timings is not None:
+        for stage, seconds in recording.get("stages", {}).items():
+            timings.add_stage(stage, seconds)
+
+    trace = _search_trace.get()
+    shared = recording.get("trace")
+    if trace is not None and shared:
+        trace["es_took_ms"].extend(shared.get("es_took_ms", []))
+        trace["tiers"].extend(shared.get("tiers", []))
+        trace["partial"] = trace["partial"] or shared.get("partial", False)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+快速JSON响应与响应压缩
+- FastJSONResponse: 基于orjson序列化，直接输出已构建好的结果对象，跳过response_model的重复校验
+- CompressionMiddleware: 按 Accept-Encoding 协商 br / gzip，超过大小阈值才压缩
+"""
+
+import os
+import gzip
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # 未安装时退回标准库json
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # 未安装时只支持gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# 可压缩的内容类型
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+
+def _model_to_dict(obj: BaseModel) -> Dict[str, Any]:
+    """Pydantic模型转dict (兼容v1/v2)，不做校验"""
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    return obj.dict()
+
+
+def _default(obj: Any) -> Any:
+    """orjson/json无法直接序列化的对象"""
+    if isinstance(obj, BaseModel):
+        return _model_to_dict(obj)
+    if hasattr(obj, "tolist"):  # numpy数组/标量
+        return obj.tolist()
+    raise TypeError(f"无法序列化类型: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """序列化为JSON字节串"""
+    if orjson is not None:
+        return orjson.dumps(
+            content,
+            default=_default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        )
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """orjson序列化的JSON响应，内容可直接包含Pydantic模型和numpy数组"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def project_results(results: List[BaseModel], fields: Optional[List[str]] = None) -> List[Any]:
+    """只保留指定字段 (fields 为空时原样返回)"""
+    if fields is None:
+        return results
+    return [{field: getattr(result, field) for field in fields} for result in results]
+
+
+class CompressionMiddleware:
+    """响应压缩中间件 (ASGI)
+
+    只压缩一次性返回的JSON/文本响应，流式响应和已编码的响应原样透传
+    客户端同时接受 br 和 gzip 时优先使用 brotli (需安装 brotli 包)
+    """
+
+    def __init__(self, app, minimum_size: int = None, gzip_level: int = None, brotli_quality: int = None):
+        self.app = app
+        self.minimum_size = minimum_size if minimum_size is not None else int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+        self.gzip_level = gzip_level if gzip_level is not None else int(os.getenv("GZIP_LEVEL", "6"))
+        self.brotli_quality = brotli_quality if brotli_quality is not None else int(os.getenv("BROTLI_QUALITY", "4"))
+
+    def _negotiate(self, accept_encoding: str) -> Optional[str]:
+        """选择压缩算法 (RFC 9110: q=0 表示客户端拒绝该编码，* 匹配未单独列出的编码)"""
+        qualities = {}
+        for item in accept_encoding.split(","):
+            coding, *params = item.split(";")
+            coding = coding.strip().lower()
+            if not coding:
+                continue
+            quality = 1.0
+            for param in params:
+                name, _, value = param.strip().partition("=")
+                if name.strip().lower() == "q":
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            qualities[coding] = quality
+
+        candidates = ("br", "gzip") if brotli is not None else ("gzip",)
+        for coding in candidates:
+            if qualities.get(coding, qualities.get("*", 0.0)) > 0:
+                return coding
+        return None
+
+    def _compress(self, encoding: str, body: bytes) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.minimum_size <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        encoding = self._negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+
+            if message["type"] == "http.response.start":
+                # 等拿到完整响应体后再决定是否压缩
+                start_message = message
+                return
+
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            headers = MutableHeaders(raw=start_message["headers"])
+            body = message.get("body", b"")
+            content_type = headers.get("content-type", "")
+
+            if (
+                message.get("more_body", False)
+                or "content-encoding" in headers
+                or len(body) < self.minimum_size
+                or not content_type.startswith(COMPRESSIBLE_TYPES)
+            ):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = self._compress(encoding, body)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
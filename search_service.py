@@ -4,20 +4,52 @@
 基于Elasticsearch的智能搜索引擎
 """
 
+import os
+import copy
 import json
+import time
+import random
 import asyncio
-from typing import List, Dict, Any, Optional
+import contextvars
+from typing import List, Dict, Any, Optional, Tuple
 from pathlib import Path
 import logging
 
 from elasticsearch import Elasticsearch, AsyncElasticsearch
-from elasticsearch.exceptions import NotFoundError, RequestError
+from elasticsearch.exceptions import NotFoundError, RequestError, ApiError, TransportError
 import numpy as np
-from sentence_transformers import SentenceTransformer
 
 from models import SearchResult, QuestionData, IndexStats
 from caie_math_processor import CAIEMathProcessor
 from math_formula_processor import MathFormulaProcessor
+from embedding_backend import load_embedding_model
+from embedding_service import EmbeddingService
+from executors import get_executor, ExecutorSaturatedError
+from cpu_budget import apply_torch_threads
+from metrics import track_stage, track_es_request, SEARCH_TIER, RERANK_RECALL
+from request_timing import record_es_response, record_search_tier, mark_partial
+from profiling import SlowQueryLog, summarize_es_profile
+from singleflight import SingleFlight, make_key
+from vector_index import VectorIndex, load_vector_index, quantize_int8
+from index_schema import load_index_definition, mapping_fields, mapping_version, with_element_type, prune_clauses
+
+# SearchResult字段 -> 索引文档字段 (confidence 来自评分，不在 _source 中)
+RESULT_SOURCE_FIELDS = {
+    "id": "question_id",
+    "title": "title",
+    "content": "content",
+    "year": "year",
+    "season": "season",
+    "paper_code": "paper_code",
+    "mark_scheme": "mark_scheme",
+    "file_path": "file_path",
+}
+
+# 请求合并时截止时间按该粒度分桶 (毫秒)
+DEADLINE_BUCKET_MS = 250
+
+# 向量和检索用字段体积大，不随搜索结果返回
+SOURCE_EXCLUDES = ["embedding", "formula_tokens", "formula_fingerprints", "formula_hashes", "math_features", "math_concepts"]
 
 class SearchService:
     def __init__(self, elasticsearch_url: str):
@@ -34,13 +66,72 @@ class SearchService:
         # 初始化数学公式处理器
         self.math_processor = MathFormulaProcessor()
         
-        # 初始化向量模型（用于语义搜索）
+        # 初始化向量模型（用于语义搜索），后端由 EMBEDDING_BACKEND 配置
+        # 先按CPU线程预算限制PyTorch线程数
+        apply_torch_threads()
         try:
-            self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+            self.embedding_model = load_embedding_model()
             self.logger.info("✅ 向量模型加载成功")
         except Exception as e:
             self.logger.warning(f"⚠️  向量模型加载失败: {e}")
             self.embedding_model = None
+        
+        # 查询向量微批处理服务
+        self.embedding_service = EmbeddingService(self.embedding_model) if self.embedding_model else None
+        
+        # 分层搜索配置: SEARCH_MODE=cascade 时先执行精确子句，不足时再升级
+        self.search_mode = os.getenv("SEARCH_MODE", "full")
+        self.cascade_min_hits = int(os.getenv("CASCADE_MIN_HITS", "3"))
+        self.cascade_min_score = float(os.getenv("CASCADE_MIN_SCORE", "5.0"))
+        
+        # OCR容错模式: SEARCH_MODE=ocr 时用字符trigram子句代替模糊子句，至少匹配该比例的查询trigram
+        self.trigram_min_match = os.getenv("TRIGRAM_MIN_MATCH", "40%")
+        
+        # 两阶段搜索配置: SEARCH_MODE=rerank 时先取词法top-N候选，再在本地按向量和公式token重排
+        self.rerank_candidates = int(os.getenv("RERANK_CANDIDATES", "100"))
+        # 按比例抽样在后台执行完整查询，统计重排结果相对完整评分的召回率
+        self.rerank_recall_sample_rate = float(os.getenv("RERANK_RECALL_SAMPLE_RATE", "0"))
+        
+        # 截止时间模式下每次ES请求每个分片最多收集的文档数
+        self.terminate_after = int(os.getenv("ES_TERMINATE_AFTER", "10000"))
+        
+        # 慢查询日志 (慢查询会以 profile 模式重跑以获取子句级耗时)
+        self.slow_query_log = SlowQueryLog()
+        self._background_tasks = set()
+        
+        # ES中向量的存储类型: float (4字节/维) 或 byte (按行缩放的int8，1字节/维，修改后需重建索引)
+        self.embedding_element_type = os.getenv("EMBEDDING_ELEMENT_TYPE", "float")
+        
+        # 本地内存映射向量索引 (VECTOR_INDEX_PATH)，可用时代替ES script_score
+        self.vector_index = load_vector_index()
+        self.vector_candidates = int(os.getenv("VECTOR_INDEX_CANDIDATES", "100"))
+        
+        # 查询中最多使用的公式指纹数 (每个指纹一个term子句)
+        self.max_query_fingerprints = int(os.getenv("FORMULA_FINGERPRINT_MAX_TERMS", "64"))
+        # 出现在超过该比例题目中的指纹 (如 x^2) 区分度低，查询时跳过
+        self.fingerprint_max_df = float(os.getenv("FORMULA_FINGERPRINT_MAX_DF", "0.05"))
+        self.common_fingerprints = set()
+        
+        # 主题路由: 按查询的数学概念 (math_concepts) 在filter上下文中限定 (filter) 或加分 (boost)，off 关闭
+        self.topic_routing = os.getenv("TOPIC_ROUTING", "off")
+        # 出现在超过该比例题目中的概念 (如 solve) 切分不出小范围，不参与路由
+        self.topic_max_df = float(os.getenv("TOPIC_ROUTING_MAX_DF", "0.2"))
+        self.common_concepts = set()
+        
+        # 索引定义 (ES_MAPPING_PATH，默认 elasticsearch_mapping.json)
+        self.index_definition = load_index_definition()
+        # 线上索引中存在的字段，启动时读取；为None时 (映射读取失败) 不裁剪查询子句
+        self.index_fields = None
+        self.dropped_query_fields = set()
+        
+        # ES不可用时的降级搜索服务 (如 LocalSearchService)，由调用方设置
+        self.fallback = None
+        
+        # 相同查询并发时只执行一次ES查询和向量编码
+        self.search_flight = SingleFlight(
+            "text_search",
+            decode=lambda data: [SearchResult(**item) for item in data]
+        )
     
     async def initialize(self):
         """初始化搜索服务"""
@@ -51,6 +142,9 @@ class SearchService:
             
             # 创建索引
             await self.create_index()
+            await self.load_index_fields()
+            await self.load_common_fingerprints()
+            await self.load_common_concepts()
             
             self.logger.info("✅ 搜索服务初始化完成")
             
@@ -60,71 +154,8 @@ class SearchService:
     
     async def create_index(self):
         """创建Elasticsearch索引"""
-        index_mapping = {
-            "mappings": {
-                "properties": {
-                    "question_id": {"type": "keyword"},
-                    "content": {
-                        "type": "text",
-                        "analyzer": "standard",
-                        "search_analyzer": "standard",
-                        "fields": {
-                            "keyword": {"type": "keyword"},
-                            "english": {
-                                "type": "text",
-                                "analyzer": "english"
-                            }
-                        }
-                    },
-                    "title": {
-                        "type": "text",
-                        "analyzer": "standard"
-                    },
-                    "year": {"type": "keyword"},
-                    "season": {"type": "keyword"},
-                    "paper_code": {"type": "keyword"},
-                    "subject_code": {"type": "keyword"},
-                    "mark_scheme": {
-                        "type": "text",
-                        "analyzer": "standard"
-                    },
-                    "file_path": {"type": "keyword"},
-                    "embedding": {
-                        "type": "dense_vector",
-                        "dims": 384  # all-MiniLM-L6-v2的向量维度
-                    },
-                    "created_at": {"type": "date"}
-                }
-            },
-            "settings": {
-                "number_of_shards": 1,
-                "number_of_replicas": 0,
-                "analysis": {
-                    "analyzer": {
-                        "math_analyzer": {
-                            "tokenizer": "standard",
-                            "filter": [
-                                "lowercase",
-                                "stop",
-                                "math_synonyms"
-                            ]
-                        }
-                    },
-                    "filter": {
-                        "math_synonyms": {
-                            "type": "synonym",
-                            "synonyms": [
-                                "differentiate,derivative,diff",
-                                "integrate,integration,integral",
-                                "solve,find,calculate,determine",
-                                "function,equation,formula",
-                                "graph,plot,curve,line"
-                            ]
-                        }
-                    }
-                }
-            }
-        }
+        # 映射和分析器统一来自 elasticsearch_mapping.json，向量存储类型按 EMBEDDING_ELEMENT_TYPE 覆盖
+        index_mapping = with_element_type(self.index_definition, self.embedding_element_type)
         
         try:
             # 检查索引是否存在
@@ -146,6 +177,48 @@ class SearchService:
                 self.logger.error(f"❌ 创建索引失败: {e}")
                 raise
     
+    async def load_index_fields(self):
+        """读取线上索引的映射，记录可查询的字段，并检查映射版本是否落后于索引定义"""
+        try:
+            response = self.es.indices.get_mapping(index=self.index_name)
+        except Exception as e:
+            self.logger.warning(f"⚠️  读取索引映射失败，查询子句不做裁剪: {e}")
+            self.index_fields = None
+            return
+        
+        fields = set()
+        live_versions = set()
+        for index_mapping in response.values():
+            mappings = index_mapping.get("mappings", {})
+            fields |= mapping_fields(mappings.get("properties"))
+            live_versions.add(mapping_version(mappings))
+        self.index_fields = fields
+        
+        expected_version = mapping_version(self.index_definition["mappings"])
+        if any(version is None or version < expected_version for version in live_versions):
+            self.logger.warning(
+                f"⚠️  索引 {self.index_name} 的映射版本 {sorted(live_versions, key=str)} "
+                f"落后于定义文件 (version {expected_version})，需重建索引才能使用新字段"
+            )
+        
+        # 用一个包含公式的示例查询检查子句，启动时即记录被去掉的字段
+        self.dropped_query_fields = set()
+        probe = "Differentiate f(x) = 2x^2 + 5 with respect to x"
+        self._build_text_clauses(probe, self._analyze_query(probe))
+    
+    def _prune_text_clauses(self, clauses: Dict[str, List[Dict]]) -> Dict[str, List[Dict]]:
+        """去掉引用线上索引中不存在字段的子句，新出现的缺失字段记录一次日志"""
+        if self.index_fields is None:
+            return clauses
+        
+        dropped = set()
+        pruned = {tier: prune_clauses(tier_clauses, self.index_fields, dropped) for tier, tier_clauses in clauses.items()}
+        new_dropped = dropped - self.dropped_query_fields
+        if new_dropped:
+            self.dropped_query_fields |= new_dropped
+            self.logger.warning(f"⚠️  索引 {self.index_name} 中不存在字段 {sorted(new_dropped)}，相关查询子句已去掉")
+        return pruned
+    
     async def build_index(self):
         """构建搜索索引"""
         self.logger.info("🔨 开始构建搜索索引...")
@@ -153,13 +226,14 @@ class SearchService:
         try:
             # 使用CAIE数学处理器提取数据
             processor = CAIEMathProcessor("/Users/patrick/Desktop/Container")
+            pdf_executor = get_executor("pdf_parsing")
             
             # 扫描试卷
-            papers = processor.scan_papers()
+            papers = await pdf_executor.run(processor.scan_papers)
             self.logger.info(f"找到 {len(papers)} 个试卷文件")
             
-            # 匹配题目和答案
-            processor.match_questions_with_answers()
+            # 匹配题目和答案 (PDF解析在专用线程池中执行)
+            await pdf_executor.run(processor.match_questions_with_answers)
             questions = processor.questions
             
             self.logger.info(f"提取到 {len(questions)} 个题目")
@@ -175,49 +249,18 @@ class SearchService:
     
     async def _bulk_index_questions(self, questions: List, batch_size: int = 100):
         """批量索引题目"""
+        pdf_executor = get_executor("pdf_parsing")
+        vector_ids, vectors = [], []
+        
         for i in range(0, len(questions), batch_size):
             batch = questions[i:i + batch_size]
-            actions = []
             
-            for question in batch:
-                # 生成文档ID
-                doc_id = question.question_id
-                
-                # 增强数学内容处理
-                enhanced_content = self.math_processor.process_pdf_text(question.content)
-                math_features = self.math_processor.extract_formula_features(question.content)
-                formula_tokens = self.math_processor.tokenize_formula(question.content)
-                
-                # 准备文档数据
-                doc = {
-                    "question_id": question.question_id,
-                    "content": enhanced_content,
-                    "math_features": " ".join(math_features),
-                    "formula_tokens": formula_tokens,
-                    "title": f"Question {question.question_id}",
-                    "year": question.paper_info.year,
-                    "season": question.paper_info.season,
-                    "paper_code": question.paper_info.paper_code,
-                    "subject_code": "9709",
-                    "mark_scheme": question.mark_scheme or "",
-                    "file_path": question.paper_info.file_path,
-                    "created_at": "2024-01-01T00:00:00"
-                }
-                
-                # 生成向量嵌入
-                if self.embedding_model:
-                    try:
-                        embedding = self.embedding_model.encode(question.content)
-                        doc["embedding"] = embedding.tolist()
-                    except Exception as e:
-                        self.logger.warning(f"生成嵌入向量失败: {e}")
-                
-                # 添加到批次
-                actions.append({
-                    "_index": self.index_name,
-                    "_id": doc_id,
-                    "_source": doc
-                })
+            # 文档预处理和向量编码在专用线程池中执行，不阻塞事件循环
+            actions = await pdf_executor.run(self._prepare_index_actions, batch)
+            for action in actions:
+                if "embedding" in action["_source"]:
+                    vector_ids.append(action["_id"])
+                    vectors.append(action["_source"]["embedding"])
             
             # 执行批量索引 - 修复格式
             try:
@@ -234,166 +277,786 @@ class SearchService:
                     self.logger.info(f"成功索引 {len(actions)} 个文档")
             except Exception as e:
                 self.logger.error(f"批量索引失败: {e}")
+        
+        # 同时生成本地向量索引
+        index_dir = os.getenv("VECTOR_INDEX_PATH", "")
+        if index_dir and vectors:
+            dtype = os.getenv("VECTOR_INDEX_DTYPE", "float32")
+            await pdf_executor.run(VectorIndex.save, index_dir, vector_ids, vectors, dtype)
+            self.vector_index = load_vector_index(index_dir)
+        
+        # 重新读取字段 (动态映射可能新增字段) 并统计高频公式指纹和概念
+        self.es.indices.refresh(index=self.index_name)
+        await self.load_index_fields()
+        await self.load_common_fingerprints()
+        await self.load_common_concepts()
     
-    async def search_by_text(
-        self, 
-        query: str, 
-        limit: int = 10,
-        filters: Optional[Dict] = None
-    ) -> List[SearchResult]:
-        """文本搜索 - 支持数学公式增强"""
-        try:
-            # 使用数学公式处理器增强查询
-            enhanced_queries = self.math_processor.enhance_search_query(query)
+    def _prepare_index_actions(self, batch: List) -> List[Dict]:
+        """生成一批题目的索引文档 (CPU密集，在线程池中运行)"""
+        actions = []
+        
+        for question in batch:
+            # 生成文档ID
+            doc_id = question.question_id
             
-            # 构建增强的搜索查询
-            search_body = {
-                "query": {
-                    "bool": {
-                        "should": [
-                            # 数学公式token精确匹配 - 最高权重
-                            {
-                                "terms": {
-                                    "formula_tokens": self.math_processor.tokenize_formula(query),
-                                    "boost": 5.0
-                                }
-                            },
-                            # 数学特征匹配
-                            {
-                                "multi_match": {
-                                    "query": " ".join(self.math_processor.extract_formula_features(query)),
-                                    "fields": ["math_features^3"],
-                                    "type": "best_fields",
-                                    "boost": 4.0
-                                }
-                            },
-                            # 数学符号字段精确匹配
-                            {
-                                "match": {
-                                    "content.math_symbols": {
-                                        "query": enhanced_queries.get('normalized', query),
-                                        "boost": 3.5
-                                    }
-                                }
-                            },
-                            # 数学概念匹配
-                            {
-                                "match": {
-                                    "content.math_concepts": {
-                                        "query": enhanced_queries.get('expanded', query),
-                                        "boost": 3.0
-                                    }
-                                }
-                            },
-                            # 原始查询 - 精确短语匹配
-                            {
-                                "match_phrase": {
-                                    "content": {
-                                        "query": enhanced_queries.get('original', query),
-                                        "boost": 2.5
-                                    }
-                                }
-                            },
-                            # 标准化查询 - 数学符号处理
-                            {
-                                "multi_match": {
-                                    "query": enhanced_queries.get('normalized', query),
-                                    "fields": ["content^2", "title", "mark_scheme"],
-                                    "type": "best_fields",
-                                    "fuzziness": "AUTO",
-                                    "boost": 2.0
-                                }
-                            },
-                            # 扩展查询 - 概念同义词
-                            {
-                                "multi_match": {
-                                    "query": enhanced_queries.get('expanded', query),
-                                    "fields": ["content^1.5", "title", "mark_scheme"],
-                                    "type": "best_fields",
-                                    "fuzziness": "AUTO",
-                                    "boost": 1.5
-                                }
-                            },
-                            # 模糊匹配 - 兜底搜索
-                            {
-                                "multi_match": {
-                                    "query": query,
-                                    "fields": ["content", "title", "mark_scheme"],
-                                    "type": "best_fields",
-                                    "fuzziness": "AUTO",
-                                    "boost": 1.0
-                                }
-                            },
-                        ],
-                        "minimum_should_match": 1
+            # 增强数学内容处理
+            enhanced_content = self.math_processor.process_pdf_text(question.content)
+            math_features = self.math_processor.extract_formula_features(question.content)
+            formula_tokens = self.math_processor.tokenize_formula(question.content)
+            formula_fingerprints = self.math_processor.formula_fingerprints(question.content)
+            formula_hashes = self.math_processor.formula_hashes(question.content)
+            math_concepts = self.math_processor.extract_mathematical_concepts(question.content)
+            
+            # 准备文档数据
+            doc = {
+                "question_id": question.question_id,
+                "content": enhanced_content,
+                "math_features": " ".join(math_features),
+                "formula_tokens": formula_tokens,
+                "formula_fingerprints": formula_fingerprints,
+                "formula_hashes": formula_hashes,
+                "math_concepts": math_concepts,
+                "title": f"Question {question.question_id}",
+                "year": question.paper_info.year,
+                "season": question.paper_info.season,
+                "paper_code": question.paper_info.paper_code,
+                "subject_code": "9709",
+                "mark_scheme": question.mark_scheme or "",
+                "file_path": question.paper_info.file_path,
+                "created_at": "2024-01-01T00:00:00"
+            }
+            
+            # 生成向量嵌入
+            if self.embedding_model:
+                try:
+                    embedding = self.embedding_model.encode(question.content)
+                    doc["embedding"] = self._to_index_vector(embedding)
+                except Exception as e:
+                    self.logger.warning(f"生成嵌入向量失败: {e}")
+            
+            # 添加到批次
+            actions.append({
+                "_index": self.index_name,
+                "_id": doc_id,
+                "_source": doc
+            })
+        
+        return actions
+    
+    def _analyze_query(self, query: str) -> Dict[str, Any]:
+        """查询数学分析 (CPU密集，在 math_analysis 线程池中运行)"""
+        with track_stage("math_analysis"):
+            return {
+                "enhanced": self.math_processor.enhance_search_query(query),
+                "formula_tokens": self.math_processor.tokenize_formula(query),
+                "formula_fingerprints": self.math_processor.formula_fingerprints(query),
+                "formula_hashes": self.math_processor.formula_hashes(query),
+                "math_features": self.math_processor.extract_formula_features(query),
+                "math_concepts": self.math_processor.extract_mathematical_concepts(query)
+            }
+    
+    def _common_terms(self, field: str, max_df: float) -> set:
+        """出现在超过 max_df 比例题目中的词项 (一次terms聚合)"""
+        total = self.es.count(index=self.index_name)["count"]
+        if not total:
+            return set()
+        response = self.es.search(index=self.index_name, body={
+            "size": 0,
+            "aggs": {
+                "common": {
+                    "terms": {
+                        "field": field,
+                        "min_doc_count": max(int(total * max_df), 1) + 1,
+                        "size": 10000
                     }
-                },
-                "size": limit,
-                "highlight": {
-                    "fields": {
-                        "content": {"fragment_size": 200},
-                        "math_features": {"fragment_size": 100}
+                }
+            }
+        })
+        return {bucket["key"] for bucket in response["aggregations"]["common"]["buckets"]}
+    
+    async def load_common_fingerprints(self):
+        """统计高频公式指纹，查询时跳过这些指纹"""
+        try:
+            self.common_fingerprints = self._common_terms("formula_fingerprints", self.fingerprint_max_df)
+            self.logger.info(f"📊 高频公式指纹 {len(self.common_fingerprints)} 个 (出现在 >{self.fingerprint_max_df:.0%} 的题目中)")
+        except Exception as e:
+            self.logger.warning(f"⚠️  高频公式指纹统计失败: {e}")
+    
+    async def load_common_concepts(self):
+        """统计高频数学概念，主题路由时跳过这些概念"""
+        if self.topic_routing == "off":
+            return
+        try:
+            self.common_concepts = self._common_terms("math_concepts", self.topic_max_df)
+            self.logger.info(f"📊 高频数学概念 {sorted(self.common_concepts)} (出现在 >{self.topic_max_df:.0%} 的题目中)")
+        except Exception as e:
+            self.logger.warning(f"⚠️  高频数学概念统计失败: {e}")
+    
+    def _routing_concepts(self, concepts: List[str]) -> List[str]:
+        """参与主题路由的查询概念 (全部为高频概念时不路由)"""
+        return [concept for concept in concepts if concept not in self.common_concepts]
+    
+    def _selective_fingerprints(self, fingerprints: List[str]) -> List[str]:
+        """去掉高频指纹；全部为高频指纹时原样保留"""
+        selective = [fp for fp in fingerprints if fp not in self.common_fingerprints]
+        return (selective or fingerprints)[:self.max_query_fingerprints]
+    
+    def _build_fingerprint_clause(self, fingerprints: List[str], boost: float = 6.0) -> Dict:
+        """公式指纹子句：每个指纹一个term查询，按idf计分，罕见的指纹权重更高"""
+        return {
+            "bool": {
+                "should": [
+                    {"term": {"formula_fingerprints": fingerprint}}
+                    for fingerprint in self._selective_fingerprints(fingerprints)
+                ],
+                "boost": boost
+            }
+        }
+    
+    def _build_text_clauses(self, query: str, analysis: Dict[str, Any]) -> Dict[str, List[Dict]]:
+        """构建文本搜索子句，按代价分层
+        - exact: 等价公式哈希、公式指纹、公式token、数学特征、短语等精确子句，开销低
+        - token: 标准化查询的非模糊多字段匹配 (仅分层搜索第一层使用)
+        - fuzzy: fuzziness AUTO 的多字段模糊匹配，开销高
+        - trigram: content.trigram 字符trigram匹配 (ocr模式代替fuzzy)
+        - topic: 查询概念的 math_concepts 过滤子句 (主题路由，不参与评分)
+        """
+        enhanced_queries = analysis["enhanced"]
+        
+        exact = [
+            # 数学公式token精确匹配 - 最高权重
+            {
+                "terms": {
+                    "formula_tokens": analysis["formula_tokens"],
+                    "boost": 5.0
+                }
+            },
+            # 数学特征匹配
+            {
+                "multi_match": {
+                    "query": " ".join(analysis["math_features"]),
+                    "fields": ["math_features^3"],
+                    "type": "best_fields",
+                    "boost": 4.0
+                }
+            },
+            # 数学符号字段精确匹配
+            {
+                "match": {
+                    "content.math_symbols": {
+                        "query": enhanced_queries.get('normalized', query),
+                        "boost": 3.5
+                    }
+                }
+            },
+            # 数学概念匹配
+            {
+                "match": {
+                    "content.math_concepts": {
+                        "query": enhanced_queries.get('expanded', query),
+                        "boost": 3.0
+                    }
+                }
+            },
+            # 原始查询 - 精确短语匹配
+            {
+                "match_phrase": {
+                    "content": {
+                        "query": enhanced_queries.get('original', query),
+                        "boost": 2.5
+                    }
+                }
+            },
+        ]
+        
+        # 公式指纹精确查找 - 区分度最高的子句
+        if analysis["formula_fingerprints"]:
+            exact.insert(0, self._build_fingerprint_clause(analysis["formula_fingerprints"]))
+        
+        # 等价公式查找 (2x^2+5 与 5+2x^2 规范形式相同) - 常数分，命中即可满足分层搜索第一层
+        if analysis["formula_hashes"]:
+            exact.insert(0, {
+                "terms": {
+                    "formula_hashes": analysis["formula_hashes"],
+                    "boost": 8.0
+                }
+            })
+        
+        token = [
+            # 标准化查询 - 不做模糊扩展
+            {
+                "multi_match": {
+                    "query": enhanced_queries.get('normalized', query),
+                    "fields": ["content^2", "title", "mark_scheme"],
+                    "type": "best_fields",
+                    "boost": 2.0
+                }
+            },
+        ]
+        
+        fuzzy = [
+            # 标准化查询 - 数学符号处理
+            {
+                "multi_match": {
+                    "query": enhanced_queries.get('normalized', query),
+                    "fields": ["content^2", "title", "mark_scheme"],
+                    "type": "best_fields",
+                    "fuzziness": "AUTO",
+                    "boost": 2.0
+                }
+            },
+            # 扩展查询 - 概念同义词
+            {
+                "multi_match": {
+                    "query": enhanced_queries.get('expanded', query),
+                    "fields": ["content^1.5", "title", "mark_scheme"],
+                    "type": "best_fields",
+                    "fuzziness": "AUTO",
+                    "boost": 1.5
+                }
+            },
+            # 模糊匹配 - 兜底搜索
+            {
+                "multi_match": {
+                    "query": query,
+                    "fields": ["content", "title", "mark_scheme"],
+                    "type": "best_fields",
+                    "fuzziness": "AUTO",
+                    "boost": 1.0
+                }
+            },
+        ]
+        
+        trigram = [
+            # 字符trigram匹配 - OCR错字只影响少数trigram，开销与词表大小无关
+            {
+                "match": {
+                    "content.trigram": {
+                        "query": enhanced_queries.get('normalized', query),
+                        "minimum_should_match": self.trigram_min_match,
+                        "boost": 2.0
                     }
                 }
+            },
+        ]
+        
+        topic = []
+        routing_concepts = self._routing_concepts(analysis["math_concepts"])
+        if self.topic_routing != "off" and routing_concepts:
+            # 含任一查询概念的题目 (题目包含查询文本时，其概念包含查询的概念)
+            topic.append({"terms": {"math_concepts": routing_concepts}})
+        
+        return self._prune_text_clauses({
+            "exact": exact, "token": token, "fuzzy": fuzzy, "trigram": trigram, "topic": topic
+        })
+    
+    def _to_index_vector(self, embedding) -> List:
+        """转换为ES dense_vector字段的取值 (byte类型时按行缩放量化，余弦相似度不受缩放影响)"""
+        if self.embedding_element_type == "byte":
+            return quantize_int8(embedding)[0][0].tolist()
+        return np.asarray(embedding, dtype=np.float32).tolist()
+    
+    def _search_vector_index(self, query_embedding: np.ndarray, k: int) -> List:
+        """本地向量索引top-k (矩阵-向量乘积，在 math_analysis 线程池中运行)"""
+        with track_stage("vector_index_search"):
+            return self.vector_index.search(query_embedding, k)
+    
+    async def _vector_clause(self, query: str) -> Optional[Dict]:
+        """编码查询并生成向量子句：有本地向量索引时只为最近邻题目加分，否则使用ES script_score
+        (本地索引中没有近邻时返回None)"""
+        query_embedding = await self.embedding_service.encode(query)
+        if self.vector_index is not None:
+            neighbours = await get_executor("math_analysis").run(
+                self._search_vector_index, query_embedding, self.vector_candidates
+            )
+            return self._build_vector_ids_clause(neighbours)
+        return self._build_vector_clause(self._to_index_vector(query_embedding))
+    
+    def _build_vector_ids_clause(self, neighbours: List) -> Optional[Dict]:
+        """最近邻题目按相似度加分 (与script_score的 (cos+1)*3.5 评分一致)
+
+        没有近邻时返回None: 空的 bool should 会匹配所有文档
+        """
+        if not neighbours:
+            return None
+        return {
+            "bool": {
+                "should": [
+                    {
+                        "constant_score": {
+                            "filter": {"ids": {"values": [doc_id]}},
+                            "boost": max((score + 1.0) * 3.5, 0.0)
+                        }
+                    }
+                    for doc_id, score in neighbours
+                ]
+            }
+        }
+    
+    def _build_vector_clause(self, query_embedding: List[float]) -> Dict:
+        """向量语义匹配子句 - 提高权重用于数学公式语义匹配"""
+        return {
+            "script_score": {
+                "query": {"match_all": {}},
+                "script": {
+                    "source": "cosineSimilarity(params.query_vector, 'embedding') + 1.0",
+                    "params": {"query_vector": query_embedding}
+                },
+                "boost": 3.5  # 提高向量搜索权重
+            }
+        }
+    
+    @staticmethod
+    def _matches_all(clause: Dict) -> bool:
+        """子句是否匹配全部文档 (如 match_all 上的 script_score 向量子句)"""
+        return "match_all" in clause or "match_all" in clause.get("script_score", {}).get("query", {})
+    
+    def _build_text_search_body(
+        self,
+        should: List[Dict],
+        limit: int,
+        filters: Optional[Dict],
+        timeout_ms: Optional[float] = None,
+        fields: Optional[List[str]] = None,
+        topic: Optional[List[Dict]] = None
+    ) -> Dict:
+        """组装文本搜索请求体 (timeout_ms 为本次ES请求的剩余时间预算，fields 为需要返回的结果字段，
+        topic 为主题路由子句)"""
+        search_body = {
+            "query": {
+                "bool": {
+                    "should": should,
+                    "minimum_should_match": 1
+                }
+            },
+            "size": limit,
+            "_source": self._source_filter(fields)
+        }
+        
+        # 只有返回内容时才需要高亮片段
+        if fields is None or "content" in fields:
+            search_body["highlight"] = {
+                "fields": {
+                    "content": {"fragment_size": 200},
+                    "math_features": {"fragment_size": 100}
+                }
+            }
+        
+        # 添加过滤条件
+        filter_clauses = []
+        if filters:
+            for field, value in filters.items():
+                filter_clauses.append({"term": {field: value}})
+        
+        # 主题路由: filter 模式下评分子句只在主题范围内执行；boost 模式下主题内的题目加常数分
+        # 两种方式的主题子句都在filter上下文中，结果由ES按段缓存
+        if topic and self.topic_routing == "filter":
+            filter_clauses.extend(topic)
+        
+        if filter_clauses:
+            search_body["query"]["bool"]["filter"] = filter_clauses
+        
+        if topic and self.topic_routing == "boost":
+            search_body["query"] = {
+                "bool": {
+                    "must": [search_body["query"]],
+                    "should": [{"constant_score": {"filter": clause, "boost": 2.0}} for clause in topic]
+                }
             }
+        
+        # 截止时间：分片级超时 + 限制收集文档数，超时返回已收集的部分结果
+        # 含 match_all 向量子句时所有文档都匹配，按索引顺序截断只会得到前N个文档而不是得分最高的，只依赖 timeout
+        if timeout_ms is not None:
+            search_body["timeout"] = f"{max(int(timeout_ms), 1)}ms"
+            if self.terminate_after > 0 and not any(self._matches_all(clause) for clause in should):
+                search_body["terminate_after"] = self.terminate_after
+        
+        return search_body
+    
+    async def _execute_text_search(self, query: str, search_body: Dict, start_time: float) -> Dict:
+        """执行文本搜索请求 (异步客户端，不阻塞事件循环)"""
+        with track_es_request("text_search"):
+            response = await self.async_es.search(
+                index=self.index_name,
+                body=search_body
+            )
+        record_es_response(response)
+        
+        # 慢查询：后台重跑ES profile，不影响当前请求；间隔内的其他慢查询只记录耗时
+        duration_ms = (time.perf_counter() - start_time) * 1000
+        if self.slow_query_log.is_slow(duration_ms):
+            if self.slow_query_log.acquire_profile_slot():
+                task = asyncio.create_task(
+                    self._capture_slow_query(query, search_body, duration_ms, response.get("took", 0))
+                )
+                self._background_tasks.add(task)
+                task.add_done_callback(self._background_tasks.discard)
+            else:
+                self.slow_query_log.add(query, duration_ms, response.get("took", 0), None)
+        
+        return response
+    
+    @staticmethod
+    def _source_filter(fields: Optional[List[str]] = None) -> Dict[str, List[str]]:
+        """_source 投影：只取结果需要的字段，排除向量等大字段"""
+        if fields is None:
+            includes = list(RESULT_SOURCE_FIELDS.values())
+        else:
+            includes = [RESULT_SOURCE_FIELDS[f] for f in fields if f in RESULT_SOURCE_FIELDS]
+            # 至少取ID，用于多策略结果融合
+            if "question_id" not in includes:
+                includes.append("question_id")
+        return {"includes": includes, "excludes": SOURCE_EXCLUDES}
+    
+    @staticmethod
+    def _hit_to_result(hit: Dict, content: Optional[str] = None) -> SearchResult:
+        """ES命中 -> SearchResult (未投影的字段置空)"""
+        source = hit["_source"]
+        return SearchResult(
+            id=source["question_id"],
+            title=source.get("title", ""),
+            content=content if content is not None else source.get("content", ""),
+            year=source.get("year", ""),
+            season=source.get("season", ""),
+            paper_code=source.get("paper_code", ""),
+            mark_scheme=source.get("mark_scheme"),
+            confidence=hit["_score"] / 10.0,  # 归一化分数
+            file_path=source.get("file_path")
+        )
+    
+    def _parse_text_hits(self, response: Dict) -> List[SearchResult]:
+        """解析文本搜索结果"""
+        results = []
+        for hit in response["hits"]["hits"]:
+            # 获取高亮文本
+            highlight = hit.get("highlight", {})
+            content = highlight["content"][0] if "content" in highlight else None
             
-            # 添加向量搜索 - 提高权重用于数学公式语义匹配
-            if self.embedding_model:
-                query_embedding = self.embedding_model.encode(query).tolist()
-                search_body["query"]["bool"]["should"].append({
-                    "script_score": {
-                        "query": {"match_all": {}},
-                        "script": {
-                            "source": "cosineSimilarity(params.query_vector, 'embedding') + 1.0",
-                            "params": {"query_vector": query_embedding}
-                        },
-                        "boost": 3.5  # 提高向量搜索权重
-                    }
-                })
+            results.append(self._hit_to_result(hit, content))
+        
+        return results
+    
+    def _cascade_satisfied(self, response: Dict, limit: int) -> bool:
+        """判断分层搜索第一层结果是否足够 (命中数和最高分均达到阈值)"""
+        hits = response["hits"]["hits"]
+        if len(hits) < min(self.cascade_min_hits, limit):
+            return False
+        return bool(hits) and hits[0]["_score"] >= self.cascade_min_score
+    
+    def _candidate_vectors(self, hits: List[Dict]) -> Tuple[np.ndarray, np.ndarray]:
+        """候选题目的向量 (优先从本地向量索引按行读取，否则使用_source中的embedding)
+        
+        返回 (向量矩阵, 是否有向量的掩码)
+        """
+        if self.vector_index is not None:
+            rows = [self.vector_index.id_to_row.get(hit["_id"]) for hit in hits]
+            available = np.array([row is not None for row in rows], dtype=bool)
+            vectors = np.zeros((len(hits), self.vector_index.dim), dtype=np.float32)
+            if available.any():
+                # 内存映射上的花式索引只读取候选行
+                vectors[available] = self.vector_index.get_vectors([row for row in rows if row is not None])
+            return vectors, available
+        
+        embeddings = [hit["_source"].get("embedding") for hit in hits]
+        available = np.array([embedding is not None for embedding in embeddings], dtype=bool)
+        dim = next((len(e) for e in embeddings if e is not None), 0)
+        vectors = np.zeros((len(hits), dim), dtype=np.float32)
+        for i, embedding in enumerate(embeddings):
+            if embedding is not None:
+                vectors[i] = embedding
+        return vectors, available
+    
+    def _rerank_hits(
+        self,
+        hits: List[Dict],
+        query_tokens: List[str],
+        query_embedding: Optional[np.ndarray],
+        limit: int
+    ) -> List[Dict]:
+        """第二阶段：按 词法分 + 向量余弦 + 公式token重合度 重排候选 (在 math_analysis 线程池中运行)
+        
+        权重与完整查询一致：向量 (cos+1)*3.5，公式token 5.0
+        """
+        with track_stage("rerank"):
+            scores = np.array([hit["_score"] or 0.0 for hit in hits], dtype=np.float32)
             
-            # 添加过滤条件
-            if filters:
-                filter_clauses = []
-                for field, value in filters.items():
-                    filter_clauses.append({"term": {field: value}})
-                
-                if filter_clauses:
-                    search_body["query"]["bool"]["filter"] = filter_clauses
+            if query_embedding is not None:
+                vectors, available = self._candidate_vectors(hits)
+                if available.any():
+                    query = np.asarray(query_embedding, dtype=np.float32)
+                    query = query / (np.linalg.norm(query) or 1.0)
+                    norms = np.linalg.norm(vectors, axis=1)
+                    norms[norms == 0] = 1.0
+                    cosine = (vectors @ query) / norms
+                    scores += np.where(available, (cosine + 1.0) * 3.5, 0.0)
             
-            # 执行搜索
-            response = self.es.search(
-                index=self.index_name,
-                body=search_body
+            unique_query_tokens = list(set(query_tokens))
+            if unique_query_tokens:
+                # 展开所有候选的去重token，一次isin + bincount得到每个候选的重合数
+                doc_tokens = [set(hit["_source"].get("formula_tokens") or []) for hit in hits]
+                flat = np.array([t for tokens in doc_tokens for t in tokens], dtype=object)
+                owners = np.repeat(np.arange(len(hits)), [len(tokens) for tokens in doc_tokens])
+                if len(flat):
+                    matched = np.isin(flat, unique_query_tokens).astype(np.float32)
+                    overlap = np.bincount(owners, weights=matched, minlength=len(hits))
+                    scores += 5.0 * overlap / len(unique_query_tokens)
+            
+            order = np.argsort(-scores, kind="stable")[:limit]
+            return [{**hits[i], "_score": float(scores[i])} for i in order]
+    
+    async def _search_rerank(
+        self,
+        query: str,
+        analysis: Dict[str, Any],
+        clauses: Dict[str, List[Dict]],
+        limit: int,
+        filters: Optional[Dict],
+        timeout_ms: Optional[float],
+        fields: Optional[List[str]],
+        start_time: float
+    ) -> List[Dict]:
+        """两阶段搜索：ES只执行精确/token子句取top-N，语义评分只在N个候选上计算"""
+        candidates = max(self.rerank_candidates, limit)
+        search_body = self._build_text_search_body(
+            clauses["exact"] + clauses["token"], candidates, filters, timeout_ms, fields, clauses["topic"]
+        )
+        
+        # 重排需要公式token，没有本地向量索引时还需要候选的embedding
+        needed = ["formula_tokens"] if self.vector_index is not None else ["formula_tokens", "embedding"]
+        search_body["_source"] = {
+            "includes": search_body["_source"]["includes"] + needed,
+            "excludes": [f for f in search_body["_source"]["excludes"] if f not in needed]
+        }
+        
+        response = await self._execute_text_search(query, search_body, start_time)
+        hits = response["hits"]["hits"]
+        if not hits:
+            return []
+        
+        query_embedding = None
+        if self.embedding_service:
+            query_embedding = await self.embedding_service.encode(query)
+        
+        return await get_executor("math_analysis").run(
+            self._rerank_hits, hits, analysis["formula_tokens"], query_embedding, limit
+        )
+    
+    async def _measure_rerank_recall(self, query: str, limit: int, filters: Optional[Dict], rerank_ids: List[str]):
+        """后台执行完整查询，记录两阶段结果的召回率"""
+        try:
+            full_results = await self._search_by_text(query, limit, filters, mode="full")
+            recall = self.compute_recall(rerank_ids, [r.id for r in full_results])
+            if recall is not None:
+                RERANK_RECALL.observe(recall)
+                if recall < 1.0:
+                    self.logger.info(f"两阶段搜索召回率 {recall:.2f}: {query[:50]}")
+        except Exception as e:
+            self.logger.warning(f"召回率统计失败: {e}")
+    
+    @staticmethod
+    def compute_recall(candidate_ids: List[str], reference_ids: List[str]) -> Optional[float]:
+        """reference中被candidate覆盖的比例 (reference为空时返回None)"""
+        if not reference_ids:
+            return None
+        return len(set(candidate_ids) & set(reference_ids)) / len(reference_ids)
+    
+    async def search_by_text(
+        self, 
+        query: str, 
+        limit: int = 10,
+        filters: Optional[Dict] = None,
+        mode: Optional[str] = None,
+        timeout_ms: Optional[float] = None,
+        fields: Optional[List[str]] = None
+    ) -> List[SearchResult]:
+        """文本搜索 - 相同参数的并发查询合并为一次执行 (参数说明见 _search_by_text)
+
+        有截止时间的搜索可能返回部分结果，只与截止时间相近的搜索合并
+        """
+        deadline_bucket = None if timeout_ms is None else int(timeout_ms // DEADLINE_BUCKET_MS)
+        key = make_key(query, limit, filters, mode or self.search_mode, fields, deadline_bucket)
+        try:
+            # 共享计算中的异常传给每个等待方，由各自处理 (不共享降级后的空结果)
+            results = await self.search_flight.do(
+                key,
+                lambda: self._execute_text_search_tiers(query, limit, filters, mode, timeout_ms, fields)
+            )
+        except Exception as e:
+            return await self._handle_text_search_error(e, query, limit, filters, mode, fields)
+        # 结果对象可能被调用方修改 (如替换置信度)，每个请求使用独立副本
+        return [copy.copy(result) for result in results]
+    
+    async def _search_by_text(
+        self, 
+        query: str, 
+        limit: int = 10,
+        filters: Optional[Dict] = None,
+        mode: Optional[str] = None,
+        timeout_ms: Optional[float] = None,
+        fields: Optional[List[str]] = None
+    ) -> List[SearchResult]:
+        """文本搜索 - 支持数学公式增强
+        
+        mode:
+          - full:    一次性发送全部子句 (精确 + 模糊 + 向量)
+          - cascade: 先执行精确/短语/token子句，命中不足或最高分过低时才升级到模糊和向量子句
+          - rerank:  精确/token子句取top-N候选，再在本地按向量余弦和公式token重合度重排
+          - ocr:     精确 + token + 字符trigram + 向量，不做fuzzy扩展 (OCR错字容错)
+        timeout_ms: 本次搜索的时间预算，每个ES请求使用剩余预算作为 timeout
+        fields: 只返回这些SearchResult字段 (其余字段不从ES取回)，默认全部
+        """
+        try:
+            return await self._execute_text_search_tiers(query, limit, filters, mode, timeout_ms, fields)
+        except Exception as e:
+            return await self._handle_text_search_error(e, query, limit, filters, mode, fields)
+    
+    async def _execute_text_search_tiers(
+        self,
+        query: str,
+        limit: int,
+        filters: Optional[Dict],
+        mode: Optional[str],
+        timeout_ms: Optional[float],
+        fields: Optional[List[str]]
+    ) -> List[SearchResult]:
+        """按搜索模式执行文本搜索，错误直接抛出"""
+        start_time = time.perf_counter()
+        mode = mode or self.search_mode
+        
+        def remaining_ms() -> Optional[float]:
+            if timeout_ms is None:
+                return None
+            return timeout_ms - (time.perf_counter() - start_time) * 1000
+        
+        # 使用数学公式处理器增强查询 (在专用线程池中执行)
+        analysis = await get_executor("math_analysis").run(self._analyze_query, query)
+        clauses = self._build_text_clauses(query, analysis)
+        
+        # 两阶段搜索：词法召回 + 本地重排
+        if mode == "rerank":
+            ranked_hits = await self._search_rerank(
+                query, analysis, clauses, limit, filters, remaining_ms(), fields, start_time
             )
+            SEARCH_TIER.labels(tier="rerank").inc()
+            record_search_tier("rerank")
+            results = self._parse_text_hits({"hits": {"hits": ranked_hits}})
             
-            # 解析结果
-            results = []
-            for hit in response["hits"]["hits"]:
-                source = hit["_source"]
-                
-                # 获取高亮文本
-                highlight = hit.get("highlight", {})
-                content = highlight.get("content", [source["content"]])[0]
-                
-                result = SearchResult(
-                    id=source["question_id"],
-                    title=source["title"],
-                    content=content,
-                    year=source["year"],
-                    season=source["season"],
-                    paper_code=source["paper_code"],
-                    mark_scheme=source.get("mark_scheme"),
-                    confidence=hit["_score"] / 10.0,  # 归一化分数
-                    file_path=source.get("file_path")
+            if self.rerank_recall_sample_rate > 0 and random.random() < self.rerank_recall_sample_rate:
+                # 在独立上下文中执行，不计入当前请求的耗时和搜索层级
+                task = contextvars.Context().run(
+                    asyncio.create_task,
+                    self._measure_rerank_recall(query, limit, filters, [r.id for r in results])
                 )
-                results.append(result)
-            
+                self._background_tasks.add(task)
+                task.add_done_callback(self._background_tasks.discard)
             return results
+        
+        # 分层搜索第一层：只执行低开销的精确子句
+        if mode == "cascade":
+            search_body = self._build_text_search_body(
+                clauses["exact"] + clauses["token"], limit, filters, remaining_ms(), fields, clauses["topic"]
+            )
+            response = await self._execute_text_search(query, search_body, start_time)
             
+            # 时间预算已用完时不再升级，返回第一层结果
+            budget_left = remaining_ms()
+            exhausted = budget_left is not None and budget_left <= 0
+            if exhausted:
+                mark_partial()
+            if exhausted or self._cascade_satisfied(response, limit):
+                SEARCH_TIER.labels(tier="exact").inc()
+                record_search_tier("exact")
+                return self._parse_text_hits(response)
+        
+        # 完整查询：精确 + 模糊 (ocr模式为token + 字符trigram) + 向量语义
+        if mode == "ocr":
+            should = clauses["exact"] + clauses["token"] + clauses["trigram"]
+            tier = "ocr"
+        else:
+            should = clauses["exact"] + clauses["fuzzy"]
+            tier = "full"
+        if self.embedding_service:
+            vector_clause = await self._vector_clause(query)
+            if vector_clause is not None:
+                should.append(vector_clause)
+        
+        search_body = self._build_text_search_body(
+            should, limit, filters, remaining_ms(), fields, clauses["topic"]
+        )
+        response = await self._execute_text_search(query, search_body, start_time)
+        SEARCH_TIER.labels(tier=tier).inc()
+        record_search_tier(tier)
+        
+        return self._parse_text_hits(response)
+    
+    async def _handle_text_search_error(
+        self,
+        error: Exception,
+        query: str,
+        limit: int,
+        filters: Optional[Dict],
+        mode: Optional[str],
+        fields: Optional[List[str]]
+    ) -> List[SearchResult]:
+        """文本搜索失败: 执行器饱和时继续抛出，ES不可用时使用降级搜索，其他错误返回空结果"""
+        if isinstance(error, ExecutorSaturatedError):
+            raise error
+        if self.fallback is not None and self._is_es_degraded(error):
+            self.logger.warning(f"⚠️  ES不可用，使用降级搜索: {error}")
+            return await self.fallback.search_by_text(query, limit, filters, mode=mode, fields=fields)
+        self.logger.error(f"文本搜索失败: {error}")
+        return []
+    
+    @staticmethod
+    def _is_es_degraded(error: Exception) -> bool:
+        """连接失败、超时或ES服务端错误 (5xx / 429)"""
+        if isinstance(error, TransportError):
+            return True
+        return isinstance(error, ApiError) and (error.meta.status >= 500 or error.meta.status == 429)
+    
+    async def _capture_slow_query(self, query: str, search_body: Dict, duration_ms: float, took_ms: int):
+        """以 profile 模式重跑慢查询，记录各子句耗时"""
+        try:
+            response = await self.async_es.search(
+                index=self.index_name,
+                body={**search_body, "profile": True}
+            )
+            profile = summarize_es_profile(response.get("profile", {}))
         except Exception as e:
-            self.logger.error(f"文本搜索失败: {e}")
+            self.logger.warning(f"慢查询profile失败: {e}")
+            profile = {}
+        
+        self.slow_query_log.add(query, duration_ms, took_ms, profile)
+        self.logger.warning(f"🐢 慢查询 {duration_ms:.0f}ms (ES took {took_ms}ms): {query[:50]}")
+
+    async def search_by_fingerprints(
+        self,
+        fingerprints: List[str],
+        limit: int = 5,
+        timeout_ms: Optional[float] = None
+    ) -> List[SearchResult]:
+        """只按公式指纹查找 (拍照搜题的公式直达层)，候选集只有包含相同公式片段的题目"""
+        if not fingerprints:
             return []
-    
+
+        start_time = time.perf_counter()
+        try:
+            search_body = self._build_text_search_body(
+                [self._build_fingerprint_clause(fingerprints, boost=1.0)], limit, None, timeout_ms
+            )
+            search_body.pop("highlight", None)
+            response = await self._execute_text_search(" ".join(fingerprints), search_body, start_time)
+            SEARCH_TIER.labels(tier="fingerprint").inc()
+            record_search_tier("fingerprint")
+            return self._parse_text_hits(response)
+
+        except Exception as e:
+            if self.fallback is not None and self._is_es_degraded(e):
+                self.logger.warning(f"⚠️  ES不可用，使用降级指纹搜索: {e}")
+                return await self.fallback.search_by_fingerprints(fingerprints, limit)
+            self.logger.error(f"公式指纹搜索失败: {e}")
+            return []
+
     async def search_by_image_similarity(
         self, 
         image_embedding: List[float], 
@@ -401,46 +1064,67 @@ class SearchService:
     ) -> List[SearchResult]:
         """基于图像向量的相似度搜索"""
         try:
+            if self.vector_index is not None:
+                return await self._search_similar_by_index(image_embedding, limit)
+            
             search_body = {
                 "query": {
                     "script_score": {
                         "query": {"match_all": {}},
                         "script": {
                             "source": "cosineSimilarity(params.query_vector, 'embedding') + 1.0",
-                            "params": {"query_vector": image_embedding}
+                            "params": {"query_vector": self._to_index_vector(image_embedding)}
                         }
                     }
                 },
-                "size": limit
+                "size": limit,
+                "_source": self._source_filter()
             }
             
-            response = self.es.search(
-                index=self.index_name,
-                body=search_body
-            )
-            
-            results = []
-            for hit in response["hits"]["hits"]:
-                source = hit["_source"]
-                result = SearchResult(
-                    id=source["question_id"],
-                    title=source["title"],
-                    content=source["content"],
-                    year=source["year"],
-                    season=source["season"],
-                    paper_code=source["paper_code"],
-                    mark_scheme=source.get("mark_scheme"),
-                    confidence=hit["_score"] / 10.0,
-                    file_path=source.get("file_path")
+            with track_es_request("vector_search"):
+                response = await self.async_es.search(
+                    index=self.index_name,
+                    body=search_body
                 )
-                results.append(result)
+            record_es_response(response)
             
-            return results
+            return [self._hit_to_result(hit) for hit in response["hits"]["hits"]]
             
         except Exception as e:
+            if self.fallback is not None and self._is_es_degraded(e):
+                self.logger.warning(f"⚠️  ES不可用，使用降级向量搜索: {e}")
+                return await self.fallback.search_by_image_similarity(image_embedding, limit)
             self.logger.error(f"向量搜索失败: {e}")
             return []
     
+    async def _search_similar_by_index(self, image_embedding: List[float], limit: int) -> List[SearchResult]:
+        """本地向量索引检索，再按ID从ES取回题目内容"""
+        neighbours = await get_executor("math_analysis").run(
+            self._search_vector_index, np.asarray(image_embedding, dtype=np.float32), limit
+        )
+        if not neighbours:
+            return []
+        
+        search_body = {
+            "query": {"ids": {"values": [doc_id for doc_id, _ in neighbours]}},
+            "size": len(neighbours),
+            "_source": self._source_filter()
+        }
+        with track_es_request("vector_fetch"):
+            response = await self.async_es.search(
+                index=self.index_name,
+                body=search_body
+            )
+        record_es_response(response)
+        
+        # 按相似度排序，分数与script_score (cos+1) 一致
+        hits = {hit["_id"]: hit for hit in response["hits"]["hits"]}
+        results = []
+        for doc_id, score in neighbours:
+            if doc_id in hits:
+                results.append(self._hit_to_result({**hits[doc_id], "_score": score + 1.0}))
+        return results
+    
     async def get_index_stats(self) -> IndexStats:
         """获取索引统计信息"""
         try:
@@ -456,7 +1140,12 @@ class SearchService:
             self.logger.error(f"获取统计信息失败: {e}")
             return IndexStats(total_documents=0, index_size="0 MB")
     
+    async def ping(self) -> bool:
+        """检查ES是否可用"""
+        return await self.async_es.ping()
+    
     async def close(self):
         """关闭连接"""
+        await self.search_flight.close()
         await self.async_es.close()
         self.es.close()
\ No newline at end of file
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+相同请求合并 (single-flight)
+同一时刻的相同查询/相同图片只执行一次计算，后到的请求等待并共享结果
+- 进程内: 按key合并正在执行的协程
+- 跨worker (可选): 设置 SINGLEFLIGHT_REDIS_URL 后通过Redis锁选出一个worker计算，
+  其他worker轮询读取其写入Redis的结果
+共享计算在独立的耗时记录中执行，阶段耗时、ES took、搜索层级和部分结果标记回放到每个等待方；
+计算抛出的异常同样传给每个等待方
+"""
+
+import os
+import json
+import asyncio
+import uuid
+import hashlib
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from metrics import CACHE_HITS
+from responses import dumps
+from request_timing import isolated_recording, replay_recording
+
+logger = logging.getLogger(__name__)
+
+# 只删除自己持有的锁 (锁过期后可能已被其他worker重新获取)
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def make_key(*parts: Any) -> str:
+    """由请求参数生成合并key"""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """相同key的并发调用只执行一次"""
+
+    def __init__(
+        self,
+        name: str,
+        decode: Callable[[Any], Any] = None,
+        redis_url: str = None
+    ):
+        """
+        name: 合并组名称 (用于指标和Redis key前缀)
+        decode: 跨worker共享时将Redis中的JSON结果还原为调用方需要的对象
+        """
+        self.name = name
+        self.decode = decode or (lambda data: data)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+
+        self.lock_ttl_ms = int(os.getenv("SINGLEFLIGHT_LOCK_TTL_MS", "5000"))
+        self.result_ttl_ms = int(os.getenv("SINGLEFLIGHT_RESULT_TTL_MS", "2000"))
+        self.wait_ms = int(os.getenv("SINGLEFLIGHT_WAIT_MS", "3000"))
+        self.poll_ms = int(os.getenv("SINGLEFLIGHT_POLL_MS", "20"))
+
+        self.redis = None
+        redis_url = redis_url if redis_url is not None else os.getenv("SINGLEFLIGHT_REDIS_URL", "")
+        if redis_url:
+            try:
+                import redis.asyncio as aioredis
+                self.redis = aioredis.from_url(redis_url)
+            except Exception as e:
+                logger.warning(f"⚠️  跨worker请求合并不可用: {e}")
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """执行 fn() 或加入相同key正在执行的调用，返回共享结果"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run(key, fn))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            CACHE_HITS.labels(cache=f"singleflight_{self.name}").inc()
+
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            # shield: 单个等待方被取消时不影响其他等待方
+            result, recording = await asyncio.shield(task)
+            replay_recording(recording)
+            return result
+        except asyncio.CancelledError:
+            # 所有等待方都已取消时，取消计算本身
+            if self._waiters.get(key, 0) <= 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if self._waiters[key] <= 0:
+                self._waiters.pop(key, None)
+
+    async def _run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, Dict[str, Any]]:
+        """执行共享计算，返回 (结果, 耗时记录)"""
+        with isolated_recording() as recording:
+            if self.redis is None:
+                return await fn(), recording
+            result, shared_recording = await self._run_with_redis(key, fn, recording)
+            return result, shared_recording or recording
+
+    async def _run_with_redis(
+        self, key: str, fn: Callable[[], Awaitable[Any]], recording: Dict[str, Any]
+    ) -> Tuple[Any, Optional[Dict[str, Any]]]:
+        """跨worker合并，其他worker的结果附带其耗时记录"""
+
+        lock_key = f"singleflight:{self.name}:{key}:lock"
+        result_key = f"singleflight:{self.name}:{key}:result"
+
+        token = uuid.uuid4().hex
+        try:
+            acquired = await self.redis.set(lock_key, token, nx=True, px=self.lock_ttl_ms)
+        except Exception as e:
+            logger.warning(f"Redis合并锁失败，本地执行: {e}")
+            return await fn(), None
+
+        if acquired:
+            try:
+                result = await fn()
+                await self._publish(result_key, result, recording)
+                return result, None
+            finally:
+                try:
+                    await self.redis.eval(_RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+                except Exception:
+                    pass
+
+        # 其他worker正在计算：等待其结果，超时或锁释放后仍无结果时本地执行
+        shared = await self._wait_for_result(lock_key, result_key)
+        if shared is not None:
+            CACHE_HITS.labels(cache=f"singleflight_{self.name}_redis").inc()
+            return self.decode(shared["value"]), shared.get("recording")
+        return await fn(), None
+
+    async def _publish(self, result_key: str, result: Any, recording: Dict[str, Any]):
+        """将结果和耗时记录写入Redis供其他worker读取"""
+        try:
+            payload = {"value": result, "recording": recording}
+            await self.redis.set(result_key, dumps(payload), px=self.result_ttl_ms)
+        except Exception as e:
+            logger.warning(f"写入合并结果失败: {e}")
+
+    async def _wait_for_result(self, lock_key: str, result_key: str) -> Optional[Any]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_ms / 1000
+        try:
+            while loop.time() < deadline:
+                data = await self.redis.get(result_key)
+                if data is not None:
+                    return json.loads(data)
+                if not await self.redis.exists(lock_key):
+                    # 锁已释放但没有结果 (计算失败或结果已过期)
+                    data = await self.redis.get(result_key)
+                    return json.loads(data) if data is not None else None
+                await asyncio.sleep(self.poll_ms / 1000)
+        except Exception as e:
+            logger.warning(f"读取合并结果失败: {e}")
+        return None
+
+    def inflight_count(self) -> int:
+        return len(self._inflight)
+
+    async def close(self):
+        if self.redis is not None:
+            await self.redis.close()
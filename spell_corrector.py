@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+OCR拼写纠正
+基于题库词表的对称删除 (SymSpell) 纠错和粘连词切分:
+- 词典中每个词预先生成编辑距离内的所有删除变体，查询时只需生成查询词的删除变体并查表，
+  每个词的查找开销与词典大小无关
+- 粘连词 (Findtheequation、ofthecurve) 用动态规划切分为词典中的词，相邻两个词须在题库中分开出现过
+
+题库文本本身也含有粘连词，建词典时剔除能切分为在题库中分开出现过的词序列的词 (ofthe → of the)
+题库只覆盖很少的英语词汇，纠错偏保守: 词典中的词及其其他形式 (estimate / estimates) 原样保留，
+按编辑距离纠错只接受OCR常见错误 (漏字、rn/m、c/e 混淆) 能解释的结果
+"""
+
+import os
+import re
+import json
+import math
+import logging
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CORPUS_FILE = "caie_math_questions.json"
+
+_WORD_PATTERN = re.compile(r"[A-Za-z]+")
+
+# 最长词长度 (切分时的窗口)
+MAX_WORD_LENGTH = 20
+
+# 切分粘连词时允许的少于3个字母的词 (其他短串多是PDF断词碎片: th、fo、re、ed)
+COMMON_WORDS = {
+    "a", "an", "as", "at", "be", "by", "if", "in", "is", "it", "no", "of", "on", "or", "to"
+}
+
+# 词形变化后缀 (由长到短): 去掉后缀后词干相同的词视为同一个词的不同形式 (estimate / estimates、
+# integral / integrate)，词典中有其中一种形式时其他形式也视为正确拼写，不会被改成词典中的形式
+INFLECTION_SUFFIXES = (
+    "ations", "ation", "ities", "ity", "ions", "ion", "ating", "ated", "ates", "ate",
+    "ing", "ally", "ial", "al", "ly", "ers", "er", "es", "ed", "s", "d", "e"
+)
+# 词干最短长度 (避免 as → a 之类过短的词干)
+MIN_STEM_LENGTH = 4
+
+# OCR常见的字符混淆 (识别结果, 原字符)，纠错只接受这些替换和漏识别一个字母
+OCR_CONFUSIONS = (("m", "rn"), ("rn", "m"), ("c", "e"), ("e", "c"), ("l", "i"), ("i", "l"), ("d", "cl"), ("h", "li"), ("w", "vv"))
+
+# 按编辑距离纠错的目标词在题库中的最少出现次数: 题库只是英语词汇的一小部分，
+# 只出现过一两次的词 (rage) 离不在题库中的正确拼写 (range) 往往只差一个字母
+MIN_CORRECTION_COUNT = 3
+
+
+def normalize_text(text: str) -> str:
+    """NFKC规范化 (PDF中的 ﬁ、ﬂ 等连字拆为普通字母)"""
+    return unicodedata.normalize("NFKC", text) if text else ""
+
+
+def word_stems(word: str) -> Set[str]:
+    """word本身及去掉各个词形变化后缀后的词干"""
+    stems = {word}
+    for suffix in INFLECTION_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM_LENGTH:
+            stems.add(word[:-len(suffix)])
+    return stems
+
+
+def damerau_distance(a: str, b: str, max_distance: int) -> int:
+    """受限Damerau-Levenshtein距离 (相邻交换计为1)，超过 max_distance 时返回 max_distance + 1"""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return min(previous[-1], max_distance + 1)
+
+
+class SpellCorrector:
+    def __init__(
+        self,
+        word_counts: Dict[str, int],
+        max_edit_distance: int = 2,
+        protected: Iterable[str] = (),
+        bigram_counts: Optional[Dict[Tuple[str, str], int]] = None
+    ):
+        """初始化纠错器
+
+        word_counts: 词 -> 频次 (小写)
+        protected: 视为正确拼写、不会被当作粘连词剔除的词 (如数学术语)
+        bigram_counts: (词, 下一个词) -> 频次，切分粘连词时相邻两个词必须在语料中分开出现过；
+            为None时不剔除题库中的粘连词，切分也不检查相邻的词
+        """
+        self.logger = logging.getLogger(__name__)
+        self.max_edit_distance = max_edit_distance
+        self.bigrams = bigram_counts
+
+        self.words = self._prune_merged_words(word_counts, set(protected), bigram_counts)
+        self.total = sum(self.words.values())
+
+        # 词典中所有词的词干 (判断不在词典中的词是否是词典中某个词的其他形式)
+        self.stems = {stem for word in self.words for stem in word_stems(word)}
+
+        # 删除变体 -> 原词列表
+        self.deletes: Dict[str, List[str]] = {}
+        for word in self.words:
+            for variant in self._delete_variants(word, max_edit_distance):
+                self.deletes.setdefault(variant, []).append(word)
+
+    @classmethod
+    def from_texts(cls, texts: Iterable[str], min_count: int = 1, **kwargs) -> "SpellCorrector":
+        """从语料建立词典和相邻词统计 (出现次数少于 min_count 的词视为噪声)"""
+        counts, bigrams = Counter(), Counter()
+        for text in texts:
+            words = [word.lower() for word in _WORD_PATTERN.findall(normalize_text(text))]
+            counts.update(words)
+            bigrams.update(zip(words, words[1:]))
+        return cls({word: n for word, n in counts.items() if n >= min_count}, bigram_counts=bigrams, **kwargs)
+
+    @staticmethod
+    def _delete_variants(word: str, max_distance: int) -> Set[str]:
+        """word及其删除至多 max_distance 个字符的所有变体"""
+        variants = {word}
+        frontier = {word}
+        for _ in range(max_distance):
+            frontier = {
+                candidate[:i] + candidate[i + 1:]
+                for candidate in frontier if len(candidate) > 1
+                for i in range(len(candidate))
+            }
+            variants |= frontier
+        return variants
+
+    @staticmethod
+    def _is_segment_part(part: str) -> bool:
+        """切分结果中允许的词: 至少3个字母的词或常用短词 (th、fo、re 等PDF断词碎片不算)"""
+        return len(part) >= 3 or part in COMMON_WORDS
+
+    @staticmethod
+    def _prune_merged_words(
+        word_counts: Dict[str, int],
+        protected: Set[str],
+        bigram_counts: Optional[Dict[Tuple[str, str], int]]
+    ) -> Dict[str, int]:
+        """剔除题库中的粘连词 (findthe、ofthecurve): 能切分为词典中的词，且相邻的每两个词在题库中分开出现的
+        次数不少于该词 (find the、the curve)；是词典中另一个词的其他形式的词 (areas、becomes) 不剔除，
+        PDF断词 (com pany) 比完整的词 (company) 少见，也不会被剔除"""
+        merged = set()
+        if bigram_counts:
+            stems = Counter(stem for word in word_counts for stem in word_stems(word))
+            # 由短到长处理，切分时只使用已确认不是粘连词的部分 (solvetheequation 不会切成 solve + theequation)
+            for word in sorted(word_counts, key=len):
+                count = word_counts[word]
+                if len(word) < 5 or word in protected:
+                    continue
+                # 词干被其他词共用: 同一个词的不同形式，不是粘连词
+                if any(stems[stem] > 1 for stem in word_stems(word) - {word}):
+                    continue
+
+                parts = SpellCorrector._split(
+                    word,
+                    lambda part: (
+                        part != word and part in word_counts and part not in merged
+                        and SpellCorrector._is_segment_part(part)
+                    ),
+                    lambda part: 0.0,
+                    lambda previous, part: bigram_counts.get((previous, part), 0) >= count
+                )
+                if parts:
+                    merged.add(word)
+
+        words = {word: count for word, count in word_counts.items() if word not in merged}
+        # 受保护的词 (数学术语) 即使不在题库中也视为正确拼写
+        for word in protected:
+            words.setdefault(word, 1)
+        return words
+
+    @staticmethod
+    def _split(text: str, is_word, word_score, is_pair=None) -> Optional[List[str]]:
+        """动态规划切分: 词数最少，其次 word_score 之和最大；is_pair 限定相邻两个词的组合；
+        无法完整切分时返回None"""
+        # best[end]: 最后一个词 -> (词数, 得分, 切分)
+        best = [{} for _ in range(len(text) + 1)]
+        best[0][None] = (0, 0.0, [])
+        for end in range(1, len(text) + 1):
+            for start in range(max(0, end - MAX_WORD_LENGTH), end):
+                if not best[start]:
+                    continue
+                part = text[start:end]
+                if not is_word(part):
+                    continue
+                for previous, (count, score, parts) in best[start].items():
+                    if previous is not None and is_pair is not None and not is_pair(previous, part):
+                        continue
+                    candidate = (count + 1, score + word_score(part), parts + [part])
+                    current = best[end].get(part)
+                    if current is None or (candidate[0], -candidate[1]) < (current[0], -current[1]):
+                        best[end][part] = candidate
+        if not best[-1]:
+            return None
+        return min(best[-1].values(), key=lambda candidate: (candidate[0], -candidate[1]))[2]
+
+    def _log_probability(self, word: str) -> float:
+        return math.log(self.words[word] / self.total)
+
+    def _is_segment_word(self, part: str) -> bool:
+        return part in self.words and self._is_segment_part(part)
+
+    def _is_bigram(self, previous: str, part: str) -> bool:
+        return self.bigrams is None or (previous, part) in self.bigrams
+
+    def is_plausible(self, word: str) -> bool:
+        """word是词典中的词，或是词典中某个词的其他形式 (词干相同)"""
+        return word in self.words or not word_stems(word).isdisjoint(self.stems)
+
+    def segment(self, token: str) -> Optional[List[str]]:
+        """将粘连词切分为词典中的词 (至少两个词)，无法切分时返回None"""
+        parts = self._split(token, self._is_segment_word, self._log_probability, self._is_bigram)
+        return parts if parts and len(parts) > 1 else None
+
+    @staticmethod
+    def is_ocr_error(token: str, word: str) -> bool:
+        """token能否由word经一次OCR常见错误得到: 漏识别一个字母，或一处字符混淆 (rn → m、e → c)"""
+        if len(token) + 1 == len(word) and any(word[:i] + word[i + 1:] == token for i in range(len(word))):
+            return True
+        for seen, actual in OCR_CONFUSIONS:
+            start = token.find(seen)
+            while start != -1:
+                if token[:start] + actual + token[start + len(seen):] == word:
+                    return True
+                start = token.find(seen, start + 1)
+        return False
+
+    def lookup(self, token: str, max_distance: Optional[int] = None, min_count: int = 1, accept=None) -> Optional[str]:
+        """编辑距离内最接近的词 (距离相同时取频次高的)，token已在词典中时原样返回
+
+        频次低于 min_count 的词和 accept(token, word) 为假的词不考虑
+        """
+        if token in self.words:
+            return token
+
+        max_distance = self.max_edit_distance if max_distance is None else max_distance
+        best, best_key = None, None
+        for variant in self._delete_variants(token, max_distance):
+            for word in self.deletes.get(variant, ()):
+                if self.words[word] < min_count or (accept is not None and not accept(token, word)):
+                    continue
+                distance = damerau_distance(token, word, max_distance)
+                if distance > max_distance:
+                    continue
+                key = (distance, -self.words[word])
+                if best_key is None or key < best_key:
+                    best, best_key = word, key
+        return best
+
+    def correct_word(self, token: str) -> str:
+        """纠正单个字母串: 先尝试切分粘连词，再按编辑距离纠错
+
+        以下情况原样保留: 短词 (多为变量)、首字母之后含大写字母的串 (ABCD、OABC 等点和线段的标签)、
+        词典中的词及其其他形式 (estimate 不会被改成 estimates)
+        """
+        lower = token.lower()
+        if len(lower) < 4 or any(ch.isupper() for ch in token[1:]) or self.is_plausible(lower):
+            return token
+
+        corrected = None
+        parts = self.segment(lower)
+        if parts:
+            corrected = " ".join(parts)
+        elif len(lower) >= 5:
+            # 短词只允许1处编辑，避免把变量名改成常用词；不在题库中的正确拼写 (abort、print)
+            # 离题库中的词 (about、point) 往往只差一两个字母，只接受OCR常见错误能解释的纠正
+            corrected = self.lookup(
+                lower, 1 if len(lower) < 8 else self.max_edit_distance, MIN_CORRECTION_COUNT, self.is_ocr_error
+            )
+
+        if not corrected:
+            return token
+        return corrected[0].upper() + corrected[1:] if token[0].isupper() else corrected
+
+    def correct_text(self, text: str) -> str:
+        """纠正文本中的所有字母串，数字、符号和公式保持不变"""
+        return _WORD_PATTERN.sub(lambda match: self.correct_word(match.group()), normalize_text(text))
+
+
+def load_spell_corrector(corpus_path: str = None, protected: Iterable[str] = ()) -> Optional[SpellCorrector]:
+    """按题库建立纠错器 (SPELL_CORRECTION_ENABLED=false 或题库不存在时返回None)"""
+    if os.getenv("SPELL_CORRECTION_ENABLED", "true").lower() != "true":
+        return None
+
+    corpus_path = corpus_path or os.getenv("SPELL_CORPUS_PATH") or os.getenv("LOCAL_CORPUS_PATH", DEFAULT_CORPUS_FILE)
+    if not os.path.exists(corpus_path):
+        logger.warning(f"⚠️  拼写纠正词库不存在: {corpus_path}")
+        return None
+
+    try:
+        with open(corpus_path, "r", encoding="utf-8") as f:
+            questions = json.load(f)
+        corrector = SpellCorrector.from_texts(
+            (q.get("content", "") for q in questions),
+            min_count=int(os.getenv("SPELL_MIN_COUNT", "1")),
+            max_edit_distance=int(os.getenv("SPELL_MAX_EDIT_DISTANCE", "2")),
+            protected=protected
+        )
+        logger.info(f"✅ 拼写纠正词典已建立: {len(corrector.words)} 个词, {len(corrector.deletes)} 个删除变体")
+        return corrector
+    except Exception as e:
+        logger.warning(f"⚠️  拼写纠正词典建立失败: {e}")
+        return None
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+执行器测试
+运行: python -m pytest test_executors.py
+"""
+
+import time
+import asyncio
+
+import pytest
+
+from executors import BoundedExecutor, ExecutorSaturatedError
+
+
+def test_cancelled_queued_jobs_release_queue_slots():
+    """排队中被取消的任务归还排队名额，之后的提交不会被拒绝"""
+    async def scenario():
+        executor = BoundedExecutor("test", 1, 4)
+        tasks = [asyncio.create_task(executor.run(time.sleep, 0.2)) for _ in range(4)]
+        await asyncio.sleep(0.05)
+
+        # 第一个任务在执行，其余3个在排队
+        for task in tasks[1:]:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        assert executor.queue_depth == 0
+
+        results = await asyncio.gather(*(executor.run(lambda: "ok") for _ in range(4)))
+        assert results == ["ok"] * 4
+        stats = executor.get_stats()
+        executor.shutdown(wait=True)
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert stats["queue_depth"] == 0
+    assert stats["active"] == 0
+    assert stats["completed"] == 5
+
+
+def test_cancel_while_running_counts_once():
+    """执行中被取消的任务只由工作线程减少排队计数"""
+    async def scenario():
+        executor = BoundedExecutor("test", 1, 2)
+        task = asyncio.create_task(executor.run(time.sleep, 0.1))
+        await asyncio.sleep(0.02)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0.15)
+        stats = executor.get_stats()
+        executor.shutdown(wait=True)
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert stats["queue_depth"] == 0
+    assert stats["active"] == 0
+
+
+def test_saturated_executor_rejects():
+    async def scenario():
+        executor = BoundedExecutor("test", 1, 1)
+        running = asyncio.create_task(executor.run(time.sleep, 0.1))
+        await asyncio.sleep(0.02)
+        queued = asyncio.create_task(executor.run(time.sleep, 0))
+        await asyncio.sleep(0)
+        with pytest.raises(ExecutorSaturatedError):
+            await executor.run(time.sleep, 0)
+        await asyncio.gather(running, queued)
+        executor.shutdown(wait=True)
+
+    asyncio.run(scenario())
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+数学公式处理器测试
+运行: python -m pytest test_math_formula_processor.py
+"""
+
+import pytest
+
+from math_formula_processor import MathFormulaProcessor
+
+
+@pytest.fixture(scope="module")
+def processor():
+    return MathFormulaProcessor()
+
+
+@pytest.mark.parametrize("text, span", [
+    ("y = 2x^2 + 5", "y = 2x^2 + 5"),
+    ("2x^2 + 5", "2x^2 + 5"),
+    ("Find x when 2x + 3 = 7 and hence", "2x + 3 = 7"),
+    ("Given that f(x) = 3x - 1, find", "f(x) = 3x - 1"),
+])
+def test_formula_spans_cross_spaced_operators(processor, text, span):
+    assert processor.formula_spans(text) == [span]
+
+
+def test_formula_spans_do_not_absorb_words(processor):
+    assert processor.formula_spans("x^2 - that is") == ["x^2 -"]
+
+
+@pytest.mark.parametrize("spaced, unspaced", [
+    ("y = 2x^2 + 5", "y=2x^2+5"),
+    ("2x^2 + 5", "2x^2+5"),
+    ("f(x) = 3x - 1", "f(x)=3x-1"),
+])
+def test_spaced_and_unspaced_formulas_match(processor, spaced, unspaced):
+    assert processor.formula_fingerprints(spaced) == processor.formula_fingerprints(unspaced)
+    assert processor.formula_hashes(spaced) == processor.formula_hashes(unspaced)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("2x^2 + 7", "2x^2 + 5"),
+    ("x^2 - 4", "x^2 + 9"),
+])
+def test_different_constants_do_not_collide(processor, a, b):
+    assert processor.formula_fingerprints(a) != processor.formula_fingerprints(b)
+    assert not set(processor.formula_hashes(a)) & set(processor.formula_hashes(b))
+
+
+@pytest.mark.parametrize("a, b", [
+    ("2x^2+5", "5+2x^2"),                # 加法交换律
+    ("x*y", "y*x"),                      # 乘法交换律
+    ("3xy", "3yx"),                      # 隐式乘积
+    ("-x+2", "2-x"),                     # 一元负号
+    ("x-3", "-3+x"),
+    ("x>3", "3<x"),                      # > 转为 <
+    ("y=2x+1", "2x+1=y"),                # 等式两边交换
+    ("sin(x)+cos(x)", "cos(x)+sin(x)"),  # 函数调用作为操作数
+    ("y=2x²+5", "y=2x^2+5"),             # 上标变体
+])
+def test_canonical_form_equivalent(processor, a, b):
+    assert processor.canonical_form(a) is not None
+    assert processor.canonical_form(a) == processor.canonical_form(b)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("x-3", "3-x"),
+    ("2^x", "x^2"),
+    ("x/2", "2/x"),
+    ("sin(x)", "sin(y)"),
+    ("x<3", "x>3"),
+])
+def test_canonical_form_distinguishes(processor, a, b):
+    assert processor.canonical_form(a) != processor.canonical_form(b)
+
+
+def test_canonical_form_functions(processor):
+    assert processor.canonical_form("sin(x)") == "(sin x)"
+    assert processor.canonical_form("cosec(x)") == "(cosec x)"
+
+
+@pytest.mark.parametrize("text", ["1Find", "point/lpar2", "the answer=and", "3xy"])
+def test_formula_hashes_skip_fragments(processor, text):
+    assert processor.formula_hashes(text) == []
+
+
+def test_formula_hashes_read_pdf_glyphs(processor):
+    assert processor.formula_hashes("f/lparx/rpar=x2+3") == processor.formula_hashes("f(x) = x2 + 3")
+
+
+@pytest.mark.parametrize("text, concepts", [
+    ("Water flows into a tank at a constant rate", []),
+    ("The logs were cut into pieces", []),
+    ("the cost of a ticket", []),
+    ("Solve sinx + cosθ = 1", ["trigonometric"]),
+    ("Find tan 30", ["trigonometric"]),
+    ("Given that lnx = 2", ["logarithmic"]),
+])
+def test_function_concepts_need_variable_suffix(processor, text, concepts):
+    found = processor.extract_mathematical_concepts(text)
+    assert [c for c in found if c in ("trigonometric", "logarithmic")] == concepts
+
+
+def test_bracketed_function_argument_ends_at_bracket(processor):
+    assert processor.canonical_form("sin(x)cos(x)") != processor.canonical_form("sin(x cos x)")
+    assert processor.canonical_form("sin(x)cos(x)") == processor.canonical_form("sin x cos x")
+    assert processor.canonical_form("sin 2x") == processor.canonical_form("sin(2x)")
+
+
+def test_function_product_order_does_not_matter(processor):
+    assert processor.formula_hashes("y = sin(x)cos(x)") == processor.formula_hashes("y = cos(x)sin(x)")
+
+
+@pytest.mark.parametrize("formula", [
+    "y=x" + "^x" * 1200 + "+1",   # 嵌套过深
+    "y = " + "9" * 400 + "x + 1",  # 数字超出浮点范围
+])
+def test_pathological_formulas_are_skipped(processor, formula):
+    assert processor.canonical_form(formula) is None
+    assert processor.formula_hashes(formula) == []
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+请求剖析与慢查询日志测试
+运行: python -m pytest test_profiling.py
+"""
+
+import asyncio
+
+from profiling import RequestProfiler, SlowQueryLog
+
+
+def test_slow_query_log_disabled_by_default(monkeypatch):
+    monkeypatch.delenv("SLOW_QUERY_THRESHOLD_MS", raising=False)
+    assert not SlowQueryLog().is_slow(10_000)
+
+
+def test_slow_query_profile_interval(monkeypatch):
+    monkeypatch.setenv("SLOW_QUERY_THRESHOLD_MS", "100")
+    monkeypatch.setenv("SLOW_QUERY_PROFILE_INTERVAL_S", "60")
+    log = SlowQueryLog()
+    assert log.is_slow(200)
+    assert log.acquire_profile_slot()
+    assert not log.acquire_profile_slot()
+
+
+def test_auto_profiling_cooldown(monkeypatch):
+    monkeypatch.setenv("PROFILE_SLOW_THRESHOLD_MS", "100")
+    monkeypatch.setenv("PROFILE_AUTO_SAMPLES", "1")
+    monkeypatch.setenv("PROFILE_AUTO_COOLDOWN_S", "300")
+    profiler = RequestProfiler()
+
+    profiler.observe_latency("/search", 500)
+    assert profiler.should_profile("/search", None)
+    # 冷却时间内再次变慢不会重新开启
+    profiler.observe_latency("/search", 500)
+    assert not profiler.should_profile("/search", None)
+
+
+def test_admin_token(monkeypatch):
+    monkeypatch.setenv("PROFILE_ADMIN_TOKEN", "secret")
+    profiler = RequestProfiler()
+    assert profiler.should_profile("/search", "secret")
+    assert not profiler.should_profile("/search", "wrong")
+    assert not profiler.should_profile("/search", None)
+
+
+def test_profile_files_are_rotated(monkeypatch, tmp_path):
+    monkeypatch.setenv("PROFILE_DIR", str(tmp_path))
+    monkeypatch.setenv("PROFILE_MAX_FILES", "2")
+    profiler = RequestProfiler()
+
+    async def call_next(request):
+        return "ok"
+
+    async def run():
+        for _ in range(4):
+            response, _ = await profiler.profile("/search", call_next, None)
+            assert response == "ok"
+
+    asyncio.run(run())
+    assert len(list(tmp_path.glob("*.prof"))) == 2
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+响应压缩协商测试
+运行: python -m pytest test_responses.py
+"""
+
+import pytest
+
+import responses
+from responses import CompressionMiddleware
+
+
+@pytest.fixture
+def middleware():
+    return CompressionMiddleware(app=None, minimum_size=1)
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip", "gzip"),
+    ("gzip;q=0", None),
+    ("gzip;q=0, deflate", None),
+    ("identity", None),
+    ("*", "gzip"),
+    ("*;q=0", None),
+    ("*;q=0, gzip", "gzip"),
+    ("gzip;q=0, *", None),
+    ("", None),
+])
+def test_gzip_negotiation(monkeypatch, middleware, header, expected):
+    monkeypatch.setattr(responses, "brotli", None)
+    assert middleware._negotiate(header) == expected
+
+
+def test_brotli_preferred_when_available(monkeypatch, middleware):
+    monkeypatch.setattr(responses, "brotli", object())
+    assert middleware._negotiate("gzip, br") == "br"
+    assert middleware._negotiate("*") == "br"
+    assert middleware._negotiate("br;q=0, *") == "gzip"
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+请求合并测试
+运行: python -m pytest test_singleflight.py
+"""
+
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+from request_timing import start_request_timing, collect_search_trace, record_timing, record_search_tier, mark_partial
+
+
+def test_waiters_receive_shared_timings_and_partial_flag():
+    """合并的每个等待方都获得共享计算的阶段耗时、搜索层级和部分结果标记"""
+    flight = SingleFlight("test", redis_url="")
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        record_timing("es_search", 0.01)
+        record_search_tier("exact")
+        mark_partial()
+        return ["result"]
+
+    async def caller():
+        timings = start_request_timing()
+        with collect_search_trace() as trace:
+            result = await flight.do("key", compute)
+        return result, timings.stages, trace
+
+    async def scenario():
+        return await asyncio.gather(caller(), caller())
+
+    outcomes = asyncio.run(scenario())
+    assert len(calls) == 1
+    for result, stages, trace in outcomes:
+        assert result == ["result"]
+        assert stages["es_search"] == pytest.approx(0.01)
+        assert trace["tiers"] == ["exact"]
+        assert trace["partial"] is True
+
+
+def test_errors_propagate_to_every_waiter():
+    flight = SingleFlight("test", redis_url="")
+
+    async def compute():
+        await asyncio.sleep(0.02)
+        raise RuntimeError("boom")
+
+    async def scenario():
+        return await asyncio.gather(
+            flight.do("key", compute), flight.do("key", compute), return_exceptions=True
+        )
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+class FakeRedis:
+    """只实现单飞用到的命令"""
+
+    def __init__(self):
+        self.data = {}
+
+    async def set(self, key, value, nx=False, px=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def exists(self, key):
+        return int(key in self.data)
+
+    async def eval(self, script, numkeys, key, token):
+        if self.data.get(key) == token:
+            del self.data[key]
+            return 1
+        return 0
+
+
+def test_lock_release_only_deletes_own_lock():
+    """锁过期后被其他worker获取时，原持有者不会删除新锁"""
+    flight = SingleFlight("test", redis_url="")
+    flight.redis = FakeRedis()
+    lock_key = "singleflight:test:key:lock"
+
+    async def compute():
+        # 模拟锁过期并被其他worker重新获取
+        flight.redis.data[lock_key] = "other-worker"
+        return ["result"]
+
+    assert asyncio.run(flight.do("key", compute)) == ["result"]
+    assert flight.redis.data[lock_key] == "other-worker"
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+OCR拼写纠正测试 (词典基于仓库中的题库)
+运行: python -m pytest test_spell_corrector.py
+"""
+
+import os
+
+import pytest
+
+from spell_corrector import DEFAULT_CORPUS_FILE, SpellCorrector, load_spell_corrector
+
+
+@pytest.fixture(scope="module")
+def corrector():
+    corpus = os.path.join(os.path.dirname(os.path.abspath(__file__)), DEFAULT_CORPUS_FILE)
+    return load_spell_corrector(corpus)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Findtheequation ofthecurve", "Find the equation of the curve"),
+    ("Showthat the particle is in equilibrium", "Show that the particle is in equilibrium"),
+    ("Find the equatlon of the tangent", "Find the equation of the tangent"),
+    ("the probabllity that", "the probability that"),
+])
+def test_ocr_errors_are_corrected(corrector, text, expected):
+    assert corrector.correct_text(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "Integrate the function with respect to x.",
+    "Differentiate the expression and therefore find the gradient.",
+    "The inequality holds; determine something about it.",
+    "The speed is maintained.",
+    "Use the graph to estimate the value.",
+    "A company manufactures components, and records show that",
+    "Sketch the graph and state the range of values.",
+    "Verify that the point lies within the region.",
+    "Explain why the approximation is reasonable.",
+    "parallelogram ABCD",
+    "OABC",
+])
+def test_normal_prose_unchanged(corrector, text):
+    assert corrector.correct_text(text) == text
+
+
+def test_real_words_not_pruned(corrector):
+    for word in ("ofthe", "findtheequation", "thecurve"):
+        assert word not in corrector.words
+    for word in ("company", "within", "areas", "equation", "another"):
+        assert word in corrector.words
+
+
+def test_segment_rejects_fragments():
+    corrector = SpellCorrector(
+        {"there": 5, "fo": 3, "re": 3, "the": 9, "curve": 4},
+        bigram_counts={("there", "fo"): 1, ("fo", "re"): 1, ("the", "curve"): 2}
+    )
+    assert corrector.segment("therefore") is None
+    assert corrector.segment("thecurve") == ["the", "curve"]
+
+
+def test_ocr_error_explanations():
+    assert SpellCorrector.is_ocr_error("equaton", "equation")
+    assert SpellCorrector.is_ocr_error("modem", "modern")
+    assert not SpellCorrector.is_ocr_error("print", "point")
+    assert not SpellCorrector.is_ocr_error("impossible", "possible")
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+本地向量索引
+所有题目的L2归一化向量保存为 .npy 矩阵 (float32 / float16 / 按行缩放的int8)，旁边是题目ID表
+加载时使用内存映射，多个worker共享同一份页缓存，启动无需读入内存
+检索为一次矩阵-向量乘积 + argpartition取top-k，替代ES中逐文档执行的 script_score
+
+用法:
+    python vector_index.py [题库JSON] [输出目录] [float32|float16|int8]
+"""
+
+import os
+import sys
+import json
+import logging
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+VECTORS_FILE = "vectors.npy"
+SCALES_FILE = "scales.npy"   # int8索引的每行缩放系数
+IDS_FILE = "ids.json"
+
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+
+# float16/int8索引按块转换为float32后计算 (块较小时转换结果留在CPU缓存中)，避免每次查询复制整个矩阵
+SCORE_CHUNK_ROWS = 1024
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """按行缩放量化为int8: 每行最大绝对值映射到127，返回 (int8向量, 每行缩放系数)"""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.rint(vectors / scales[:, np.newaxis]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+class VectorIndex:
+    """内存映射的向量索引 (余弦相似度 = 归一化向量点积)"""
+
+    def __init__(self, vectors: np.ndarray, ids: List[str], scales: Optional[np.ndarray] = None):
+        if len(vectors) != len(ids):
+            raise ValueError(f"向量数 {len(vectors)} 与ID数 {len(ids)} 不一致")
+        if vectors.dtype == np.int8 and scales is None:
+            raise ValueError("int8向量索引缺少缩放系数")
+        self.vectors = vectors
+        self.scales = scales
+        self.ids = ids
+        self.id_to_row = {doc_id: row for row, doc_id in enumerate(ids)}
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        return self.vectors.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    @classmethod
+    def load(cls, index_dir: str) -> "VectorIndex":
+        """以只读内存映射方式加载索引"""
+        path = Path(index_dir)
+        vectors = np.load(path / VECTORS_FILE, mmap_mode="r")
+        scales = np.load(path / SCALES_FILE) if vectors.dtype == np.int8 else None
+        with open(path / IDS_FILE, "r", encoding="utf-8") as f:
+            ids = json.load(f)
+        logger.info(f"✅ 向量索引已加载: {len(ids)} 个向量, dim={vectors.shape[1]}, dtype={vectors.dtype}")
+        return cls(vectors, ids, scales)
+
+    @staticmethod
+    def save(index_dir: str, ids: List[str], vectors: np.ndarray, dtype: str = "float32"):
+        """保存索引 (向量先L2归一化)；先写临时文件再替换，正在读取的worker不受影响"""
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"不支持的向量类型: {dtype}")
+
+        path = Path(index_dir)
+        path.mkdir(parents=True, exist_ok=True)
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors = vectors / norms
+
+        files = {}
+        if dtype == "int8":
+            vectors, scales = quantize_int8(vectors)
+            files[SCALES_FILE] = scales
+        else:
+            vectors = vectors.astype(dtype)
+        files[VECTORS_FILE] = vectors
+
+        for name, array in files.items():
+            with open(path / f"{name}.tmp", "wb") as f:
+                np.save(f, array)
+        tmp_ids = path / f"{IDS_FILE}.tmp"
+        with open(tmp_ids, "w", encoding="utf-8") as f:
+            json.dump(list(ids), f, ensure_ascii=False)
+
+        # 缩放系数先于向量替换，避免读到新向量配旧系数
+        for name in files:
+            if name != VECTORS_FILE:
+                os.replace(path / f"{name}.tmp", path / name)
+        os.replace(path / f"{VECTORS_FILE}.tmp", path / VECTORS_FILE)
+        os.replace(tmp_ids, path / IDS_FILE)
+        if dtype != "int8" and (path / SCALES_FILE).exists():
+            (path / SCALES_FILE).unlink()
+
+        size = sum(array.nbytes for array in files.values())
+        logger.info(f"✅ 向量索引已保存: {path} ({len(ids)} 个向量, {size / 1024 / 1024:.2f} MB, {dtype})")
+
+    def scores(self, query_vector: np.ndarray) -> np.ndarray:
+        """查询向量与所有题目的余弦相似度"""
+        query = np.asarray(query_vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        if self.vectors.dtype == np.float32:
+            return self.vectors @ query
+
+        result = np.empty(len(self.ids), dtype=np.float32)
+        for start in range(0, len(self.ids), SCORE_CHUNK_ROWS):
+            chunk = np.asarray(self.vectors[start:start + SCORE_CHUNK_ROWS], dtype=np.float32)
+            result[start:start + len(chunk)] = chunk @ query
+        if self.scales is not None:
+            result *= self.scales
+        return result
+
+    def get_vectors(self, rows: List[int]) -> np.ndarray:
+        """按行读取float32向量 (int8索引会反量化)"""
+        vectors = np.asarray(self.vectors[rows], dtype=np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[rows][:, np.newaxis]
+        return vectors
+
+    def search(
+        self,
+        query_vector: np.ndarray,
+        k: int = 10,
+        mask: Optional[np.ndarray] = None
+    ) -> List[Tuple[str, float]]:
+        """top-k最相似题目，返回 [(题目ID, 余弦相似度)]，按相似度降序
+
+        mask: 可选的布尔数组，只在为True的行中检索
+        """
+        scores = self.scores(query_vector)
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.ids[i], float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+
+def load_vector_index(index_dir: str = None) -> Optional[VectorIndex]:
+    """按 VECTOR_INDEX_PATH 加载向量索引，未配置或文件不存在时返回None"""
+    index_dir = index_dir or os.getenv("VECTOR_INDEX_PATH", "")
+    if not index_dir:
+        return None
+    if not (Path(index_dir) / VECTORS_FILE).exists():
+        logger.warning(f"⚠️  向量索引不存在: {index_dir}")
+        return None
+    try:
+        return VectorIndex.load(index_dir)
+    except Exception as e:
+        logger.warning(f"⚠️  向量索引加载失败: {e}")
+        return None
+
+
+def build_from_corpus(corpus_file: str, index_dir: str, dtype: str = "float32"):
+    """用当前向量模型编码题库，生成向量索引"""
+    from embedding_backend import load_embedding_model
+
+    with open(corpus_file, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+
+    model = load_embedding_model()
+    logger.info(f"🔨 编码 {len(questions)} 个题目...")
+    vectors = model.encode([q["content"] for q in questions], batch_size=64)
+    VectorIndex.save(index_dir, [q["id"] for q in questions], vectors, dtype)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    corpus = sys.argv[1] if len(sys.argv) > 1 else "caie_math_questions.json"
+    output = sys.argv[2] if len(sys.argv) > 2 else "vector_index"
+    build_from_corpus(corpus, output, sys.argv[3] if len(sys.argv) > 3 else "float32")